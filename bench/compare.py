@@ -0,0 +1,59 @@
+"""
+Сравнение двух прогонов bench.run: изменение пропускной способности, задержек и памяти по уровням
+
+    python -m bench.compare bench/results/before.json bench/results/after.json
+"""
+import sys
+import json
+import argparse
+from typing import Dict, Any, List, Optional
+
+
+def load(path: str) -> Dict[int, Dict[str, Any]]:
+    with open(path, encoding="utf-8") as file:
+        results = json.load(file)
+    return {level["concurrency"]: level for level in results["levels"]}
+
+
+def change(before: Optional[float], after: Optional[float]) -> str:
+    if before is None or after is None:
+        return "n/a"
+    if not before:
+        return f"{after:.3f}"
+    return f"{before:.3f} -> {after:.3f} ({(after - before) / before * 100:+.1f}%)"
+
+
+def compare_level(before: Dict[str, Any], after: Dict[str, Any], stages: bool) -> List[str]:
+    lines = [
+        f"  generations/s  {change(before['generations_per_s'], after['generations_per_s'])}",
+        f"  failed         {before['failed']} -> {after['failed']}",
+        f"  peak RSS, MB   {change(before['peak_rss_mb'], after['peak_rss_mb'])}",
+    ]
+    for p in ("p50", "p95", "p99"):
+        lines.append(f"  e2e {p}, s     {change(before['e2e_s'].get(p), after['e2e_s'].get(p))}")
+    if stages:
+        for stage in sorted(set(before["stages_s"]) | set(after["stages_s"])):
+            old = before["stages_s"].get(stage, {})
+            new = after["stages_s"].get(stage, {})
+            lines.append(f"  {stage} p95, s  {change(old.get('p95'), new.get('p95'))}")
+    return lines
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--stages", action="store_true", help="Also compare p95 of every stage")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    common = sorted(set(before) & set(after))
+    if not common:
+        sys.exit("No common concurrency levels in the two files")
+    for concurrency in common:
+        print(f"concurrency={concurrency}")
+        print("\n".join(compare_level(before[concurrency], after[concurrency], args.stages)))
+
+
+if __name__ == "__main__":
+    main()
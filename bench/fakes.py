@@ -0,0 +1,352 @@
+"""
+Локальные заменители внешних сервисов для нагрузочного теста: Telegram Bot API, fal-ai и Google Sheets
+Задержки задаются распределениями, чтобы воспроизводить хвосты реальных сервисов
+"""
+import io
+import math
+import time
+import types
+import random
+import asyncio
+import itertools
+from datetime import datetime
+from typing import Optional, Dict, Any, List, AsyncGenerator
+
+from aiohttp import web
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetFile, SendMessage, SendPhoto, SendMediaGroup
+from aiogram.types import Chat, File, Message, PhotoSize
+from PIL import Image
+
+
+class LatencyDistribution:
+    """
+    Распределение задержки в секундах, задается строкой:
+    const:0.5, uniform:0.2,1.0, lognormal:8,0.3 (медиана и sigma), exp:2 (среднее)
+    """
+
+    def __init__(self, spec: str, rng: Optional[random.Random] = None):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(value) for value in params.split(",") if value]
+        self._rng = rng or random.Random(0)
+        if kind not in ("const", "uniform", "lognormal", "exp"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "const":
+            return self.params[0]
+        if self.kind == "uniform":
+            return self._rng.uniform(self.params[0], self.params[1])
+        if self.kind == "lognormal":
+            median, sigma = self.params
+            return self._rng.lognormvariate(math.log(median), sigma)
+        return self._rng.expovariate(1 / self.params[0])
+
+    async def wait(self) -> None:
+        delay = self.sample()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def __repr__(self) -> str:
+        return self.spec
+
+
+def make_jpeg(width: int = 768, height: int = 1024) -> bytes:
+    """Фото-заготовка, которое проходит валидацию бота"""
+    image = Image.new("RGB", (width, height))
+    image.putdata([((x * 7) % 256, (y * 3) % 256, (x + y) % 256)
+                   for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def make_png(width: int = 768, height: int = 1024) -> bytes:
+    """Результат примерки: PNG, как у fal-ai"""
+    image = Image.new("RGB", (width, height), (180, 160, 140))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def unique_jpeg(base: bytes, tag: str) -> bytes:
+    """Та же картинка с другим содержимым файла: COM-сегмент сразу после SOI меняет хэш"""
+    comment = tag.encode("utf-8")
+    return base[:2] + b"\xff\xfe" + (len(comment) + 2).to_bytes(2, "big") + comment + base[2:]
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Bot API без сети: отвечает на методы, которые использует бот, и отдает фото пользователей
+
+    Отправленные результаты (sendPhoto, sendMediaGroup) отмечаются временем, по нему считается
+    задержка от фото одежды до результата.
+    """
+
+    def __init__(self, latency: LatencyDistribution):
+        super().__init__()
+        self.latency = latency
+        self.files: Dict[str, bytes] = {}
+        self.calls: Dict[str, int] = {}
+        self._message_ids = itertools.count(1)
+        # chat_id -> future первого результата после expect_result()
+        self._waiting: Dict[int, asyncio.Future] = {}
+
+    def add_file(self, file_id: str, data: bytes) -> None:
+        self.files[file_id] = data
+
+    def expect_result(self, chat_id: int) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[chat_id] = future
+        return future
+
+    def _delivered(self, chat_id: int) -> None:
+        future = self._waiting.pop(chat_id, None)
+        if future and not future.done():
+            future.set_result(time.perf_counter())
+
+    def _message(self, chat_id: int, **fields) -> Message:
+        return Message(message_id=next(self._message_ids), date=datetime.now(),
+                       chat=Chat(id=chat_id, type="private"), **fields)
+
+    def _photo_message(self, chat_id: int) -> Message:
+        message_id = next(self._message_ids)
+        photo = PhotoSize(file_id=f"sent-{message_id}", file_unique_id=f"sent-u-{message_id}",
+                          width=768, height=1024)
+        return Message(message_id=message_id, date=datetime.now(), chat=Chat(id=chat_id, type="private"),
+                       photo=[photo])
+
+    async def make_request(self, bot, method, timeout: Optional[int] = None):
+        name = type(method).__name__
+        self.calls[name] = self.calls.get(name, 0) + 1
+        await self.latency.wait()
+
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=f"u-{method.file_id}",
+                        file_size=len(self.files[method.file_id]), file_path=f"photos/{method.file_id}.jpg")
+        if isinstance(method, SendPhoto):
+            message = self._photo_message(method.chat_id)
+            self._delivered(method.chat_id)
+            return message
+        if isinstance(method, SendMediaGroup):
+            messages = [self._photo_message(method.chat_id) for _ in method.media]
+            self._delivered(method.chat_id)
+            return messages
+        if isinstance(method, SendMessage):
+            # Результат, который не удалось отправить фото, приходит ссылкой
+            if method.text and "https://" in method.text and method.chat_id in self._waiting:
+                self._delivered(method.chat_id)
+            return self._message(method.chat_id, text=method.text)
+        # editMessageText, deleteMessage, answerCallbackQuery и остальные
+        return True
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        await self.latency.wait()
+        file_id = url.rsplit("/", 1)[-1].removesuffix(".jpg")
+        data = self.files[file_id]
+        for offset in range(0, len(data), chunk_size):
+            yield data[offset:offset + chunk_size]
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeFalError(Exception):
+    """Временный сбой fal-ai (повторяется политикой устойчивости)"""
+
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class FakeFal:
+    """
+    Очередь fal-ai: capacity одновременных генераций, остальные ждут с позицией в очереди
+
+    Результаты отдает локальный HTTP-сервер (ResultServer), чтобы отправка результата
+    проходила весь путь: скачивание, пережатие и загрузку в Telegram.
+    """
+
+    def __init__(self, upload_latency: LatencyDistribution, inference_latency: Dict[str, LatencyDistribution],
+                 capacity: int, error_rate: float, result_base_url: str, seed: int = 0):
+        self.upload_latency = upload_latency
+        self.inference_latency = inference_latency
+        self.error_rate = error_rate
+        self.result_base_url = result_base_url
+        self._rng = random.Random(seed)
+        self._capacity = asyncio.Semaphore(capacity)
+        self._waiting = 0
+        self._ids = itertools.count(1)
+        self.counters = {"uploads": 0, "submitted": 0, "completed": 0, "failed": 0, "cancelled": 0}
+
+    def module(self) -> types.ModuleType:
+        """Модуль с интерфейсом fal_client, который подставляется в sys.modules"""
+        fake = self
+
+        class Queued:
+            def __init__(self, position: int):
+                self.position = position
+
+        class InProgress:
+            logs = None
+
+        class Completed:
+            logs = None
+            metrics = None
+
+        class Handle:
+            def __init__(self, request_id: str, arguments: Dict[str, Any]):
+                self.request_id = request_id
+                self.arguments = arguments
+                self._result = None
+
+            async def iter_events(self, with_logs: bool = False, interval: float = 0.1):
+                fake._waiting += 1
+                try:
+                    if fake._capacity.locked():
+                        yield Queued(fake._waiting)
+                    await fake._capacity.acquire()
+                finally:
+                    fake._waiting -= 1
+                try:
+                    yield InProgress()
+                    mode = self.arguments.get("mode", "quality")
+                    await fake.inference_latency.get(mode, fake.inference_latency["quality"]).wait()
+                    if fake._rng.random() < fake.error_rate:
+                        fake.counters["failed"] += 1
+                        raise FakeFalError(f"fal request {self.request_id} failed")
+                finally:
+                    fake._capacity.release()
+                self._result = {"images": [
+                    {"url": f"{fake.result_base_url}/{self.request_id}/{index}.png"}
+                    for index in range(self.arguments.get("num_samples", 1))
+                ]}
+                fake.counters["completed"] += 1
+                yield Completed()
+
+            async def get(self):
+                return self._result
+
+            async def cancel(self):
+                fake.counters["cancelled"] += 1
+
+        async def upload_async(data: bytes, content_type: str, file_name: str) -> str:
+            fake.counters["uploads"] += 1
+            await fake.upload_latency.wait()
+            return f"https://fal.bench/files/{next(fake._ids)}/{file_name}"
+
+        async def submit_async(application: str, arguments: Dict[str, Any]):
+            fake.counters["submitted"] += 1
+            return Handle(f"req-{next(fake._ids)}", arguments)
+
+        module = types.ModuleType("fal_client")
+        module.Queued, module.InProgress, module.Completed = Queued, InProgress, Completed
+        module.upload_async = upload_async
+        module.submit_async = submit_async
+        return module
+
+
+class ResultServer:
+    """Отдает PNG результата по любому пути - вместо хранилища результатов fal-ai"""
+
+    def __init__(self, latency: LatencyDistribution):
+        self.latency = latency
+        self.image = make_png()
+        self._runner: Optional[web.AppRunner] = None
+        self.base_url = ""
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        await self.latency.wait()
+        return web.Response(body=self.image, content_type="image/png")
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host="127.0.0.1", port=0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}/results"
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class FakeWorksheet:
+    """Лист Google Sheets в памяти; вызовы блокируют поток, как gspread"""
+
+    def __init__(self, latency: LatencyDistribution, header: List[str], calls: Dict[str, int]):
+        self.latency = latency
+        self.rows: List[List[Any]] = [header]
+        self.calls = calls
+
+    def _call(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        delay = self.latency.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+    def get_all_values(self) -> List[List[str]]:
+        self._call("get_all_values")
+        return [[str(value) for value in row] for row in self.rows]
+
+    def col_values(self, column: int) -> List[str]:
+        self._call("col_values")
+        return [str(row[column - 1]) if len(row) >= column else "" for row in self.rows]
+
+    def find(self, query: str, in_column: Optional[int] = None):
+        self._call("find")
+        return None
+
+    def append_row(self, values: List[Any], **kwargs) -> Dict[str, Any]:
+        self._call("append_row")
+        self.rows.append(list(values))
+        row = len(self.rows)
+        return {"updates": {"updatedRange": f"Sheet1!A{row}:F{row}"}}
+
+    def append_rows(self, rows: List[List[Any]], **kwargs) -> Dict[str, Any]:
+        self._call("append_rows")
+        first = len(self.rows) + 1
+        self.rows.extend(list(row) for row in rows)
+        return {"updates": {"updatedRange": f"Sheet1!A{first}:F{len(self.rows)}", "updatedRows": len(rows)}}
+
+    def batch_update(self, data: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        self._call("batch_update")
+        return {"totalUpdatedCells": len(data)}
+
+    def update(self, *args, **kwargs) -> Dict[str, Any]:
+        self._call("update")
+        return {}
+
+
+class FakeSpreadsheet:
+    """Таблица с одним листом: sheet1 и get_worksheet(0), как у gspread.Spreadsheet"""
+
+    def __init__(self, worksheet: FakeWorksheet):
+        self.sheet1 = worksheet
+
+    def get_worksheet(self, index: int) -> FakeWorksheet:
+        return self.sheet1
+
+
+class FakeGspreadClient:
+    """Заменяет клиент gspread.service_account(): таблицы пользователей и аналитики в памяти"""
+
+    USERS_HEADER = ["user_id", "username", "first_name", "last_name", "last_activity", "tokens"]
+    ANALYTICS_HEADER = ["id", "user_id", "person_url", "garment_url", "result_url", "timestamp"]
+
+    def __init__(self, latency: LatencyDistribution):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        self._sheets: Dict[str, FakeSpreadsheet] = {}
+
+    def open_by_key(self, key: str):
+        if key not in self._sheets:
+            header = self.ANALYTICS_HEADER if "analytics" in key else self.USERS_HEADER
+            self._sheets[key] = FakeSpreadsheet(FakeWorksheet(self.latency, header, self.calls))
+        return self._sheets[key]
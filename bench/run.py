@@ -0,0 +1,300 @@
+"""
+Нагрузочный тест бота: синтетические пользователи проходят сценарий примерки через настоящие
+create_router и Container, внешние сервисы заменены локальными (bench/fakes.py)
+
+    python -m bench.run --concurrency 1,8,32 --sessions 3 --inference-latency lognormal:8,0.3
+
+Результат - JSON с p50/p95/p99 по стадиям, задержкой до результата, генерациями в секунду
+и пиковым RSS для каждого уровня параллельности; два файла сравниваются через bench.compare.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import Dict, List, Any, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end load test with local fakes")
+    parser.add_argument("--concurrency", default="1,4,16",
+                        help="Comma-separated numbers of simultaneous users, one run per level")
+    parser.add_argument("--sessions", type=int, default=3, help="Try-on sessions per user")
+    parser.add_argument("--telegram-latency", default="lognormal:0.05,0.4", help="Bot API call latency")
+    parser.add_argument("--upload-latency", default="lognormal:0.3,0.4", help="fal upload latency")
+    parser.add_argument("--inference-latency", default="lognormal:10,0.3",
+                        help="fal inference latency for mode=quality")
+    parser.add_argument("--preview-latency", default="lognormal:4,0.3",
+                        help="fal inference latency for mode=performance")
+    parser.add_argument("--result-latency", default="lognormal:0.2,0.4", help="Result image download latency")
+    parser.add_argument("--sheets-latency", default="lognormal:0.4,0.3", help="Google Sheets call latency")
+    parser.add_argument("--fal-capacity", type=int, default=8, help="Generations fal runs at once")
+    parser.add_argument("--fal-error-rate", type=float, default=0.0, help="Share of failing fal generations")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Bot setting override, e.g. --env GENERATION_WORKERS=8")
+    parser.add_argument("--output", help="Results file (default bench/results/<time>_<commit>.json)")
+    return parser.parse_args(argv)
+
+
+def prepare_environment(args: argparse.Namespace, workdir: str) -> Dict[str, str]:
+    """
+    Настройки бота для прогона: все файлы во временном каталоге, без лимитов частоты
+    и эндпоинта метрик. Настройки читаются при импорте, поэтому вызывается до импорта модулей бота.
+    """
+    env = {
+        "BOT_TOKEN": "42:BENCH",
+        "LLM_API_KEY": "bench",
+        "LLM_MODEL": "fal-ai/fashn/tryon/v1.6",
+        "GOOGLE_CREDENTIALS_FILE": "bench.json",
+        "USERS_SHEET_ID": "bench-users",
+        "ANALYTICS_SHEET_ID": "bench-analytics",
+        "FSM_STORAGE": "memory",
+        "SQLITE_PATH": os.path.join(workdir, "bot.db"),
+        "TEMP_DIR": os.path.join(workdir, "temp"),
+        "CACHE_DIR": os.path.join(workdir, "cache"),
+        "METRICS_PORT": "0",
+        "FAL_POLL_INTERVAL": "0.05",
+        # Нагрузка задается числом пользователей, а не отбрасывается лимитами
+        "THROTTLE_PHOTO_RATE": "1000", "THROTTLE_PHOTO_BURST": "1000",
+        "THROTTLE_COMMAND_RATE": "1000", "THROTTLE_COMMAND_BURST": "1000",
+        "THROTTLE_GLOBAL_PHOTO_RATE": "100000", "THROTTLE_GLOBAL_PHOTO_BURST": "100000",
+        "THROTTLE_GLOBAL_COMMAND_RATE": "100000", "THROTTLE_GLOBAL_COMMAND_BURST": "100000",
+        "GENERATION_QUEUE_MAX": "10000",
+        "LOG_LEVEL": "WARNING",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    os.environ.update(env)
+    return env
+
+
+def percentiles(samples: List[float]) -> Dict[str, Any]:
+    """p50/p95/p99 (ближайший ранг), среднее и максимум в секундах"""
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "p50": rank(50), "p95": rank(95), "p99": rank(99),
+        "mean": sum(ordered) / len(ordered), "max": ordered[-1]
+    }
+
+
+def current_rss_mb() -> float:
+    """Текущий RSS процесса; без /proc - пиковый из getrusage"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class RssSampler:
+    """Пиковый RSS за уровень: ru_maxrss монотонен за весь процесс, поэтому RSS опрашивается"""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.peak = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _loop(self) -> None:
+        while True:
+            self.peak = max(self.peak, current_rss_mb())
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        self.peak = current_rss_mb()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> float:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        return max(self.peak, current_rss_mb())
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_level(args: argparse.Namespace, concurrency: int, level_index: int, fakes) -> Dict[str, Any]:
+    """Один прогон: concurrency пользователей по args.sessions примерок, свежие Container и Dispatcher"""
+    import gspread
+    from aiogram import Bot, Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from aiogram.types import Update, Message, Chat, User, PhotoSize
+    from bench.fakes import LatencyDistribution, FakeTelegramSession, FakeFal, FakeGspreadClient, unique_jpeg
+    from container import Container
+    from bot.handlers.image_handler import create_router
+    from utils.metrics import metrics
+
+    seed = args.seed + level_index
+    telegram = FakeTelegramSession(LatencyDistribution(args.telegram_latency, fakes["rng"](seed)))
+    sheets = FakeGspreadClient(LatencyDistribution(args.sheets_latency, fakes["rng"](seed + 1)))
+    fal = FakeFal(
+        LatencyDistribution(args.upload_latency, fakes["rng"](seed + 2)),
+        {
+            "quality": LatencyDistribution(args.inference_latency, fakes["rng"](seed + 3)),
+            "performance": LatencyDistribution(args.preview_latency, fakes["rng"](seed + 4)),
+        },
+        args.fal_capacity, args.fal_error_rate, fakes["result_server"].base_url, seed
+    )
+    sys.modules["fal_client"] = fal.module()
+    gspread.service_account = lambda *a, **kw: sheets
+
+    # Сырые замеры стадий вместо корзин гистограммы - для точных перцентилей
+    stage_samples: Dict[str, List[float]] = {}
+    stage_errors: Dict[str, int] = {}
+    observe = type(metrics.stage_seconds).observe.__get__(metrics.stage_seconds)
+
+    def record(value: float, **labels: str) -> None:
+        observe(value, **labels)
+        if labels["outcome"] == "ok":
+            stage_samples.setdefault(labels["stage"], []).append(value)
+        else:
+            stage_errors[labels["stage"]] = stage_errors.get(labels["stage"], 0) + 1
+
+    metrics.stage_seconds.observe = record
+
+    container = Container()
+    await container.initialize()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=telegram)
+    bot.container = container
+    dp = Dispatcher(storage=MemoryStorage())
+    dp.include_router(create_router(container))
+
+    update_ids = iter(range(1, 10 ** 9))
+    message_ids = iter(range(1, 10 ** 9))
+
+    def update(user_id: int, **fields) -> Update:
+        message = Message(message_id=next(message_ids), date=datetime.now(), chat=Chat(id=user_id, type="private"),
+                          from_user=User(id=user_id, is_bot=False, first_name=f"bench{user_id}"), **fields)
+        return Update(update_id=next(update_ids), message=message)
+
+    def photo_update(user_id: int, tag: str) -> Update:
+        file_id = f"{tag}-{user_id}"
+        telegram.add_file(file_id, unique_jpeg(fakes["photo"], file_id))
+        size = PhotoSize(file_id=file_id, file_unique_id=f"u-{file_id}", width=768, height=1024,
+                         file_size=len(telegram.files[file_id]))
+        return update(user_id, photo=[size])
+
+    e2e: List[float] = []
+    failures = 0
+
+    async def user(user_id: int) -> None:
+        nonlocal failures
+        await dp.feed_update(bot, update(user_id, text="/start"))
+        for session in range(args.sessions):
+            await dp.feed_update(bot, photo_update(user_id, f"person{session}"))
+            delivered = telegram.expect_result(user_id)
+            started = time.perf_counter()
+            await dp.feed_update(bot, photo_update(user_id, f"garment{session}"))
+            if delivered.done():
+                e2e.append(delivered.result() - started)
+            else:
+                delivered.cancel()
+                failures += 1
+
+    sampler = RssSampler()
+    sampler.start()
+    started = time.perf_counter()
+    base_user = (level_index + 1) * 1_000_000
+    await asyncio.gather(*(user(base_user + index) for index in range(concurrency)))
+    wall = time.perf_counter() - started
+    peak_rss = await sampler.stop()
+
+    queue_stats = container.generation_queue.get_stats()
+    await container.shutdown()
+    metrics.stage_seconds.observe = observe
+
+    generations = len(e2e)
+    return {
+        "concurrency": concurrency,
+        "users": concurrency,
+        "sessions": concurrency * args.sessions,
+        "generations": generations,
+        "failed": failures,
+        "wall_s": wall,
+        "generations_per_s": generations / wall if wall else 0.0,
+        "e2e_s": percentiles(e2e),
+        "stages_s": {stage: percentiles(samples) for stage, samples in sorted(stage_samples.items())},
+        "stage_errors": stage_errors,
+        "peak_rss_mb": peak_rss,
+        "peak_rss_children_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "queue": {key: value for key, value in queue_stats.items() if not isinstance(value, dict)},
+        "calls": {"telegram": telegram.calls, "fal": fal.counters, "sheets": sheets.calls},
+    }
+
+
+async def run(args: argparse.Namespace, env: Dict[str, str]) -> Dict[str, Any]:
+    import random
+    from bench.fakes import LatencyDistribution, ResultServer, make_jpeg
+
+    result_server = ResultServer(LatencyDistribution(args.result_latency, random.Random(args.seed)))
+    await result_server.start()
+    fakes = {"photo": make_jpeg(), "result_server": result_server, "rng": random.Random}
+    levels = []
+    try:
+        for index, concurrency in enumerate(int(level) for level in args.concurrency.split(",")):
+            level = await run_level(args, concurrency, index, fakes)
+            levels.append(level)
+            e2e = level["e2e_s"]
+            print(f"concurrency={concurrency}: {level['generations']} generations in {level['wall_s']:.1f}s "
+                  f"({level['generations_per_s']:.2f}/s), e2e p50={e2e.get('p50', 0):.2f}s "
+                  f"p95={e2e.get('p95', 0):.2f}s p99={e2e.get('p99', 0):.2f}s, "
+                  f"failed={level['failed']}, peak RSS {level['peak_rss_mb']:.0f} MB")
+    finally:
+        await result_server.stop()
+
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": {key: value for key, value in vars(args).items() if key != "output"},
+            "env": {key: value for key, value in env.items() if key != "BOT_TOKEN"},
+        },
+        "levels": levels,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    env = prepare_environment(args, workdir)
+    # Логи и файлы бота - во временном каталоге, модули бота - из репозитория
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    results = asyncio.run(run(args, env))
+
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(REPO_ROOT, "bench", "results", f"{stamp}_{results['meta']['commit'] or 'nogit'}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(results, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
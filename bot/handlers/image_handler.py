@@ -2,147 +2,622 @@
 Обработчик изображений для Telegram бота - реализация с Dependency Injection и правильной регистрацией handler'ов
 """
 
-import os
 import asyncio
+import uuid
+from typing import Optional, List
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
 from llm.clients.fal_client import FalClient
-from image.validators.image_validator import validate_image
+from llm.providers.base import (
+    STAGE_UPLOADING, STAGE_QUEUED, STAGE_IN_PROGRESS, STAGE_DONE, MODE_PERFORMANCE, MODE_QUALITY
+)
+from services.generation_queue import QueueFullError, DuplicateJobError
+from image.validators.image_validator import validate_photo
+from image.photo_buffer import PhotoBuffer
 from config.settings import settings
 from utils.logger import logger
+from utils.metrics import metrics
 from bot.text import MESSAGES, PROMPTS
+from bot.middlewares.tracing import TracingMiddleware
 
 class ImageProcessing(StatesGroup):
     """Состояния для обработки изображений"""
     waiting_first_image = State()
     waiting_second_image = State()
 
-async def send_typing_periodically(bot, chat_id: int, duration: int = 30):
-    """Отправляет typing action каждые 5 секунд"""
-    for _ in range(duration // 5):
-        await bot.send_chat_action(chat_id=chat_id, action="typing")
-        await asyncio.sleep(5)
+class ProgressMessage:
+    """Одно сообщение о ходе примерки, которое редактируется при смене стадии"""
 
-async def save_photo(message: Message) -> str:
-    """Сохраняет фото из сообщения, возвращает путь к файлу"""
+    def __init__(self, bot, chat_id: int, message_id: int, text: str):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+
+    async def update(self, text: str):
+        """Редактирует сообщение, только если текст изменился"""
+        if text == self.text:
+            return
+        self.text = text
+        try:
+            await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+        except TelegramBadRequest as e:
+            logger.warning(f"Failed to update progress message: {e}")
+
+    async def on_queue(self, position: int, eta: float):
+        """Позиция в очереди бота; позиция 0 - генерация началась"""
+        await self.update(MESSAGES["queue_position"].format(position=position, eta=round(eta))
+                          if position else MESSAGES["processing"])
+
+    async def on_progress(self, stage: str, position: Optional[int]):
+        """Стадия генерации в fal-ai"""
+        if stage == STAGE_QUEUED:
+            await self.update(MESSAGES["progress_queued"].format(position=(position or 0) + 1))
+        elif stage in PROGRESS_MESSAGES:
+            await self.update(MESSAGES[PROGRESS_MESSAGES[stage]])
+
+    async def delete(self):
+        try:
+            await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+        except TelegramBadRequest:
+            pass
+
+# Тексты стадий генерации
+PROGRESS_MESSAGES = {
+    STAGE_UPLOADING: "progress_uploading",
+    STAGE_IN_PROGRESS: "progress_in_progress",
+    STAGE_DONE: "progress_done"
+}
+
+# Кнопка финального рендера: "quality:<id предложения>"
+QUALITY_CALLBACK_PREFIX = "quality:"
+# Сколько последних предпросмотров можно довести до финального рендера (не меньше альбома результатов)
+QUALITY_OFFERS_MAX = 10
+
+def quality_button(offer_id: str, text: Optional[str] = None) -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text or MESSAGES["quality_button"],
+                                callback_data=f"{QUALITY_CALLBACK_PREFIX}{offer_id}")
+
+def quality_keyboard(offer_id: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[[quality_button(offer_id)]])
+
+def make_quality_offer(result_data: dict, person: PhotoBuffer, garment: PhotoBuffer) -> dict:
+    """Фото уже загружены в fal-ai: финальный рендер переиспользует их URL"""
+    return {
+        "person_url": result_data['person_url'],
+        "garment_url": result_data['garment_url'],
+        "person_file_id": person.file_id,
+        "person_file_unique_id": person.file_unique_id,
+        "person_hash": person.content_hash,
+        "garment_file_id": garment.file_id,
+        "garment_file_unique_id": garment.file_unique_id,
+        "garment_hash": garment.content_hash
+    }
+
+async def save_quality_offer(state: FSMContext, offer_id: str, offer: dict):
+    """Запоминает в FSM загруженные в fal-ai фото предпросмотра для финального рендера"""
+    data = await state.get_data()
+    offers = dict(data.get("quality_offers", {}))
+    offers[offer_id] = offer
+    # dict сохраняет порядок вставки - отбрасываем самые старые предложения
+    while len(offers) > QUALITY_OFFERS_MAX:
+        offers.pop(next(iter(offers)))
+    await state.update_data(quality_offers=offers)
+
+async def pop_quality_offer(state: FSMContext, offer_id: str) -> Optional[dict]:
+    data = await state.get_data()
+    offers = dict(data.get("quality_offers", {}))
+    offer = offers.pop(offer_id, None)
+    if offer:
+        await state.update_data(quality_offers=offers)
+    return offer
+
+async def restore_quality_offer(state: FSMContext, message: Message, offer_id: str, offer: dict,
+                                markup: Optional[InlineKeyboardMarkup]):
+    """Возвращает предложение и кнопки, если финальный рендер не состоялся"""
+    await save_quality_offer(state, offer_id, offer)
+    try:
+        await message.edit_reply_markup(reply_markup=markup or quality_keyboard(offer_id))
+    except TelegramBadRequest:
+        pass
+
+def without_button(markup: Optional[InlineKeyboardMarkup], callback_data: str) -> Optional[InlineKeyboardMarkup]:
+    """Клавиатура без нажатой кнопки; None, если кнопок не осталось"""
+    if markup is None:
+        return None
+    rows = [[button for button in row if button.callback_data != callback_data] for row in markup.inline_keyboard]
+    rows = [row for row in rows if row]
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+async def settle_tokens(token_service, reservation, result_data: dict) -> int:
+    """
+    Одна операция в конце: результат из кэша не стоит генерации -
+    токены списываем только по настройке. Возвращает остаток токенов
+    """
+    remaining = reservation.remaining
+    if not result_data.get('cached') or settings.result_cache_charge_hits:
+        await token_service.commit(reservation)
+    elif await token_service.refund(reservation):
+        remaining += reservation.amount
+    return remaining
+
+async def deliver_result(message: Message, container, result_url: str, caption: str, reply_markup=None):
+    """Результат отправляем фотографией; если не удалось - ссылкой, как раньше"""
+    sent = await container.result_delivery.send(message.bot, message.chat.id, result_url,
+                                                 caption=caption, reply_markup=reply_markup)
+    if not sent:
+        await message.answer(f"{caption}: {result_url}", reply_markup=reply_markup)
+
+async def finish_session(message: Message, state: FSMContext, token_service, remaining: int):
+    """Показывает остаток токенов и начинает новую сессию, если токены остались"""
+    await message.answer(token_service.format_tokens_message(remaining))
+    if remaining > 0:
+        await asyncio.sleep(2)
+        await message.answer(MESSAGES["ask_photo_person"])
+        await state.set_state(ImageProcessing.waiting_first_image)
+    else:
+        # Кнопки финального рендера под предпросмотрами продолжают работать после пополнения токенов
+        offers = (await state.get_data()).get("quality_offers")
+        await state.clear()
+        if offers:
+            await state.update_data(quality_offers=offers)
+
+async def fail_session(message: Message, state: FSMContext, token_service):
+    """Сообщает об ошибке генерации и возвращает пользователя к фото человека"""
+    if message.bot.container.fal_client.is_degraded:
+        await message.answer(MESSAGES["service_degraded"])
+    else:
+        await message.answer("Προέκυψε σφάλμα κατά την επεξεργασία των εικόνων")
+    tokens_message = await token_service.get_tokens_message(message.from_user.id)
+    await message.answer(tokens_message)
+    await asyncio.sleep(1)
+    await message.answer(MESSAGES["ask_photo_person"])
+    await state.set_state(ImageProcessing.waiting_first_image)
+
+async def save_photo(message: Message, container) -> Optional[PhotoBuffer]:
+    """Загружает фото из сообщения в память"""
+    photo = message.photo[-1]  # Берем фото максимального качества
+    return await load_photo(message.bot, photo.file_id, photo.file_unique_id, message.from_user.id, container)
+
+async def load_photo(bot, file_id: str, file_unique_id: str, user_id: int, container) -> Optional[PhotoBuffer]:
+    """Загружает фото по file_id Telegram в PhotoBuffer; на диск попадают только большие фото"""
+    image_cache = container.image_cache
     try:
-        photo = message.photo[-1]  # Берем фото максимального качества
-        file_info = await message.bot.get_file(photo.file_id)
-        # Создаем путь для сохранения
-        file_path = os.path.join(settings.temp_dir, f"{photo.file_id}.jpg")
-        os.makedirs(settings.temp_dir, exist_ok=True)
-        # Скачиваем файл
-        await message.bot.download_file(file_info.file_path, file_path)
-        logger.info(f"Photo saved: {file_path}")
-        return file_path
+        # Повторно отправленное фото уже загружено в fal-ai - не скачиваем
+        if image_cache:
+            content_hash = image_cache.lookup(file_unique_id)
+            if content_hash:
+                logger.info(f"Photo download skipped, content known: {content_hash}")
+                return PhotoBuffer.from_cache(bot, file_id, file_unique_id, content_hash,
+                                              container.file_manager, user_id)
+
+        with metrics.stage("telegram_download"):
+            photo = await PhotoBuffer(file_id, file_unique_id, container.file_manager, user_id).download(bot)
+        if image_cache:
+            image_cache.remember(file_unique_id, photo.content_hash)
+        return photo
     except Exception as e:
-        logger.error(f"Failed to save photo: {e}")
+        logger.error(f"Failed to load photo: {e}")
+        return None
+
+async def check_photo(photo: PhotoBuffer) -> bool:
+    """Валидирует фото из буфера; фото из кэша уже проверялось при первой загрузке"""
+    if not photo.is_loaded:
+        return True
+    with metrics.stage("validation") as timer:
+        if await validate_photo(photo) is None:
+            timer.fail()
+            return False
+    return True
+
+async def restore_session_photo(bot, user_id: int, data: dict, container) -> Optional[PhotoBuffer]:
+    """
+    Возвращает фото человека из текущей сессии
+
+    Сессию мог начать другой процесс бота: если фото нет в памяти этого процесса,
+    оно заново загружается по сохраненному file_id.
+    """
+    photo = container.photo_store.get(user_id)
+    if photo:
+        return photo
+    if not data.get("human_file_id"):
         return None
+    logger.info("Person photo not found in this process, restoring it by file_id")
+    photo = await load_photo(bot, data["human_file_id"], data["human_file_unique_id"], user_id, container)
+    if photo:
+        container.photo_store.put(user_id, photo)
+    return photo
 
 def create_router(container):
     """Создает router с внедренными зависимостями и регистрирует handler'ы"""
     router = Router()
+    # outer middleware срабатывают до фильтров и handler'ов: сначала трасса, затем лимиты
+    tracing_middleware = TracingMiddleware()
+    router.message.outer_middleware(tracing_middleware)
+    router.callback_query.outer_middleware(tracing_middleware)
+    router.message.outer_middleware(container.throttling)
+    router.callback_query.outer_middleware(container.throttling)
 
     @router.message(F.content_type == "photo")
-    async def handle_photo(message: Message, state: FSMContext):
+    async def handle_photo(message: Message, state: FSMContext, album: Optional[List[Message]] = None):
         container = message.bot.container
         current_state = await state.get_state()
-        photo_path = await save_photo(message)
-        if not photo_path:
+        user_id = message.from_user.id
+        photo = await save_photo(message, container)
+        if not photo:
             await message.answer("Σφάλμα αποθήκευσης φωτογραφίας")
             return
 
-        if not validate_image(photo_path):
+        if not await check_photo(photo):
+            photo.close()
             await message.answer("Μη έγκυρη εικόνα")
             return
 
         if current_state == ImageProcessing.waiting_first_image:
-            await state.update_data(human_image=photo_path)
+            # Фото человека живет в памяти до конца сессии, а file_id позволяет
+            # любому процессу бота восстановить его
+            container.photo_store.put(user_id, photo)
+            await state.update_data(
+                human_file_id=photo.file_id,
+                human_file_unique_id=photo.file_unique_id
+            )
             await state.set_state(ImageProcessing.waiting_second_image)
             await message.answer("Φωτογραφία παραλήφθηκε! Τώρα στείλτε φωτογραφία ρούχων")
         elif current_state == ImageProcessing.waiting_second_image:
-            await state.update_data(garment_image=photo_path)
-            user_id = message.from_user.id
-            if not await container.token_service.has_tokens(user_id):
-                tokens_message = await container.token_service.get_tokens_message(user_id)
-                await message.answer(tokens_message)
-                await state.clear()
+            garments = [photo]
+            try:
+                # Альбом с фото одежды - примерка одного фото человека с каждой вещью
+                if album and len(album) > 1:
+                    garments += await load_album_garments(message, album, container)
+                if len(garments) > 1 or settings.tryon_num_samples > 1:
+                    await run_fanout(message, state, garments)
+                else:
+                    await run_tryon(message, state, photo)
+            finally:
+                # Фото одежды нужны только на время генерации
+                for garment in garments:
+                    garment.close()
+        else:
+            photo.close()
+            await message.answer("Γεια σας! Για να ξεκινήσετε, στείλτε την εντολή /start")
+
+    async def load_album_garments(message: Message, album: List[Message], container) -> List[PhotoBuffer]:
+        """Загружает и валидирует остальные фото одежды из альбома, не больше FANOUT_MAX_ITEMS вещей"""
+        max_garments = max(settings.fanout_max_items // settings.tryon_num_samples, 1)
+        others = [item for item in album if item.message_id != message.message_id]
+        if len(others) + 1 > max_garments:
+            await message.answer(MESSAGES["fanout_limit"].format(count=max_garments))
+            others = others[:max_garments - 1]
+
+        photos = await asyncio.gather(*(save_photo(item, container) for item in others))
+        garments = []
+        for photo in photos:
+            if photo and await check_photo(photo):
+                garments.append(photo)
+            elif photo:
+                photo.close()
+        if len(garments) < len(others):
+            await message.answer(MESSAGES["fanout_skipped"].format(count=len(others) - len(garments)))
+        return garments
+
+    async def run_tryon(message: Message, state: FSMContext, photo: PhotoBuffer):
+        """
+        Резервирует токен, ставит примерку в очередь и отправляет результат
+
+        С TRYON_PREVIEW сначала делается быстрый предпросмотр, а финальный рендер
+        запускается кнопкой под результатом (handle_quality).
+        """
+        container = message.bot.container
+        user_id = message.from_user.id
+        token_service = container.token_service
+        preview = settings.tryon_preview
+        mode = MODE_PERFORMANCE if preview else MODE_QUALITY
+        cost = settings.preview_token_cost if preview else settings.quality_token_cost
+
+        # fal-ai деградировал - отказываем сразу, не списывая токен; фото человека остается в сессии
+        if container.fal_client.is_degraded:
+            await message.answer(MESSAGES["service_degraded"])
+            return
+
+        # Одна операция в начале: проверка и резервирование токена
+        reservation = await token_service.reserve_token(user_id, cost, kind=mode)
+        if reservation is None:
+            tokens_message = await token_service.get_tokens_message(user_id)
+            await message.answer(tokens_message)
+            container.photo_store.release(user_id)
+            await state.clear()
+            return
+
+        processing_msg = await message.answer(MESSAGES["processing"])
+        # Одно сообщение показывает очередь бота, очередь fal-ai и ход генерации
+        progress = ProgressMessage(message.bot, message.chat.id, processing_msg.message_id, MESSAGES["processing"])
+
+        try:
+            data = await state.get_data()
+            person = await restore_session_photo(message.bot, user_id, data, container)
+            if not person:
+                raise ValueError("Person photo is missing from the session")
+
+            try:
+                job = await container.generation_queue.submit(
+                    user_id, person, photo, on_update=progress.on_queue, on_progress=progress.on_progress, mode=mode
+                )
+            except (QueueFullError, DuplicateJobError) as e:
+                # Очередь не приняла задачу - возвращаем токен, фото одежды можно прислать позже
+                await token_service.refund(reservation)
+                await progress.delete()
+                await message.answer(MESSAGES["queue_busy"] if isinstance(e, QueueFullError)
+                                     else MESSAGES["queue_duplicate"])
                 return
 
-            await message.bot.send_chat_action(chat_id=message.chat.id, action="typing")
-            processing_msg = await message.answer("Επεξεργάζομαι την εικονική δοκιμή...")
+            result_data = await job.wait()
 
-            typing_task = asyncio.create_task(
-                send_typing_periodically(message.bot, message.chat.id, duration=60)
-            )
+            if job.cancelled:
+                # Пользователь начал новую сессию - молча возвращаем токен
+                await token_service.refund(reservation)
+                await progress.delete()
+                return
+
+            # Сессия завершена при любом исходе - фото человека больше не нужно
+            container.photo_store.release(user_id)
+
+            if result_data and isinstance(result_data, dict):
+                remaining = await settle_tokens(token_service, reservation, result_data)
+                await container.analytics_service.log_generation(
+                    user_id=user_id,
+                    person_url=result_data['person_url'],
+                    garment_url=result_data['garment_url'],
+                    result_url=result_data['result_url']
+                )
+
+                if preview:
+                    offer_id = uuid.uuid4().hex[:16]
+                    await save_quality_offer(state, offer_id, make_quality_offer(result_data, person, photo))
+                    await deliver_result(message, container, result_data['result_url'],
+                                         MESSAGES["result_preview"], reply_markup=quality_keyboard(offer_id))
+                else:
+                    await deliver_result(message, container, result_data['result_url'], MESSAGES["result_ready"])
+
+                # Удаляем сообщение о процессе виртуальной примерки
+                await progress.delete()
+                await finish_session(message, state, token_service, remaining)
+            else:
+                await token_service.refund(reservation)
+                await progress.delete()
+                await fail_session(message, state, token_service)
+
+        except Exception as e:
+            # Возвращаем токен, если генерация не была подтверждена
+            await token_service.refund(reservation)
+            await progress.delete()
+            container.photo_store.release(user_id)
+            logger.error(f"Error during virtual try-on: {e}")
+            await fail_session(message, state, token_service)
+
+    async def run_fanout(message: Message, state: FSMContext, garments: List[PhotoBuffer]):
+        """
+        Примерка одного фото человека с несколькими вещами и/или TRYON_NUM_SAMPLES вариантами
+
+        Токены резервируются отдельно на каждую вещь и списываются или возвращаются
+        по ее результату. Генерации идут параллельно (не больше GENERATION_USER_CONCURRENCY
+        на пользователя), результаты приходят одним альбомом.
+        """
+        container = message.bot.container
+        user_id = message.from_user.id
+        token_service = container.token_service
+        preview = settings.tryon_preview
+        mode = MODE_PERFORMANCE if preview else MODE_QUALITY
+        samples = settings.tryon_num_samples
+        cost = (settings.preview_token_cost if preview else settings.quality_token_cost) * samples
+
+        if container.fal_client.is_degraded:
+            await message.answer(MESSAGES["service_degraded"])
+            return
+
+        reservations = []
+        for _ in garments:
+            reservation = await token_service.reserve_token(user_id, cost, kind=mode)
+            if reservation is None:
+                break
+            reservations.append(reservation)
+        if not reservations:
+            await message.answer(await token_service.get_tokens_message(user_id))
+            container.photo_store.release(user_id)
+            await state.clear()
+            return
+        if len(reservations) < len(garments):
+            # Токенов хватает не на все вещи - примеряем первые
+            await message.answer(MESSAGES["fanout_trimmed"].format(count=len(reservations)))
+            garments = garments[:len(reservations)]
+
+        total = len(garments)
+        processing_msg = await message.answer(MESSAGES["processing"])
+        progress = ProgressMessage(message.bot, message.chat.id, processing_msg.message_id, MESSAGES["processing"])
+
+        try:
+            data = await state.get_data()
+            person = await restore_session_photo(message.bot, user_id, data, container)
+            if not person:
+                raise ValueError("Person photo is missing from the session")
 
             try:
-                data = await state.get_data()
-                result_data = await container.fal_client.virtual_tryon(data["human_image"], photo_path)
-                typing_task.cancel()
+                jobs = await container.generation_queue.submit_batch(
+                    user_id, person, garments, on_update=progress.on_queue, mode=mode, num_samples=samples
+                )
+            except (QueueFullError, DuplicateJobError) as e:
+                for reservation in reservations:
+                    await token_service.refund(reservation)
+                await progress.delete()
+                await message.answer(MESSAGES["queue_busy"] if isinstance(e, QueueFullError)
+                                     else MESSAGES["queue_duplicate"])
+                return
+
+            done = 0
+
+            async def wait_job(job):
+                nonlocal done
+                result = await job.wait()
+                done += 1
+                await progress.update(MESSAGES["fanout_progress"].format(done=done, total=total))
+                return result
+
+            results = await asyncio.gather(*(wait_job(job) for job in jobs))
+
+            if any(job.cancelled for job in jobs):
+                # Пользователь начал новую сессию - молча возвращаем токены
+                for reservation in reservations:
+                    await token_service.refund(reservation)
+                await progress.delete()
+                return
+
+            container.photo_store.release(user_id)
 
-                if result_data and isinstance(result_data, dict):
-                    await container.token_service.decrease_tokens(user_id)
+            # Остаток после резервирования всех вещей плюс возвращенные токены
+            remaining = reservations[-1].remaining
+            result_urls, buttons, failed = [], [], 0
+            for index, (garment, reservation, result_data) in enumerate(zip(garments, reservations, results), 1):
+                if not result_data:
+                    failed += 1
+                    if await token_service.refund(reservation):
+                        remaining += reservation.amount
+                    continue
+                remaining += await settle_tokens(token_service, reservation, result_data) - reservation.remaining
+                for result_url in result_data['result_urls']:
                     await container.analytics_service.log_generation(
                         user_id=user_id,
                         person_url=result_data['person_url'],
                         garment_url=result_data['garment_url'],
-                        result_url=result_data['result_url']
+                        result_url=result_url
                     )
+                result_urls.extend(result_data['result_urls'])
+                if preview:
+                    offer_id = uuid.uuid4().hex[:16]
+                    await save_quality_offer(state, offer_id, make_quality_offer(result_data, person, garment))
+                    buttons.append(quality_button(offer_id, f"✨ {index}"))
 
-                    # Удаляем сообщение о процессе виртуальной примерки
-                    await message.bot.delete_message(chat_id=message.chat.id,
-                                                     message_id=processing_msg.message_id)
+            if not result_urls:
+                await progress.delete()
+                await fail_session(message, state, token_service)
+                return
 
-                    await message.answer(f"Έτοιμο! Αποτέλεσμα εικονικής δοκιμής: {result_data['result_url']}")
-                    tokens_message = await container.token_service.get_tokens_message(user_id)
-                    await message.answer(tokens_message)
+            caption = MESSAGES["fanout_preview"] if preview else MESSAGES["fanout_ready"]
+            sent = await container.result_delivery.send_group(message.bot, message.chat.id, result_urls,
+                                                              caption=caption)
+            if not sent:
+                await message.answer(f"{caption}:\n" + "\n".join(result_urls))
+            if buttons:
+                await message.answer(MESSAGES["quality_choose"],
+                                     reply_markup=InlineKeyboardMarkup(inline_keyboard=[buttons]))
+            if failed:
+                await message.answer(MESSAGES["fanout_partial"].format(failed=failed, total=total))
 
-                    if await container.token_service.has_tokens(user_id):
-                        await asyncio.sleep(2)
-                        await message.answer(MESSAGES["ask_photo_person"])
-                        await state.set_state(ImageProcessing.waiting_first_image)
-                    else:
-                        await state.clear()
-                else:
-                    # Удаляем сообщение о процессе виртуальной примерки
-                    try:
-                        await message.bot.delete_message(chat_id=message.chat.id,
-                                                        message_id=processing_msg.message_id)
-                    except:
-                        pass
-                    await message.answer("Προέκυψε σφάλμα κατά την επεξεργασία των εικόνων")
-                    tokens_message = await container.token_service.get_tokens_message(user_id)
-                    await message.answer(tokens_message)
-                    await asyncio.sleep(1)
-                    await message.answer(MESSAGES["ask_photo_person"])
-                    await state.set_state(ImageProcessing.waiting_first_image)
-
-            except Exception as e:
-                typing_task.cancel()
-                try:
-                    await message.bot.delete_message(chat_id=message.chat.id,
-                                                     message_id=processing_msg.message_id)
-                except:
-                    pass
-                logger.error(f"Error during virtual try-on: {e}")
-                await message.answer("Προέκυψε σφάλμα κατά την επεξεργασία των εικόνων")
-                tokens_message = await container.token_service.get_tokens_message(user_id)
-                await message.answer(tokens_message)
-                await asyncio.sleep(1)
-                await message.answer(MESSAGES["ask_photo_person"])
-                await state.set_state(ImageProcessing.waiting_first_image)
-        else:
-            await message.answer("Γεια σας! Για να ξεκινήσετε, στείλτε την εντολή /start")
+            await progress.delete()
+            await finish_session(message, state, token_service, remaining)
+
+        except Exception as e:
+            # Возвращаем токены, которые не были подтверждены
+            for reservation in reservations:
+                await token_service.refund(reservation)
+            await progress.delete()
+            container.photo_store.release(user_id)
+            logger.error(f"Error during fan-out try-on: {e}")
+            await fail_session(message, state, token_service)
+
+    @router.callback_query(F.data.startswith(QUALITY_CALLBACK_PREFIX))
+    async def handle_quality(callback: CallbackQuery, state: FSMContext):
+        """Финальный рендер в режиме quality по кнопке под предпросмотром - без повторной загрузки фото"""
+        container = callback.bot.container
+        user_id = callback.from_user.id
+        message = callback.message
+        token_service = container.token_service
+        offer_id = callback.data[len(QUALITY_CALLBACK_PREFIX):]
+
+        if container.fal_client.is_degraded:
+            await callback.answer(MESSAGES["service_degraded"], show_alert=True)
+            return
+
+        offer = await pop_quality_offer(state, offer_id)
+        if not offer:
+            await callback.answer(MESSAGES["quality_expired"], show_alert=True)
+            return
+        await callback.answer()
+
+        reservation = await token_service.reserve_token(user_id, settings.quality_token_cost, kind=MODE_QUALITY)
+        if reservation is None:
+            await save_quality_offer(state, offer_id, offer)
+            await message.answer(await token_service.get_tokens_message(user_id))
+            return
+
+        # Кнопка одноразовая - убираем ее, пока идет рендер; под альбомом остаются кнопки других вещей
+        markup = message.reply_markup
+        try:
+            await message.edit_reply_markup(reply_markup=without_button(markup, callback.data))
+        except TelegramBadRequest:
+            pass
+
+        processing_msg = await message.answer(MESSAGES["processing"])
+        progress = ProgressMessage(callback.bot, message.chat.id, processing_msg.message_id, MESSAGES["processing"])
+        person = PhotoBuffer.from_url(offer["person_file_id"], offer["person_file_unique_id"],
+                                      offer["person_hash"], offer["person_url"])
+        garment = PhotoBuffer.from_url(offer["garment_file_id"], offer["garment_file_unique_id"],
+                                       offer["garment_hash"], offer["garment_url"])
+
+        try:
+            try:
+                job = await container.generation_queue.submit(
+                    user_id, person, garment, on_update=progress.on_queue, on_progress=progress.on_progress,
+                    mode=MODE_QUALITY
+                )
+            except (QueueFullError, DuplicateJobError) as e:
+                await token_service.refund(reservation)
+                await progress.delete()
+                await restore_quality_offer(state, message, offer_id, offer, markup)
+                await message.answer(MESSAGES["queue_busy"] if isinstance(e, QueueFullError)
+                                     else MESSAGES["queue_duplicate"])
+                return
+
+            result_data = await job.wait()
+            if job.cancelled:
+                await token_service.refund(reservation)
+                await progress.delete()
+                await restore_quality_offer(state, message, offer_id, offer, markup)
+                return
+
+            if not result_data:
+                raise ValueError("Quality render returned no result")
+
+            remaining = await settle_tokens(token_service, reservation, result_data)
+            await container.analytics_service.log_generation(
+                user_id=user_id,
+                person_url=result_data['person_url'],
+                garment_url=result_data['garment_url'],
+                result_url=result_data['result_url']
+            )
+            await deliver_result(message, container, result_data['result_url'], MESSAGES["quality_ready"])
+            await progress.delete()
+            await message.answer(token_service.format_tokens_message(remaining))
+
+        except Exception as e:
+            await token_service.refund(reservation)
+            await progress.delete()
+            logger.error(f"Error during quality render: {e}")
+            # Предпросмотр остается: рендер можно запустить снова
+            await restore_quality_offer(state, message, offer_id, offer, markup)
+            await message.answer("Προέκυψε σφάλμα κατά την επεξεργασία των εικόνων")
 
     @router.message(F.text == "/start")
     async def start_handler(message: Message, state: FSMContext):
         container = message.bot.container
         user = message.from_user
-        await container.sheets_client.add_or_update_user(
+        # Новая сессия: незавершенная генерация прошлой сессии отменяется
+        # и больше не занимает воркер, фото прошлой сессии не нужны
+        container.generation_queue.cancel(user.id)
+        container.photo_store.release(user.id)
+        await container.storage.upsert_user(
             user_id=user.id,
             username=user.username,
             first_name=user.first_name,
@@ -0,0 +1,28 @@
+"""
+Учет обработчиков обновлений, которые выполняются сейчас: при остановке бот дожидается их завершения
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class InFlightMiddleware(BaseMiddleware):
+    """Запоминает задачу каждого обновления, пока оно обрабатывается (outer middleware на dp.update)"""
+
+    def __init__(self):
+        self.tasks: Set[asyncio.Task] = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        task = asyncio.current_task()
+        self.tasks.add(task)
+        try:
+            return await handler(event, data)
+        finally:
+            self.tasks.discard(task)
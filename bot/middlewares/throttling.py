@@ -0,0 +1,167 @@
+"""
+Ограничение частоты запросов (token bucket) для сообщений и нажатий кнопок бота
+Лишние обновления отбрасываются до скачивания фото, валидации, обращений к хранилищу и генераций
+"""
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, TelegramObject
+
+from config.settings import settings
+from utils.logger import logger
+from bot.text import MESSAGES
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self, now: float) -> bool:
+        """Забирает один токен, если он есть"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Лимиты на пользователя и глобальные, отдельно для команд и для фото"""
+
+    # Сколько пользовательских корзин держать в памяти
+    MAX_USER_BUCKETS = 10000
+
+    def __init__(self):
+        self.limits = {
+            "command": (settings.throttle_command_rate, settings.throttle_command_burst),
+            "photo": (settings.throttle_photo_rate, settings.throttle_photo_burst)
+        }
+        self.global_buckets = {
+            "command": TokenBucket(settings.throttle_global_command_rate, settings.throttle_global_command_burst),
+            "photo": TokenBucket(settings.throttle_global_photo_rate, settings.throttle_global_photo_burst)
+        }
+        self.notice_interval = settings.throttle_notice_interval
+
+        self._user_buckets: "OrderedDict[Tuple[int, str], TokenBucket]" = OrderedDict()
+        self._last_notice: Dict[int, float] = {}
+        # Последний обработанный альбом (media_group_id) на пользователя
+        self._last_media_group: Dict[int, str] = {}
+        # Альбомы, которые сейчас собираются: (user_id, media_group_id) -> сообщения
+        self._albums: Dict[Tuple[int, str], List[Message]] = {}
+        self.album_delay = settings.album_collect_delay
+
+        self.counters = {
+            "allowed": 0,
+            "rejected_user_command": 0,
+            "rejected_user_photo": 0,
+            "rejected_global_command": 0,
+            "rejected_global_photo": 0,
+            "merged_media_group": 0
+        }
+
+    @staticmethod
+    def _kind(event: TelegramObject) -> str:
+        # Кнопка финального рендера запускает платную генерацию - лимит как у фото
+        if isinstance(event, CallbackQuery) or event.photo:
+            return "photo"
+        return "command"
+
+    def _user_bucket(self, user_id: int, kind: str) -> TokenBucket:
+        key = (user_id, kind)
+        bucket = self._user_buckets.get(key)
+        if bucket is None:
+            bucket = self._user_buckets[key] = TokenBucket(*self.limits[kind])
+            if len(self._user_buckets) > self.MAX_USER_BUCKETS:
+                self._user_buckets.popitem(last=False)
+        else:
+            self._user_buckets.move_to_end(key)
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, (Message, CallbackQuery)) or event.from_user is None:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        kind = self._kind(event)
+
+        # Альбом приходит отдельным обновлением на каждое фото: первое собирает остальные
+        # и проходит лимиты за весь альбом, остальные в handler не попадают
+        album_id = event.media_group_id if isinstance(event, Message) else None
+        if album_id:
+            album = self._albums.get((user_id, album_id))
+            if album is not None:
+                album.append(event)
+                self.counters["merged_media_group"] += 1
+                return None
+            if self._last_media_group.get(user_id) == album_id:
+                self.counters["merged_media_group"] += 1
+                return None
+            self._last_media_group[user_id] = album_id
+            if len(self._last_media_group) > self.MAX_USER_BUCKETS:
+                self._last_media_group.pop(next(iter(self._last_media_group)))
+
+        now = time.monotonic()
+        if not self._user_bucket(user_id, kind).consume(now):
+            self.counters[f"rejected_user_{kind}"] += 1
+            await self._notify(event, now)
+            return None
+        if not self.global_buckets[kind].consume(now):
+            self.counters[f"rejected_global_{kind}"] += 1
+            logger.warning(f"Global {kind} rate limit exceeded, dropping update from user {user_id}")
+            await self._notify(event, now)
+            return None
+
+        self.counters["allowed"] += 1
+        if album_id:
+            data["album"] = await self._collect_album(user_id, event)
+        return await handler(event, data)
+
+    async def _collect_album(self, user_id: int, message: Message) -> List[Message]:
+        """Ждет остальные фото альбома и возвращает их в порядке отправки"""
+        key = (user_id, message.media_group_id)
+        album = self._albums[key] = [message]
+        try:
+            await asyncio.sleep(self.album_delay)
+        finally:
+            self._albums.pop(key, None)
+        return sorted(album, key=lambda m: m.message_id)
+
+    async def _notify(self, event: TelegramObject, now: float) -> None:
+        """Предупреждает пользователя: нажатие кнопки - всегда, сообщения - не чаще одного раза за notice_interval"""
+        user_id = event.from_user.id
+        if isinstance(event, CallbackQuery):
+            # На нажатие кнопки отвечаем всегда, иначе Telegram показывает ожидание на кнопке
+            try:
+                await event.answer(MESSAGES["throttled"])
+            except Exception as e:
+                logger.warning(f"Failed to answer throttled callback from user {user_id}: {e}")
+            return
+        if now - self._last_notice.get(user_id, float("-inf")) < self.notice_interval:
+            return
+        self._last_notice[user_id] = now
+        if len(self._last_notice) > self.MAX_USER_BUCKETS:
+            self._last_notice.pop(next(iter(self._last_notice)))
+        try:
+            await event.answer(MESSAGES["throttled"])
+        except Exception as e:
+            logger.warning(f"Failed to send throttling notice to user {user_id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики пропущенных и отброшенных обновлений"""
+        return {**self.counters, "user_buckets": len(self._user_buckets)}
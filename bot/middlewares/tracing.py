@@ -0,0 +1,32 @@
+"""
+Трасса на каждое обновление: trace ID попадает во все записи лога обработчика, очереди, FalClient и сервисов
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, TelegramObject
+
+from utils import tracing
+from utils.metrics import metrics
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Открывает трассу до лимитов и фильтров и замеряет обработку обновления целиком"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, CallbackQuery):
+            kind = "callback"
+        elif isinstance(event, Message):
+            kind = "photo" if event.photo else "message"
+        else:
+            return await handler(event, data)
+
+        user = event.from_user
+        trace = tracing.new_trace(user.id if user else None, update=kind)
+        with tracing.use_trace(trace), metrics.stage(f"update_{kind}"):
+            return await handler(event, data)
@@ -6,7 +6,53 @@ MESSAGES = {
     
     "ask_photo_person": "Παρακαλώ στείλτε τη φωτογραφία σας",
     
-    "ask_photo_cloth": "Παρακαλώ στείλτε μου τη φωτογραφία των ρούχων"
+    "ask_photo_cloth": "Παρακαλώ στείλτε μου τη φωτογραφία των ρούχων",
+
+    "processing": "Επεξεργάζομαι την εικονική δοκιμή...",
+
+    "queue_position": "⏳ Είστε #{position} στη σειρά, αναμονή ~{eta} δευτ.",
+
+    "queue_busy": "😔 Ο διακομιστής είναι απασχολημένος αυτή τη στιγμή. Παρακαλώ στείλτε ξανά τη φωτογραφία των ρούχων σε λίγα λεπτά",
+
+    "queue_duplicate": "⏳ Η προηγούμενη εικονική δοκιμή σας είναι ακόμη σε εξέλιξη. Παρακαλώ περιμένετε",
+
+    "progress_uploading": "📤 Ανέβασμα φωτογραφιών...",
+
+    "progress_queued": "⏳ Σε αναμονή στον διακομιστή δημιουργίας (θέση {position})...",
+
+    "progress_in_progress": "🎨 Δημιουργία της εικονικής δοκιμής...",
+
+    "progress_done": "✅ Ολοκληρώθηκε! Αποστολή αποτελέσματος...",
+
+    "result_ready": "Έτοιμο! Αποτέλεσμα εικονικής δοκιμής",
+
+    "result_preview": "Έτοιμο! Γρήγορη προεπισκόπηση εικονικής δοκιμής. Πατήστε το κουμπί για την τελική εικόνα σε υψηλή ποιότητα",
+
+    "quality_button": "✨ Υψηλή ποιότητα",
+
+    "quality_ready": "Έτοιμο! Εικονική δοκιμή σε υψηλή ποιότητα",
+
+    "quality_expired": "Αυτή η προεπισκόπηση δεν είναι πλέον διαθέσιμη. Στείλτε ξανά τις φωτογραφίες",
+
+    "fanout_limit": "Θα χρησιμοποιηθούν μόνο οι πρώτες {count} φωτογραφίες ρούχων",
+
+    "fanout_skipped": "{count} φωτογραφίες ρούχων δεν είναι έγκυρες και παραλείφθηκαν",
+
+    "fanout_trimmed": "Τα tokens σας αρκούν για {count} ρούχα - θα δοκιμαστούν τα πρώτα",
+
+    "fanout_progress": "🎨 Δημιουργία εικονικών δοκιμών... Έτοιμα {done} από {total}",
+
+    "fanout_ready": "Έτοιμο! Αποτελέσματα εικονικής δοκιμής",
+
+    "fanout_preview": "Έτοιμο! Γρήγορες προεπισκοπήσεις εικονικής δοκιμής",
+
+    "fanout_partial": "{failed} από {total} δοκιμές απέτυχαν, τα tokens τους επιστράφηκαν",
+
+    "quality_choose": "Επιλέξτε ρούχο για την τελική εικόνα σε υψηλή ποιότητα",
+
+    "service_degraded": "😔 Η υπηρεσία εικονικής δοκιμής αντιμετωπίζει προβλήματα αυτή τη στιγμή. Τα tokens σας δεν χρεώθηκαν, δοκιμάστε ξανά σε λίγα λεπτά",
+
+    "throttled": "⏳ Πάρα πολλά μηνύματα. Παρακαλώ περιμένετε λίγο και δοκιμάστε ξανά"
 }
 
 PROMPTS = {
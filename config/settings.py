@@ -23,20 +23,160 @@ class Settings:
         if not self.bot_token:
             raise ValueError("BOT_TOKEN не найден в переменных окружения. Проверьте файл .env")
         
+        # Режим получения обновлений: polling (локальная разработка) или webhook
+        self.bot_mode = os.getenv('BOT_MODE', 'polling').lower()
+        self.webhook_url = os.getenv('WEBHOOK_URL')  # Публичный адрес, например https://bot.example.com
+        self.webhook_path = os.getenv('WEBHOOK_PATH', '/webhook')
+        self.webhook_secret = os.getenv('WEBHOOK_SECRET') or None
+        self.webapp_host = os.getenv('WEBAPP_HOST', '0.0.0.0')
+        self.webapp_port = int(os.getenv('WEBAPP_PORT', '8080'))
+        # Эндпоинт метрик Prometheus на отдельном порту (0 - выключен)
+        self.metrics_host = os.getenv('METRICS_HOST', '127.0.0.1')
+        self.metrics_port = int(os.getenv('METRICS_PORT', '9108'))
+        self.metrics_path = os.getenv('METRICS_PATH', '/metrics')
+        if self.bot_mode == 'webhook' and not self.webhook_url:
+            raise ValueError("WEBHOOK_URL обязателен в режиме BOT_MODE=webhook. Проверьте файл .env")
+        
         # LLM API
         self.llm_api_key = os.getenv('LLM_API_KEY')
         self.llm_api_url = os.getenv('LLM_API_URL')
         self.llm_model = os.getenv('LLM_MODEL')
+        # Максимум одновременных примерок в fal-ai (загрузка + генерация)
+        self.fal_max_concurrency = int(os.getenv('FAL_MAX_CONCURRENCY', '4'))
+        # Период опроса статуса запроса в очереди fal-ai и общий таймаут генерации (сек)
+        self.fal_poll_interval = float(os.getenv('FAL_POLL_INTERVAL', '1'))
+        self.fal_timeout = float(os.getenv('FAL_TIMEOUT', '180'))
+        # Повторы временных ошибок fal-ai с экспоненциальной задержкой и jitter
+        self.fal_retry_attempts = int(os.getenv('FAL_RETRY_ATTEMPTS', '3'))
+        self.fal_retry_base_delay = float(os.getenv('FAL_RETRY_BASE_DELAY', '0.5'))
+        self.fal_retry_max_delay = float(os.getenv('FAL_RETRY_MAX_DELAY', '8'))
+        # Дублирующий запрос, если генерация дольше этого перцентиля прошлых (0 - выключено)
+        self.fal_hedge_percentile = float(os.getenv('FAL_HEDGE_PERCENTILE', '0'))
+        self.fal_hedge_min_samples = int(os.getenv('FAL_HEDGE_MIN_SAMPLES', '20'))
+        # Circuit breaker: после стольких ошибок подряд запросы отклоняются на FAL_BREAKER_COOLDOWN секунд
+        self.fal_breaker_threshold = int(os.getenv('FAL_BREAKER_THRESHOLD', '5'))
+        self.fal_breaker_cooldown = float(os.getenv('FAL_BREAKER_COOLDOWN', '30'))
+        # Сколько последних попыток хранить для диагностики
+        self.fal_attempt_log_size = int(os.getenv('FAL_ATTEMPT_LOG_SIZE', '200'))
+        # Провайдеры примерки "имя=модель,..." (модель fake - локальная заглушка) и canary "имя:доля"
+        self.tryon_providers = [
+            tuple(item.strip().split('=', 1))
+            for item in (os.getenv('TRYON_PROVIDERS') or f'fal={self.llm_model}').split(',') if '=' in item
+        ]
+        canary = os.getenv('TRYON_CANARY', '')
+        self.tryon_canary = canary.split(':', 1)[0].strip() or None
+        self.tryon_canary_weight = float(canary.split(':', 1)[1]) if ':' in canary else 0.0
+        # Окно статистики роутера (сек), доля ошибок, после которой провайдер уходит в конец, и минимум замеров
+        self.tryon_router_window = float(os.getenv('TRYON_ROUTER_WINDOW', '600'))
+        self.tryon_router_max_error_rate = float(os.getenv('TRYON_ROUTER_MAX_ERROR_RATE', '0.5'))
+        self.tryon_router_min_samples = int(os.getenv('TRYON_ROUTER_MIN_SAMPLES', '5'))
+        # Задержка (сек) и доля сбоев провайдера-заглушки fake
+        self.fake_provider_latency = float(os.getenv('FAKE_PROVIDER_LATENCY', '1'))
+        self.fake_provider_error_rate = float(os.getenv('FAKE_PROVIDER_ERROR_RATE', '0'))
+        # Очередь генераций: число воркеров, максимальная глубина и начальная оценка времени генерации (сек)
+        self.generation_workers = int(os.getenv('GENERATION_WORKERS', str(self.fal_max_concurrency)))
+        self.generation_queue_max = int(os.getenv('GENERATION_QUEUE_MAX', '20'))
+        self.generation_default_service_time = float(os.getenv('GENERATION_DEFAULT_SERVICE_TIME', '30'))
+        self.generation_preview_service_time = float(os.getenv('GENERATION_PREVIEW_SERVICE_TIME', '10'))
+        # Сначала быстрый предпросмотр (mode=performance), финальный рендер - по кнопке; по умолчанию выключено
+        self.tryon_preview = os.getenv('TRYON_PREVIEW', 'false').lower() == 'true'
+        # Стоимость в токенах: предпросмотра и финального рендера по кнопке
+        self.preview_token_cost = int(os.getenv('PREVIEW_TOKEN_COST', '1'))
+        self.quality_token_cost = int(os.getenv('QUALITY_TOKEN_COST', '1'))
+        # Примерка с несколькими вещами (альбом) и несколько вариантов на вещь (1-4)
+        self.tryon_num_samples = min(max(int(os.getenv('TRYON_NUM_SAMPLES', '1')), 1), 4)
+        # Результаты отправляются одним альбомом, а в альбоме Telegram не больше 10 фото
+        self.fanout_max_items = min(int(os.getenv('FANOUT_MAX_ITEMS', '4')), 10)
+        self.generation_user_concurrency = int(os.getenv('GENERATION_USER_CONCURRENCY', '2'))
         
         # Google Sheets
         self.google_credentials_file = os.getenv('GOOGLE_CREDENTIALS_FILE')
         self.users_sheet_id = os.getenv('USERS_SHEET_ID')
         self.analytics_sheet_id = os.getenv('ANALYTICS_SHEET_ID')
+
+        # Основное хранилище: sqlite (с зеркалированием в Google Sheets) или sheets
+        self.storage_backend = os.getenv('STORAGE_BACKEND', 'sqlite').lower()
+        self.sqlite_path = os.getenv('SQLITE_PATH', 'storage/bot.db')
+        # Хранилище состояний FSM: sqlite (общее для процессов), redis или memory
+        self.fsm_storage = os.getenv('FSM_STORAGE', 'sqlite').lower()
+        self.fsm_db_path = os.getenv('FSM_DB_PATH', 'storage/fsm.db')
+        self.fsm_ttl = int(os.getenv('FSM_TTL', str(24 * 3600)))
+        self.redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+        # Период и размер порции зеркалирования SQLite → Google Sheets
+        self.replication_interval = float(os.getenv('REPLICATION_INTERVAL', '5'))
+        self.replication_batch_size = int(os.getenv('REPLICATION_BATCH_SIZE', '200'))
+        # Задержка пакетной записи изменений пользователей и период пересинхронизации (сек)
+        self.ledger_flush_interval = float(os.getenv('LEDGER_FLUSH_INTERVAL', '2'))
+        self.ledger_resync_interval = int(os.getenv('LEDGER_RESYNC_INTERVAL', '300'))
+        # Пакетная запись аналитики: размер пакета и максимальная задержка (сек)
+        self.analytics_batch_size = int(os.getenv('ANALYTICS_BATCH_SIZE', '20'))
+        self.analytics_flush_interval = float(os.getenv('ANALYTICS_FLUSH_INTERVAL', '10'))
+        # Планировщик запросов к Google Sheets: минутные квоты чтения и записи, параллельные вызовы,
+        # повторы при 429 и временных ошибках (задержки в секундах)
+        self.sheets_read_quota = int(os.getenv('SHEETS_READ_QUOTA', '60'))
+        self.sheets_write_quota = int(os.getenv('SHEETS_WRITE_QUOTA', '60'))
+        self.sheets_concurrency = int(os.getenv('SHEETS_CONCURRENCY', '2'))
+        self.sheets_retry_attempts = int(os.getenv('SHEETS_RETRY_ATTEMPTS', '5'))
+        self.sheets_retry_base_delay = float(os.getenv('SHEETS_RETRY_BASE_DELAY', '2'))
+        self.sheets_retry_max_delay = float(os.getenv('SHEETS_RETRY_MAX_DELAY', '64'))
+        
+        # Ограничение частоты: скорость (токенов/сек) и размер корзины, на пользователя и глобально
+        self.throttle_command_rate = float(os.getenv('THROTTLE_COMMAND_RATE', '1'))
+        self.throttle_command_burst = float(os.getenv('THROTTLE_COMMAND_BURST', '3'))
+        self.throttle_photo_rate = float(os.getenv('THROTTLE_PHOTO_RATE', '0.2'))
+        self.throttle_photo_burst = float(os.getenv('THROTTLE_PHOTO_BURST', '3'))
+        self.throttle_global_command_rate = float(os.getenv('THROTTLE_GLOBAL_COMMAND_RATE', '20'))
+        self.throttle_global_command_burst = float(os.getenv('THROTTLE_GLOBAL_COMMAND_BURST', '50'))
+        self.throttle_global_photo_rate = float(os.getenv('THROTTLE_GLOBAL_PHOTO_RATE', '5'))
+        self.throttle_global_photo_burst = float(os.getenv('THROTTLE_GLOBAL_PHOTO_BURST', '20'))
+        # Как часто (сек) предупреждать пользователя об отброшенных сообщениях
+        self.throttle_notice_interval = float(os.getenv('THROTTLE_NOTICE_INTERVAL', '10'))
+        # Сколько ждать (сек) остальные фото альбома после первого
+        self.album_collect_delay = float(os.getenv('ALBUM_COLLECT_DELAY', '0.5'))
         
         # App Settings
         self.log_level = os.getenv('LOG_LEVEL', 'INFO')
+        # Формат логов: json (строка JSON с trace ID и таймингами стадий) или text
+        self.log_format = os.getenv('LOG_FORMAT', 'json').lower()
+        # Доля запросов, для которых полные ответы сервисов пишутся в лог (0 - никогда, 1 - всегда)
+        self.log_payload_sample_rate = float(os.getenv('LOG_PAYLOAD_SAMPLE_RATE', '0'))
         self.temp_dir = os.getenv('TEMP_DIR', 'storage/temp')
+        # Квота (МБ) и TTL (сек) временных файлов в TEMP_DIR
+        self.temp_quota_mb = int(os.getenv('TEMP_QUOTA_MB', '500'))
+        self.temp_ttl = int(os.getenv('TEMP_TTL', str(self.fsm_ttl)))
+        # Фото больше этого размера (байт) хранятся во временном файле, а не в памяти
+        self.photo_spill_threshold = int(os.getenv('PHOTO_SPILL_THRESHOLD', str(5 * 1024 * 1024)))
+        # Валидация фото: допустимые форматы, минимальная сторона и максимум пикселей (защита от decompression bomb)
+        self.image_allowed_formats = {f.strip().upper() for f in os.getenv('IMAGE_ALLOWED_FORMATS', 'JPEG,PNG,WEBP').split(',') if f.strip()}
+        self.image_min_side = int(os.getenv('IMAGE_MIN_SIDE', '256'))
+        self.image_max_pixels = int(os.getenv('IMAGE_MAX_PIXELS', str(40_000_000)))
+        # Нормализация перед загрузкой: рамка (модель работает от 576x864), качество JPEG и число процессов
+        self.normalize_max_width = int(os.getenv('NORMALIZE_MAX_WIDTH', '864'))
+        self.normalize_max_height = int(os.getenv('NORMALIZE_MAX_HEIGHT', '1296'))
+        self.normalize_quality = int(os.getenv('NORMALIZE_QUALITY', '88'))
+        self.image_workers = int(os.getenv('IMAGE_WORKERS', '1'))
         self.cache_dir = os.getenv('CACHE_DIR', 'storage/cache')
 
+        # Кэш изображений (file_unique_id → хэш содержимого → URL fal-ai)
+        self.image_cache_max_entries = int(os.getenv('IMAGE_CACHE_MAX_ENTRIES', '500'))
+        self.image_cache_ttl = int(os.getenv('IMAGE_CACHE_TTL', str(7 * 24 * 3600)))
+        self.image_cache_url_ttl = int(os.getenv('IMAGE_CACHE_URL_TTL', str(24 * 3600)))
+        # Как часто записывать измененный индекс на диск (сек)
+        self.image_cache_flush_interval = float(os.getenv('IMAGE_CACHE_FLUSH_INTERVAL', '5'))
+
+        # Кэш результатов примерки
+        self.result_cache_max_entries = int(os.getenv('RESULT_CACHE_MAX_ENTRIES', '1000'))
+        self.result_cache_ttl = int(os.getenv('RESULT_CACHE_TTL', str(3 * 24 * 3600)))
+        # Списывать ли токен, если результат отдан из кэша
+        self.result_cache_charge_hits = os.getenv('RESULT_CACHE_CHARGE_HITS', 'false').lower() == 'true'
+
+        # Отправка результата фотографией: формат (JPEG или WEBP), качество, максимальная сторона
+        self.result_photo_format = os.getenv('RESULT_PHOTO_FORMAT', 'JPEG').upper()
+        self.result_photo_quality = int(os.getenv('RESULT_PHOTO_QUALITY', '90'))
+        self.result_photo_max_side = int(os.getenv('RESULT_PHOTO_MAX_SIDE', '2560'))
+        # HTTP пул для скачивания результатов: число соединений и таймаут (сек)
+        self.result_http_pool_size = int(os.getenv('RESULT_HTTP_POOL_SIZE', '10'))
+        self.result_download_timeout = float(os.getenv('RESULT_DOWNLOAD_TIMEOUT', '30'))
+
 
 settings = Settings()
\ No newline at end of file
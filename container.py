@@ -1,20 +1,179 @@
+from config.settings import settings
 from llm.clients.fal_client import FalClient
 from storage.sheets_client import SheetsClient
+from storage.image_cache import ImageCache
+from storage.result_cache import ResultCache
+from storage.photo_store import PhotoStore
+from storage.file_manager import FileManager
+from image.processors.normalizer import ImageNormalizer
+from storage.backends.sqlite_backend import SQLiteStorage
+from storage.backends.sheets_backend import SheetsStorage
+from storage.replicator import SheetsReplicator
 from services.token_service import TokenService
 from services.analytics_service import AnalyticsService
+from services.generation_queue import GenerationQueue
+from services.result_delivery import ResultDelivery
+from services.metrics_server import MetricsServer
+from bot.middlewares.throttling import ThrottlingMiddleware
+from utils.metrics import metrics
 
 class Container:
     def __init__(self):
         # Создаем сервисы в правильном порядке (sheets_client первым)
         self.sheets_client = SheetsClient()
-        
-        # TokenService зависит от sheets_client
-        self.token_service = TokenService(self.sheets_client)
-        
+
+        # Основное хранилище: SQLite с зеркалом в таблицах или сами таблицы
+        self.replicator = None
+        if settings.storage_backend == "sheets":
+            self.storage = SheetsStorage(self.sheets_client)
+        else:
+            self.storage = SQLiteStorage(settings.sqlite_path)
+            self.replicator = SheetsReplicator(self.storage, self.sheets_client)
+
+        # TokenService и AnalyticsService работают через хранилище
+        self.token_service = TokenService(self.storage)
+        self.analytics_service = AnalyticsService(self.sheets_client, self.storage)
+
+        # Кэш изображений используется обработчиком и клиентом fal-ai
+        self.image_cache = ImageCache()
+        self.result_cache = ResultCache()
+        # Временные файлы (фото больше порога) с квотой и TTL
+        self.file_manager = FileManager()
+        # Фото человека текущих сессий в памяти
+        self.photo_store = PhotoStore(self.file_manager)
+
+        # Нормализация фото перед загрузкой в fal-ai (пул процессов)
+        self.normalizer = ImageNormalizer()
+
         # Остальные независимые сервисы
-        self.fal_client = FalClient()
-        self.analytics_service = AnalyticsService(self.sheets_client)
-    
+        self.fal_client = FalClient(self.image_cache, self.result_cache, self.normalizer)
+
+        # Отправка результатов фотографией с кэшем file_id
+        self.result_delivery = ResultDelivery(self.normalizer)
+
+        # Очередь генераций ограничивает нагрузку на fal-ai
+        self.generation_queue = GenerationQueue(self.fal_client)
+
+        # Ограничение частоты сообщений до любой работы с файлами и хранилищем
+        self.throttling = ThrottlingMiddleware()
+
+        # Эндпоинт метрик; показатели сервисов читаются при каждом запросе
+        self.metrics_server = MetricsServer()
+        self._register_metrics()
+
+    def _register_metrics(self):
+        """Регистрирует показатели сервисов: очередь, кэши, токены, провайдеры, файлы"""
+        queue = self.generation_queue.get_stats
+        metrics.gauge("tryon_queue_depth", "Jobs waiting in the generation queue", lambda: queue()["depth"])
+        metrics.gauge("tryon_queue_in_progress", "Jobs being generated", lambda: queue()["in_progress"])
+        metrics.gauge("tryon_queue_workers", "Generation workers", lambda: queue()["workers"])
+        metrics.gauge(
+            "tryon_queue_jobs_total", "Generation jobs by outcome",
+            lambda: {(event,): queue()[event] for event in
+                     ("submitted", "completed", "failed", "cancelled", "rejected_full", "rejected_duplicate")},
+            ("event",), kind="counter"
+        )
+        metrics.gauge("tryon_queue_service_time_seconds", "Moving average of generation time",
+                      lambda: {(mode,): value for mode, value in queue()["avg_service_time"].items()}, ("mode",))
+
+        def cache_lookups():
+            image, result, delivery = (self.image_cache.get_stats(), self.result_cache.get_stats(),
+                                       self.result_delivery.get_stats())
+            return {
+                ("image_id", "hit"): image["id_hits"], ("image_id", "miss"): image["id_misses"],
+                ("image_upload", "hit"): image["upload_hits"], ("image_upload", "miss"): image["upload_misses"],
+                ("result", "hit"): result["hits"], ("result", "miss"): result["misses"],
+                ("result", "merged"): result["merged"],
+                ("result_file_id", "hit"): delivery["file_id_hits"], ("result_file_id", "miss"): delivery["uploads"]
+            }
+
+        def cache_hit_ratio():
+            ratios = {}
+            for (cache, outcome), value in cache_lookups().items():
+                if outcome == "merged":
+                    continue
+                hits, total = ratios.get((cache,), (0, 0))
+                ratios[(cache,)] = (hits + (value if outcome == "hit" else 0), total + value)
+            return {key: hits / total if total else 0.0 for key, (hits, total) in ratios.items()}
+
+        metrics.gauge("cache_lookups_total", "Cache lookups by result", cache_lookups, ("cache", "result"),
+                      kind="counter")
+        metrics.gauge("cache_hit_ratio", "Cache hit ratio since start", cache_hit_ratio, ("cache",))
+        metrics.gauge("cache_entries", "Entries in cache", lambda: {
+            ("image",): self.image_cache.get_stats()["entries"],
+            ("result_file_id",): self.result_delivery.get_stats()["entries"]
+        }, ("cache",))
+
+        def tokens():
+            counters = dict(self.token_service.get_stats())
+            counters.pop("open_reservations")
+            return {tuple(key.rsplit("_", 1)): value for key, value in counters.items()}
+
+        metrics.gauge("tokens_total", "Tokens by generation kind and event", tokens, ("kind", "event"),
+                      kind="counter")
+        metrics.gauge("tokens_open_reservations", "Reserved tokens awaiting commit or refund",
+                      lambda: self.token_service.get_stats()["open_reservations"])
+
+        router = self.fal_client.router
+        metrics.gauge("tryon_provider_error_rate", "Provider error rate over the routing window",
+                      lambda: {(name,): router.error_rate(name) for name in router.providers}, ("provider",))
+        metrics.gauge("tryon_provider_breaker_open", "Provider circuit breaker is open",
+                      lambda: {(name,): int(p.is_degraded) for name, p in router.providers.items()}, ("provider",))
+        metrics.gauge("tryon_provider_fallbacks_total", "Generations moved to a fallback provider",
+                      lambda: router.counters["fallbacks"], kind="counter")
+
+        metrics.gauge("photo_store_sessions", "Person photos held for active sessions",
+                      lambda: self.photo_store.get_stats()["sessions"])
+        metrics.gauge("photo_store_bytes", "Bytes of session photos by location", lambda: {
+            ("memory",): self.photo_store.get_stats()["memory_bytes"],
+            ("disk",): self.photo_store.get_stats()["spilled_bytes"]
+        }, ("location",))
+        metrics.gauge("temp_files_bytes", "Bytes of tracked temporary files", lambda: self.file_manager.get_stats()["bytes"])
+        sheets = self.sheets_client.scheduler
+        metrics.gauge("sheets_pending_requests", "Google Sheets calls waiting in the scheduler by priority",
+                      lambda: {(name,): n for name, n in sheets.get_stats()["pending_by_priority"].items()},
+                      ("priority",))
+        metrics.gauge("sheets_quota_used", "Google Sheets calls sent in the last minute by kind",
+                      lambda: {(kind,): n for kind, n in sheets.get_stats()["quota_used"].items()}, ("kind",))
+        metrics.gauge("sheets_calls_total", "Google Sheets API calls sent by kind", lambda: {
+            ("read",): sheets.counters["read_calls"],
+            ("write",): sheets.counters["write_calls"]
+        }, ("kind",), kind="counter")
+        metrics.gauge("sheets_merged_requests_total", "Sheets requests served by another call", lambda: {
+            ("read",): sheets.counters["merged_reads"],
+            ("write",): sheets.counters["combined_writes"]
+        }, ("kind",), kind="counter")
+        metrics.gauge("sheets_throttled_total", "Google Sheets 429 responses", lambda: sheets.counters["throttled"],
+                      kind="counter")
+        if hasattr(self.storage, "analytics_sink"):
+            metrics.gauge("analytics_pending_rows", "Analytics rows waiting for a Google Sheets write",
+                          lambda: self.storage.analytics_sink.pending)
+
     async def initialize(self):
         """Инициализирует все сервисы"""
+        await self.normalizer.start()
         await self.sheets_client.initialize()
+        await self.storage.initialize()
+        if self.replicator:
+            await self.replicator.start()
+        await self.image_cache.start()
+        await self.result_cache.load()
+        await self.file_manager.start()
+        await self.photo_store.start()
+        await self.result_delivery.start()
+        await self.generation_queue.start()
+        await self.metrics_server.start()
+
+    async def shutdown(self):
+        """Останавливает фоновые задачи и сохраняет несохраненные данные"""
+        await self.metrics_server.stop()
+        await self.generation_queue.stop()
+        await self.photo_store.stop()
+        await self.file_manager.stop()
+        await self.result_delivery.stop()
+        await self.image_cache.stop()
+        self.normalizer.close()
+        if self.replicator:
+            await self.replicator.stop()
+        await self.storage.close()
+        await self.sheets_client.close()
@@ -0,0 +1,125 @@
+"""
+Фото в памяти: скачивание, валидация и загрузка в fal-ai работают с одним буфером байтов
+Временный файл создается только для фото больше порога и удаляется при закрытии
+"""
+import asyncio
+import hashlib
+from io import BytesIO
+from typing import Optional
+
+from config.settings import settings
+from storage.file_manager import StorageQuotaError
+from utils.logger import logger
+
+
+class PhotoBuffer:
+    """Фото пользователя: байты в памяти или, выше порога, во временном файле"""
+
+    def __init__(self, file_id: str, file_unique_id: str, file_manager=None, owner=None):
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        # FileManager учитывает временный файл за сессией owner
+        self.file_manager = file_manager
+        self.owner = owner
+        self.data: Optional[bytes] = None
+        self.spill_path: Optional[str] = None
+        self.size = 0
+        self.content_hash: Optional[str] = None
+        # Метаданные из валидатора (ImageInfo): формат, размеры, ориентация
+        self.info = None
+        # URL уже загруженного в fal-ai фото
+        self.url: Optional[str] = None
+        # Изображение уже известно кэшу: байты скачиваются только если понадобятся
+        self._bot = None
+
+    @classmethod
+    def from_cache(cls, bot, file_id: str, file_unique_id: str, content_hash: str,
+                   file_manager=None, owner=None) -> "PhotoBuffer":
+        """Фото, для которого уже известны хэш содержимого и URL в fal-ai - без скачивания"""
+        photo = cls(file_id, file_unique_id, file_manager, owner)
+        photo.content_hash = content_hash
+        photo._bot = bot
+        return photo
+
+    @classmethod
+    def from_url(cls, file_id: str, file_unique_id: str, content_hash: str, url: str) -> "PhotoBuffer":
+        """Фото, уже загруженное в fal-ai, - для повторного рендера без скачивания и загрузки"""
+        photo = cls(file_id, file_unique_id)
+        photo.content_hash = content_hash
+        photo.url = url
+        return photo
+
+    @property
+    def is_loaded(self) -> bool:
+        """Скачаны ли байты фото"""
+        return self.data is not None or self.spill_path is not None
+
+    async def download(self, bot, spill_threshold: Optional[int] = None) -> "PhotoBuffer":
+        """
+        Скачивает фото из Telegram в память
+
+        Размер известен заранее из getFile: фото больше порога скачивается
+        сразу во временный файл, без промежуточной копии в памяти. Если временное
+        хранилище заполнено, фото остается в памяти.
+        """
+        threshold = spill_threshold if spill_threshold is not None else settings.photo_spill_threshold
+        file_info = await bot.get_file(self.file_id)
+
+        if self.file_manager and file_info.file_size and file_info.file_size > threshold:
+            try:
+                self.spill_path = self.file_manager.allocate(self.owner, size_hint=file_info.file_size)
+            except StorageQuotaError as e:
+                logger.warning(f"Photo kept in memory: {e}")
+
+        if self.spill_path:
+            await bot.download_file(file_info.file_path, self.spill_path)
+            self.size = self.file_manager.commit(self.spill_path)
+            self.content_hash = await asyncio.to_thread(self._hash_file, self.spill_path)
+            logger.info(f"Photo spilled to disk ({self.size} bytes): {self.spill_path}")
+        else:
+            buffer = await bot.download_file(file_info.file_path)
+            self.data = buffer.getvalue()
+            self.size = len(self.data)
+            self.content_hash = hashlib.sha256(self.data).hexdigest()
+            logger.info(f"Photo downloaded to memory ({self.size} bytes)")
+        self._bot = None
+        return self
+
+    @staticmethod
+    def _hash_file(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    async def read(self) -> bytes:
+        """Возвращает содержимое фото; фото из кэша при необходимости докачивается"""
+        if not self.is_loaded and self._bot is not None:
+            await self.download(self._bot)
+        if self.data is not None:
+            return self.data
+        if self.spill_path is not None:
+            return await asyncio.to_thread(self._read_file, self.spill_path)
+        raise ValueError(f"Photo {self.file_unique_id} has no content")
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    def open(self):
+        """Файловый объект для PIL без копирования байтов"""
+        if self.data is not None:
+            return BytesIO(self.data)
+        if self.spill_path is not None:
+            return open(self.spill_path, "rb")
+        raise ValueError(f"Photo {self.file_unique_id} has no content")
+
+    def close(self) -> None:
+        """Освобождает память и удаляет временный файл"""
+        self.data = None
+        self.info = None
+        if self.spill_path:
+            self.file_manager.release(self.spill_path)
+            self.spill_path = None
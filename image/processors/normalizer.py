@@ -0,0 +1,118 @@
+"""
+Нормализация фото перед загрузкой в fal-ai: поворот по EXIF, уменьшение до рабочего размера модели, пережатие
+Пережатие результатов примерки для отправки фотографией в Telegram
+Работа с пикселями выполняется в пуле процессов, чтобы не блокировать event loop бота
+"""
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Dict, Any
+
+from config.settings import settings
+from image.processors.transforms import NormalizedImage, normalize_image, encode_result_image
+from utils.logger import logger
+
+
+class ImageNormalizer:
+    """Пул процессов для нормализации фото и счетчики сэкономленных байтов"""
+
+    # fork из процесса с потоками (asyncio.to_thread, очередь loguru, aiohttp) может оставить
+    # в дочернем процессе захваченную блокировку - воркеры запускаются чистым интерпретатором.
+    # spawn заново импортирует главный модуль, поэтому utils/logger.py не добавляет файловый sink
+    # в дочерних процессах, а сами преобразования лежат в transforms.py без настроек и логгера
+    START_METHOD = "spawn"
+
+    def __init__(self, workers: Optional[int] = None):
+        self.workers = workers or settings.image_workers
+        self.max_width = settings.normalize_max_width
+        self.max_height = settings.normalize_max_height
+        self.quality = settings.normalize_quality
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+        self.counters = {
+            "processed": 0,
+            "skipped": 0,
+            "changed": 0,
+            "failed": 0,
+            "bytes_in": 0,
+            "bytes_out": 0
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context(self.START_METHOD))
+        return self._executor
+
+    async def start(self) -> None:
+        """Создает пул при запуске бота и дожидается воркеров, чтобы первое фото не ждало их старта"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*(loop.run_in_executor(executor, int) for _ in range(self.workers)))
+
+    def is_needed(self, info) -> bool:
+        """
+        Решает по метаданным валидатора (ImageInfo), нужна ли нормализация
+
+        JPEG без поворота, который уже помещается в рамку, не отправляется в пул процессов.
+        """
+        if info is None or info.format != "JPEG" or info.orientation != 1:
+            return True
+        long_side, short_side = max(self.max_width, self.max_height), min(self.max_width, self.max_height)
+        return max(info.width, info.height) > long_side or min(info.width, info.height) > short_side
+
+    async def normalize(self, data: bytes, info=None) -> NormalizedImage:
+        """
+        Нормализует фото в пуле процессов
+
+        При ошибке возвращает исходные байты - загрузка в fal-ai не должна
+        срываться из-за нормализации.
+        """
+        if not self.is_needed(info):
+            self.counters["skipped"] += 1
+            return NormalizedImage(data, len(data), info.width, info.height, changed=False)
+
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(
+                self._get_executor(), normalize_image,
+                data, self.max_width, self.max_height, self.quality
+            )
+        except BrokenProcessPool as e:
+            # Процесс пула убит (например, OOM) - пересоздадим пул при следующем вызове
+            logger.error(f"Image normalization pool is broken: {e}")
+            self._executor = None
+            self.counters["failed"] += 1
+            return NormalizedImage(data, len(data), 0, 0, changed=False)
+        except Exception as e:
+            logger.warning(f"Image normalization failed, uploading original: {e}")
+            self.counters["failed"] += 1
+            return NormalizedImage(data, len(data), 0, 0, changed=False)
+
+        self.counters["processed"] += 1
+        self.counters["changed"] += int(result.changed)
+        self.counters["bytes_in"] += result.original_bytes
+        self.counters["bytes_out"] += len(result.data)
+        return result
+
+    async def encode_result(self, data: bytes, image_format: str, quality: int, max_side: int) -> bytes:
+        """Пережимает результат примерки в том же пуле процессов"""
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._get_executor(), encode_result_image, data, image_format, quality, max_side
+            )
+        except BrokenProcessPool:
+            self._executor = None
+            raise
+
+    def close(self) -> None:
+        """Останавливает процессы пула"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает число обработанных фото и сэкономленные байты"""
+        return {**self.counters, "bytes_saved": self.counters["bytes_in"] - self.counters["bytes_out"]}
@@ -0,0 +1,91 @@
+"""
+Преобразования фото, которые выполняются в процессах пула ImageNormalizer
+Модуль зависит только от Pillow: дочерний процесс не читает настройки и не настраивает логирование ради этих функций
+"""
+from io import BytesIO
+from dataclasses import dataclass
+
+from PIL import Image, ImageOps
+
+
+# Тег EXIF с ориентацией снимка
+EXIF_ORIENTATION = 0x0112
+
+
+@dataclass
+class NormalizedImage:
+    """Результат нормализации"""
+    data: bytes
+    original_bytes: int
+    width: int
+    height: int
+    changed: bool
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - len(self.data)
+
+
+def normalize_image(data: bytes, max_width: int, max_height: int, quality: int) -> NormalizedImage:
+    """
+    Приводит фото к размеру не больше max_width x max_height (с учетом ориентации кадра)
+
+    Выполняется в дочернем процессе. JPEG декодируется сразу в уменьшенном масштабе (draft),
+    остальное уменьшение идет через reduce/thumbnail. Фото, которое уже подходит
+    по размеру и не требует поворота, возвращается без пережатия.
+    """
+    with Image.open(BytesIO(data)) as img:
+        width, height = img.size
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        rotated = orientation in (5, 6, 7, 8)
+        # Для горизонтального кадра (как его увидит пользователь) меняем стороны рамки местами
+        landscape = (height > width) if rotated else (width > height)
+        if landscape != (max_width > max_height):
+            max_width, max_height = max_height, max_width
+        if rotated:
+            # Уменьшаем до поворота - рамка в координатах исходного кадра
+            max_width, max_height = max_height, max_width
+
+        fits = width <= max_width and height <= max_height
+        if fits and orientation == 1 and img.format == "JPEG":
+            return NormalizedImage(data, len(data), width, height, changed=False)
+
+        if img.format == "JPEG":
+            img.draft("RGB", (max_width, max_height))
+        img.thumbnail((max_width, max_height), Image.LANCZOS, reducing_gap=2.0)
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        output = BytesIO()
+        img.save(output, "JPEG", quality=quality, optimize=True)
+        result = output.getvalue()
+
+    # Пережатие без уменьшения и поворота могло только увеличить файл
+    if len(result) >= len(data) and fits and orientation == 1:
+        return NormalizedImage(data, len(data), width, height, changed=False)
+    return NormalizedImage(result, len(data), img.width, img.height, changed=True)
+
+
+def encode_result_image(data: bytes, image_format: str, quality: int, max_side: int) -> bytes:
+    """
+    Пережимает результат примерки (PNG из fal-ai) в JPEG/WebP для отправки фотографией в Telegram
+
+    Выполняется в дочернем процессе. Прозрачность заливается белым фоном.
+    """
+    with Image.open(BytesIO(data)) as img:
+        img.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+
+        output = BytesIO()
+        if image_format == "WEBP":
+            img.save(output, "WEBP", quality=quality, method=4)
+        else:
+            img.save(output, "JPEG", quality=quality, optimize=True)
+        return output.getvalue()
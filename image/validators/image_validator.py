@@ -1,21 +1,112 @@
 """
-Валидация изображений - минимальный функционал
+Валидация изображений за один проход: сигнатура, формат, размеры и защита от decompression bomb
+проверяются по заголовку, полное декодирование - только когда без него не обойтись
 """
+import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
 from PIL import Image
+
+from config.settings import settings
 from utils.logger import logger
 
 
-def validate_image(image_path):
+# Тег EXIF с ориентацией снимка
+EXIF_ORIENTATION = 0x0112
+
+# Сигнатуры допустимых форматов: формат PIL -> проверка первых байтов файла
+MAGIC_BYTES = {
+    "JPEG": lambda head: head.startswith(b"\xff\xd8\xff"),
+    "PNG": lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"),
+    "WEBP": lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+}
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    """Метаданные проверенного изображения для следующих этапов обработки"""
+    format: str
+    width: int
+    height: int
+    orientation: int
+    content_hash: Optional[str]
+    size_bytes: int
+
+
+def _detect_format(head: bytes) -> Optional[str]:
+    for image_format, matches in MAGIC_BYTES.items():
+        if matches(head):
+            return image_format
+    return None
+
+
+def _has_jpeg_end(image_source) -> bool:
+    """Проверяет маркер конца JPEG - у обрезанного файла его нет"""
+    image_source.seek(-2, 2)
+    return image_source.read(2) == b"\xff\xd9"
+
+
+def validate_image(image_source, content_hash: Optional[str] = None) -> Optional[ImageInfo]:
     """
-    Валидирует и загружает изображение
-    Возвращает PIL Image или None при ошибке
+    Валидирует изображение и возвращает его метаданные
+
+    Args:
+        image_source: Файловый объект (например, PhotoBuffer.open())
+        content_hash: Уже посчитанный хэш содержимого
+
+    Returns:
+        ImageInfo или None, если изображение не прошло проверку
     """
     try:
-        img = Image.open(image_path)
-        img.verify()  # Проверяет целостность
-        img = Image.open(image_path)  # Повторно открываем после verify
-        logger.info(f"Image validated: {image_path}")
-        return img
+        head = image_source.read(16)
+        detected = _detect_format(head)
+        if detected is None or detected not in settings.image_allowed_formats:
+            logger.error(f"Invalid image: unsupported signature {head[:4].hex()}")
+            return None
+
+        image_source.seek(0, 2)
+        size_bytes = image_source.tell()
+        image_source.seek(0)
+
+        # Image.open читает только заголовок
+        img = Image.open(image_source, formats=[detected])
+        width, height = img.size
+        if min(width, height) < settings.image_min_side:
+            logger.error(f"Invalid image: too small {width}x{height}")
+            return None
+        if width * height > settings.image_max_pixels:
+            logger.error(f"Invalid image: too many pixels {width}x{height}")
+            return None
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+
+        # Целый JPEG (Telegram всегда присылает фото в JPEG) не декодируем;
+        # обрезанный JPEG и остальные форматы проверяем полным декодированием
+        if detected != "JPEG" or not _has_jpeg_end(image_source):
+            image_source.seek(0)
+            img = Image.open(image_source, formats=[detected])
+            img.load()
+
+        info = ImageInfo(detected, width, height, orientation, content_hash, size_bytes)
+        logger.info(f"Image validated: {info.format} {info.width}x{info.height}, orientation {info.orientation}")
+        return info
+    except (Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        logger.error(f"Invalid image, decompression bomb: {e}")
+        return None
     except Exception as e:
-        logger.error(f"Invalid image {image_path}: {e}")
-        return None
\ No newline at end of file
+        logger.error(f"Invalid image: {e}")
+        return None
+
+
+async def validate_photo(photo) -> Optional[ImageInfo]:
+    """
+    Валидирует PhotoBuffer в пуле потоков, не блокируя event loop
+
+    Метаданные сохраняются в photo.info, чтобы следующие этапы не открывали изображение заново.
+    """
+    def run():
+        with photo.open() as source:
+            return validate_image(source, photo.content_hash)
+
+    photo.info = await asyncio.to_thread(run)
+    return photo.info
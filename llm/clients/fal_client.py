@@ -1,88 +1,265 @@
 """
 Клиент для работы с fal-ai API - виртуальная примерка одежды
+Загрузка фото в хранилище fal-ai и генерация на провайдере, выбранном роутером
 """
 import os
+import time
+import asyncio
+from typing import Optional, Dict, Any, List
 from config.settings import settings
+from llm.clients.resilience import ResiliencePolicy, CircuitOpenError
+from llm.providers.base import STAGE_UPLOADING, STAGE_DONE, MODE_QUALITY, ProgressCallback, report_progress
+from llm.providers.router import ProviderRouter, build_router
+from utils.errors import is_transient
 from utils.logger import logger
+from utils.metrics import metrics
 
 
 class FalClient:
-    """Клиент для fal-ai FASHN Virtual Try-On API"""
-    
-    def __init__(self):
+    """Клиент виртуальной примерки: загрузки в fal-ai, кэши и маршрутизация по провайдерам"""
+
+    def __init__(self, image_cache=None, result_cache=None, normalizer=None,
+                 resilience: Optional[ResiliencePolicy] = None, router: Optional[ProviderRouter] = None):
         self.api_key = settings.llm_api_key
+        # Пространство ключей кэша результатов: результат любого провайдера отвечает на тот же запрос
         self.model = settings.llm_model
-        
+
         # Устанавливаем переменную окружения для fal-client
         os.environ['FAL_KEY'] = self.api_key
-    
-    async def virtual_tryon(self, person_image_path, garment_image_path):
+
+        # Ограничиваем количество одновременных примерок
+        self._semaphore = asyncio.Semaphore(settings.fal_max_concurrency)
+
+        # Кэш изображений для повторного использования URL загрузок
+        self.image_cache = image_cache
+
+        # Кэш готовых результатов примерки
+        self.result_cache = result_cache
+
+        # Поворот, уменьшение и пережатие фото перед загрузкой
+        self.normalizer = normalizer
+
+        # Загрузки в процессе по хэшу содержимого: одно фото человека в параллельных
+        # примерках с разными вещами загружается один раз
+        self._uploads: Dict[str, asyncio.Future] = {}
+
+        # Повторы загрузок; у генераций своя политика на каждом провайдере
+        self.resilience = resilience or ResiliencePolicy()
+
+        # Выбор модели по задержкам и ошибкам, fallback и canary
+        self.router = router or build_router()
+
+    @property
+    def is_degraded(self) -> bool:
+        """Все провайдеры недоступны (circuit breaker открыт) - новые генерации отклоняются сразу"""
+        return self.router.is_degraded
+
+    async def _upload(self, photo):
+        """
+        Загружает фото в хранилище fal-ai, не блокируя event loop
+
+        Args:
+            photo: PhotoBuffer с байтами фото
+
+        Returns:
+            (URL загруженного файла, сэкономленные нормализацией байты)
+        """
+        content_hash = photo.content_hash if self.image_cache else None
+        if content_hash:
+            cached_url = self.image_cache.get_url(content_hash)
+            if cached_url:
+                logger.info(f"Upload skipped, cached URL used for {content_hash}")
+                return cached_url, 0
+
+        # Фото уже загружено в fal-ai (повторный рендер) - используем тот же URL
+        if photo.url:
+            return photo.url, 0
+
+        inflight = self._uploads.get(photo.content_hash) if photo.content_hash else None
+        if inflight is not None:
+            url = await asyncio.shield(inflight)
+            if url:
+                logger.info(f"Upload of {photo.content_hash} already in progress, URL reused")
+                return url, 0
+
+        if not photo.content_hash:
+            return await self._upload_bytes(photo, content_hash)
+
+        future = asyncio.get_running_loop().create_future()
+        self._uploads[photo.content_hash] = future
+        url = None
+        try:
+            url, bytes_saved = await self._upload_bytes(photo, content_hash)
+            return url, bytes_saved
+        finally:
+            self._uploads.pop(photo.content_hash, None)
+            # Ожидающие при неудаче загружают фото сами
+            future.set_result(url)
+
+    async def _upload_bytes(self, photo, content_hash: Optional[str]):
+        """Нормализует и загружает байты фото, запоминая URL в кэше изображений"""
+        import fal_client
+
+        # Загружаем те же байты, что скачаны из Telegram и прошли валидацию
+        data = await photo.read()
+        bytes_saved = 0
+        if self.normalizer:
+            with metrics.stage("normalize"):
+                normalized = await self.normalizer.normalize(data, photo.info)
+            data, bytes_saved = normalized.data, normalized.bytes_saved
+        with metrics.stage("upload"):
+            url = await fal_client.upload_async(data, "image/jpeg", f"{photo.file_unique_id}.jpg")
+        # Следующие примерки с этим фото (другие вещи той же сессии) не загружают его снова
+        photo.url = url
+
+        if content_hash:
+            self.image_cache.set_url(content_hash, url)
+        return url, bytes_saved
+
+    @staticmethod
+    def _tryon_arguments(mode: str = MODE_QUALITY, num_samples: int = 1):
+        """Параметры генерации без URL изображений"""
+        return {
+            "category": "auto",
+            "mode": mode,
+            "garment_photo_type": "auto",
+            "num_samples": num_samples,
+            "seed": 42,
+            "output_format": "png"
+        }
+
+    async def virtual_tryon(self, person, garment, on_progress: Optional[ProgressCallback] = None,
+                            mode: str = MODE_QUALITY, num_samples: int = 1):
         """
         Выполняет виртуальную примерку одежды
-        
+
+        Одинаковые запросы (те же изображения, модель и параметры) отдаются из
+        кэша результатов без повторной генерации. Отмена вызывающей задачи
+        отменяет и запрос в очереди fal-ai.
+
         Args:
-            person_image_path: Путь к фото человека
-            garment_image_path: Путь к фото одежды
-            
+            person: PhotoBuffer с фото человека
+            garment: PhotoBuffer с фото одежды
+            on_progress: Колбэк стадий генерации (uploading → queued → in_progress → done)
+            mode: MODE_PERFORMANCE (быстрый предпросмотр) или MODE_QUALITY
+            num_samples: Сколько вариантов сгенерировать за один запрос
+
         Returns:
             Словарь с URL изображений или None при ошибке:
             {
                 'person_url': str,
-                'garment_url': str, 
-                'result_url': str
+                'garment_url': str,
+                'result_url': str,  # первый вариант
+                'result_urls': list,  # все варианты
+                'cached': bool,  # результат получен без новой генерации
+                'mode': str
             }
         """
         try:
-            import fal_client
-            
-            logger.info(f"Starting virtual try-on with person: {person_image_path}, garment: {garment_image_path}")
-            
-            # Загружаем изображения
-            logger.info("Uploading person image...")
-            person_image_url = fal_client.upload_file(person_image_path)
-            logger.info(f"Person image uploaded: {person_image_url}")
-            
-            logger.info("Uploading garment image...")
-            garment_image_url = fal_client.upload_file(garment_image_path)
-            logger.info(f"Garment image uploaded: {garment_image_url}")
-            
-            # Отправляем запрос на виртуальную примерку
-            logger.info("Submitting virtual try-on request...")
-            result = fal_client.subscribe(
-                self.model,
-                arguments={
-                    "model_image": person_image_url,
-                    "garment_image": garment_image_url,
-                    "category": "auto",
-                    "mode": "quality",
-                    "garment_photo_type": "auto",
-                    "num_samples": 1,
-                    "seed": 42,
-                    "output_format": "png"
-                },
-                with_logs=True
-            )
-            
-            logger.info(f"Received result: {result}")
-            
-            # Извлекаем URL результата
-            if result and "images" in result and len(result["images"]) > 0:
-                result_url = result["images"][0]["url"]
-                logger.info(f"Virtual try-on completed successfully: {result_url}")
-                
-                # Возвращаем все URL для аналитики
-                return {
-                    'person_url': person_image_url,
-                    'garment_url': garment_image_url,
-                    'result_url': result_url
-                }
+            arguments = self._tryon_arguments(mode, num_samples)
+            if not self.result_cache:
+                result = await self._run_tryon(person, garment, arguments, on_progress)
             else:
-                logger.error(f"No images in fal-ai response. Full result: {result}")
-                return None
-                
+                # Режим входит в параметры, поэтому предпросмотр и финальный рендер кэшируются отдельно
+                key = self.result_cache.make_key(person.content_hash, garment.content_hash, self.model, arguments)
+                result = await self.result_cache.get_or_create(
+                    key,
+                    lambda: self._run_tryon(person, garment, arguments, on_progress)
+                )
+            return {**result, 'mode': mode} if result else None
+        except Exception as e:
+            logger.error(f"Virtual try-on failed: {e}")
+            return None
+
+    async def _generate(self, person_url: str, garment_url: str, arguments: Dict[str, Any],
+                        on_progress: Optional[ProgressCallback], attempted: List[str]):
+        """
+        Генерация на провайдерах в порядке роутера: при ошибке провайдера - на следующем
+
+        Returns:
+            (имя провайдера, URL результатов)
+        """
+        mode = arguments["mode"]
+        candidates = self.router.candidates(mode)
+        if not candidates:
+            raise CircuitOpenError("All try-on providers are degraded")
+
+        error: Optional[Exception] = None
+        for provider in candidates:
+            if attempted:
+                self.router.record_fallback(provider.name)
+            attempted.append(provider.name)
+            started = time.monotonic()
+            try:
+                with metrics.stage("inference"):
+                    result_urls = await provider.run(person_url, garment_url, arguments, on_progress)
+            except CircuitOpenError as e:
+                error = e
+                continue
+            except Exception as e:
+                # Отказ по входным данным (4xx) не говорит о здоровье провайдера
+                if is_transient(e):
+                    self.router.record(provider.name, mode, time.monotonic() - started, ok=False)
+                logger.error(f"Try-on provider {provider.name} failed: {e}")
+                error = e
+                continue
+            self.router.record(provider.name, mode, time.monotonic() - started, ok=True)
+            return provider.name, result_urls
+        raise error
+
+    async def _run_tryon(self, person, garment, arguments, on_progress: Optional[ProgressCallback] = None):
+        """Загружает изображения и выполняет генерацию через очередь fal-ai"""
+        try:
+            async with self._semaphore:
+                logger.info(f"Starting virtual try-on with person: {person.content_hash}, garment: {garment.content_hash}")
+                await report_progress(on_progress, STAGE_UPLOADING)
+
+                # Загружаем оба изображения параллельно
+                logger.info("Uploading person and garment images...")
+                (person_image_url, person_saved), (garment_image_url, garment_saved) = await asyncio.gather(
+                    # Хранилище файлов fal-ai - отдельный сервис, breaker следит только за генерациями
+                    self.resilience.call("upload", lambda: self._upload(person), guarded=False),
+                    self.resilience.call("upload", lambda: self._upload(garment), guarded=False)
+                )
+                logger.info(f"Images uploaded: person={person_image_url}, garment={garment_image_url}, "
+                            f"normalization saved {person_saved + garment_saved} bytes")
+
+                # Генерация на провайдере, выбранном роутером; FAL_TIMEOUT - общий бюджет
+                # на все попытки и запасные провайдеры
+                logger.info("Submitting virtual try-on request...")
+                attempted: List[str] = []
+                try:
+                    async with asyncio.timeout(settings.fal_timeout):
+                        provider, result_urls = await self._generate(
+                            person_image_url, garment_image_url, arguments, on_progress, attempted
+                        )
+                except TimeoutError:
+                    logger.error(f"Virtual try-on timed out after {settings.fal_timeout}s on {attempted[-1:]}")
+                    if attempted:
+                        self.router.record(attempted[-1], arguments["mode"], settings.fal_timeout, ok=False)
+                        self.router.providers[attempted[-1]].resilience.breaker.record_failure()
+                    return None
+                await report_progress(on_progress, STAGE_DONE)
+
+            logger.info(f"Virtual try-on completed successfully on {provider}: {result_urls}")
+
+            # Возвращаем все URL для аналитики
+            return {
+                'person_url': person_image_url,
+                'garment_url': garment_image_url,
+                'result_url': result_urls[0],
+                'result_urls': result_urls,
+                'cached': False,
+                'provider': provider
+            }
+
         except ImportError:
             logger.error("fal-client library not installed. Run: pip install fal-client")
             return None
         except Exception as e:
             logger.error(f"Virtual try-on failed: {e}")
-            return None
\ No newline at end of file
+            return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает исходы попыток загрузок и статистику провайдеров генерации"""
+        return {"uploads": self.resilience.get_stats(), "router": self.router.get_stats()}
@@ -0,0 +1,249 @@
+"""
+Политика устойчивости вызовов fal-ai: повторы с jitter, хеджирование долгих запросов, circuit breaker
+Каждая попытка записывается с длительностью и исходом
+"""
+import time
+import random
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, Callable, Awaitable, Deque, TypeVar
+
+from config.settings import settings
+from utils.errors import is_transient
+from utils.logger import logger
+
+
+T = TypeVar("T")
+
+
+class CircuitOpenError(Exception):
+    """fal-ai недоступен: запросы отклоняются без обращения к сервису"""
+
+
+class CircuitBreaker:
+    """
+    Закрыт - запросы идут; после threshold временных ошибок подряд открывается на cooldown секунд,
+    затем пропускает один пробный запрос (half-open)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, threshold: Optional[int] = None, cooldown: Optional[float] = None):
+        self.threshold = threshold or settings.fal_breaker_threshold
+        self.cooldown = cooldown or settings.fal_breaker_cooldown
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.counters = {"opened": 0, "rejected": 0}
+
+    @property
+    def is_open(self) -> bool:
+        """
+        Отклоняются ли запросы сейчас (сервис деградировал)
+
+        После cooldown breaker считается закрытым, пока пробный запрос не начался:
+        иначе отказ до обращения к сервису не дал бы пробному запросу случиться.
+        """
+        if self.state == self.OPEN:
+            return time.monotonic() - self._opened_at < self.cooldown
+        if self.state == self.HALF_OPEN:
+            return self._probe_in_flight
+        return False
+
+    def allow(self) -> bool:
+        """Можно ли выполнить запрос сейчас"""
+        if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+            self.state = self.HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        self.counters["rejected"] += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info("fal-ai circuit breaker closed")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self._failures >= self.threshold):
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self.counters["opened"] += 1
+            logger.warning(f"fal-ai circuit breaker opened after {self._failures} failures, "
+                           f"retry in {self.cooldown}s")
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.counters, "state": self.state, "consecutive_failures": self._failures}
+
+
+class LatencyTracker:
+    """Скользящее окно длительностей успешных попыток по ключу (режим генерации)"""
+
+    def __init__(self, window: int = 200):
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def add(self, key: str, seconds: float) -> None:
+        self._samples.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, key: str, percentile: float, min_samples: int = 1) -> Optional[float]:
+        """Перцентиль длительности или None, если замеров меньше min_samples"""
+        samples = self._samples.get(key)
+        if not samples or len(samples) < min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(int(len(ordered) * percentile / 100), len(ordered) - 1)
+        return ordered[index]
+
+
+@dataclass
+class AttemptRecord:
+    """Одна попытка вызова fal-ai"""
+    operation: str
+    attempt: int
+    started: float  # time.time() начала попытки
+    duration: float
+    outcome: str  # ok, transient, error, cancelled, rejected
+    error: Optional[str] = None
+
+
+class ResiliencePolicy:
+    """Повторы с экспоненциальной задержкой и full jitter, хеджирование и circuit breaker"""
+
+    def __init__(self, attempts: Optional[int] = None, base_delay: Optional[float] = None,
+                 max_delay: Optional[float] = None, breaker: Optional[CircuitBreaker] = None):
+        self.attempts = max(attempts or settings.fal_retry_attempts, 1)
+        self.base_delay = base_delay if base_delay is not None else settings.fal_retry_base_delay
+        self.max_delay = max_delay if max_delay is not None else settings.fal_retry_max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self.hedge_percentile = settings.fal_hedge_percentile
+        self.hedge_min_samples = settings.fal_hedge_min_samples
+        self.latency = LatencyTracker()
+
+        # Последние попытки для диагностики
+        self.records: Deque[AttemptRecord] = deque(maxlen=settings.fal_attempt_log_size)
+        # "<операция>_<исход>" -> количество попыток
+        self.counters: Dict[str, int] = {}
+
+    def backoff(self, attempt: int) -> float:
+        """Задержка перед повтором: случайная в [0, min(max_delay, base_delay * 2^(attempt-1))]"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _record(self, operation: str, attempt: int, started: float, wall_started: float,
+                outcome: str, error: Optional[BaseException] = None) -> float:
+        duration = time.monotonic() - started
+        self.records.append(AttemptRecord(operation, attempt, wall_started, duration, outcome,
+                                          repr(error) if error else None))
+        key = f"{operation}_{outcome}"
+        self.counters[key] = self.counters.get(key, 0) + 1
+        if outcome == "ok":
+            logger.info(f"fal-ai {operation} attempt {attempt} succeeded in {duration:.2f}s")
+        else:
+            logger.warning(f"fal-ai {operation} attempt {attempt} {outcome} after {duration:.2f}s: {error}")
+        return duration
+
+    async def call(self, operation: str, func: Callable[[], Awaitable[T]],
+                   latency_key: Optional[str] = None, guarded: bool = True) -> T:
+        """
+        Выполняет func с повторами временных ошибок
+
+        Args:
+            operation: Имя операции для записей попыток (upload, inference)
+            func: Корутина-функция одной попытки
+            latency_key: Ключ для замера длительности успешных попыток (для хеджирования)
+            guarded: Учитывать ли операцию в circuit breaker
+
+        Raises:
+            CircuitOpenError: breaker открыт
+            Exception: последняя ошибка, если попытки кончились или ошибка не временная
+        """
+        for attempt in range(1, self.attempts + 1):
+            started, wall_started = time.monotonic(), time.time()
+            if guarded and not self.breaker.allow():
+                self._record(operation, attempt, started, wall_started, "rejected")
+                raise CircuitOpenError("fal-ai is degraded, request rejected")
+            try:
+                result = await func()
+            except asyncio.CancelledError:
+                self._record(operation, attempt, started, wall_started, "cancelled")
+                raise
+            except Exception as e:
+                transient = is_transient(e)
+                self._record(operation, attempt, started, wall_started, "transient" if transient else "error", e)
+                if not transient:
+                    # Сервис ответил - для breaker это не сбой
+                    if guarded:
+                        self.breaker.record_success()
+                    raise
+                if guarded:
+                    self.breaker.record_failure()
+                if attempt == self.attempts:
+                    raise
+                await asyncio.sleep(self.backoff(attempt))
+                continue
+
+            if guarded:
+                self.breaker.record_success()
+            duration = self._record(operation, attempt, started, wall_started, "ok")
+            if latency_key:
+                self.latency.add(latency_key, duration)
+            return result
+
+    def hedge_delay(self, latency_key: str) -> Optional[float]:
+        """Через сколько секунд отправлять дублирующий запрос; None - хеджирование выключено"""
+        if not self.hedge_percentile:
+            return None
+        return self.latency.percentile(latency_key, self.hedge_percentile, self.hedge_min_samples)
+
+    async def hedged(self, operation: str, func: Callable[[bool], Awaitable[T]], latency_key: str) -> T:
+        """
+        Запускает func(primary=True); если он не завершился за перцентиль FAL_HEDGE_PERCENTILE
+        прошлых длительностей, параллельно запускает func(primary=False). Побеждает первый
+        успешный результат, проигравший отменяется.
+        """
+        delay = self.hedge_delay(latency_key)
+        primary = asyncio.create_task(func(True))
+        if delay is None:
+            return await primary
+
+        pending = {primary}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                logger.info(f"fal-ai {operation} slower than p{self.hedge_percentile:g} ({delay:.1f}s), "
+                            f"sending hedged request")
+                self.counters[f"{operation}_hedged"] = self.counters.get(f"{operation}_hedged", 0) + 1
+                pending.add(asyncio.create_task(func(False)))
+
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.counters[f"{operation}_hedge_won"] = self.counters.get(f"{operation}_hedge_won", 0) + 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Проигравший запрос отменяется вместе с запросом в очереди fal-ai
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает исходы попыток по операциям и состояние breaker"""
+        return {**self.counters, "breaker": self.breaker.get_stats()}
@@ -0,0 +1,84 @@
+"""
+Интерфейс провайдера виртуальной примерки (модели, к которой маршрутизируются генерации)
+"""
+from abc import ABC, abstractmethod
+from typing import Optional, Callable, Awaitable, Dict, Any, List
+
+from llm.clients.resilience import ResiliencePolicy
+from utils.logger import logger
+
+
+# Стадии генерации для колбэка прогресса
+STAGE_UPLOADING = "uploading"
+STAGE_QUEUED = "queued"
+STAGE_IN_PROGRESS = "in_progress"
+STAGE_DONE = "done"
+
+# Режимы генерации: быстрый предпросмотр и финальный рендер
+MODE_PERFORMANCE = "performance"
+MODE_QUALITY = "quality"
+
+# Колбэк прогресса: (стадия, позиция в очереди fal-ai или None)
+ProgressCallback = Callable[[str, Optional[int]], Awaitable[None]]
+
+
+async def report_progress(on_progress: Optional[ProgressCallback], stage: str, position: Optional[int] = None):
+    """Вызывает колбэк прогресса; его ошибки не должны прерывать генерацию"""
+    if on_progress is None:
+        return
+    try:
+        await on_progress(stage, position)
+    except Exception as e:
+        logger.warning(f"Progress callback failed at stage {stage}: {e}")
+
+
+class TryOnProvider(ABC):
+    """Модель виртуальной примерки"""
+
+    def __init__(self, name: str, resilience: Optional[ResiliencePolicy] = None):
+        self.name = name
+        # Повторы, хеджирование и circuit breaker - отдельно для каждой модели
+        self.resilience = resilience or ResiliencePolicy()
+
+    @property
+    def is_degraded(self) -> bool:
+        """Circuit breaker провайдера открыт - роутер его пропускает"""
+        return self.resilience.breaker.is_open
+
+    @abstractmethod
+    async def generate(self, person_url: str, garment_url: str, arguments: Dict[str, Any],
+                       on_progress: Optional[ProgressCallback] = None, primary: bool = True) -> List[str]:
+        """
+        Одна попытка генерации
+
+        Args:
+            person_url: URL фото человека в хранилище fal-ai
+            garment_url: URL фото одежды
+            arguments: Параметры генерации (FalClient._tryon_arguments)
+            on_progress: Колбэк стадий queued/in_progress
+            primary: False для дублирующего (хеджированного) запроса - он не сообщает стадии
+
+        Raises:
+            Exception: ошибка генерации; временные ошибки повторяются политикой
+
+        Returns:
+            URL результатов, по одному на вариант
+        """
+
+    async def run(self, person_url: str, garment_url: str, arguments: Dict[str, Any],
+                  on_progress: Optional[ProgressCallback] = None) -> List[str]:
+        """Генерация с повторами, хеджированием и circuit breaker провайдера"""
+        mode = arguments["mode"]
+        return await self.resilience.call(
+            "inference",
+            lambda: self.resilience.hedged(
+                "inference",
+                lambda primary: self.generate(person_url, garment_url, arguments, on_progress, primary),
+                mode
+            ),
+            latency_key=mode
+        )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает исходы попыток и состояние circuit breaker"""
+        return self.resilience.get_stats()
@@ -0,0 +1,53 @@
+"""
+Детерминированный локальный провайдер примерки без сети - для проверки маршрутизации офлайн
+"""
+import asyncio
+import hashlib
+import random
+from typing import Optional, Dict, Any, List
+
+from config.settings import settings
+from llm.providers.base import TryOnProvider, ProgressCallback, report_progress, STAGE_QUEUED, STAGE_IN_PROGRESS
+
+
+class FakeProviderError(ConnectionError):
+    """Имитация временного сбоя модели (повторяется политикой, как сетевая ошибка)"""
+
+
+class FakeTryOnProvider(TryOnProvider):
+    """
+    Отвечает через latency секунд (с разбросом ±jitter) и падает с вероятностью error_rate
+
+    Задержки и сбои выбираются генератором с seed, поэтому одна и та же
+    последовательность вызовов всегда дает один и тот же результат.
+    """
+
+    def __init__(self, name: str, latency: Optional[float] = None, error_rate: Optional[float] = None,
+                 jitter: float = 0.2, seed: int = 0, resilience=None):
+        super().__init__(name, resilience)
+        self.latency = latency if latency is not None else settings.fake_provider_latency
+        self.error_rate = error_rate if error_rate is not None else settings.fake_provider_error_rate
+        self.jitter = jitter
+        self._rng = random.Random(f"{seed}:{name}")
+        self.calls = 0
+
+    async def generate(self, person_url: str, garment_url: str, arguments: Dict[str, Any],
+                       on_progress: Optional[ProgressCallback] = None, primary: bool = True) -> List[str]:
+        self.calls += 1
+        delay = max(self.latency * (1 + self._rng.uniform(-self.jitter, self.jitter)), 0)
+        fails = self._rng.random() < self.error_rate
+
+        if primary:
+            await report_progress(on_progress, STAGE_QUEUED, 0)
+        await asyncio.sleep(delay / 2)
+        if primary:
+            await report_progress(on_progress, STAGE_IN_PROGRESS)
+        await asyncio.sleep(delay / 2)
+        if fails:
+            raise FakeProviderError(f"Fake provider {self.name} failed (call {self.calls})")
+
+        # Одинаковые входные данные дают одинаковые URL
+        digest = hashlib.sha256(f"{self.name}:{person_url}:{garment_url}:{sorted(arguments.items())}"
+                                .encode("utf-8")).hexdigest()[:16]
+        return [f"https://fake.local/{self.name}/{digest}/{index}.png"
+                for index in range(arguments.get("num_samples", 1))]
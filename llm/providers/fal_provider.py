@@ -0,0 +1,78 @@
+"""
+Провайдер примерки на модели fal-ai (FASHN Virtual Try-On и совместимые по параметрам)
+"""
+from typing import Optional, Dict, Any, List
+
+from config.settings import settings
+from llm.providers.base import (
+    TryOnProvider, ProgressCallback, report_progress, STAGE_QUEUED, STAGE_IN_PROGRESS
+)
+from utils.logger import logger
+from utils.tracing import log_payload
+
+
+class ProviderResultError(Exception):
+    """Модель ответила без изображений"""
+
+
+class FalTryOnProvider(TryOnProvider):
+    """Генерация через очередь fal-ai: submit_async, опрос статуса, отмена брошенного запроса"""
+
+    def __init__(self, name: str, model: str, resilience=None):
+        super().__init__(name, resilience)
+        self.model = model
+
+    async def generate(self, person_url: str, garment_url: str, arguments: Dict[str, Any],
+                       on_progress: Optional[ProgressCallback] = None, primary: bool = True) -> List[str]:
+        import fal_client
+
+        handle = await fal_client.submit_async(
+            self.model,
+            arguments={
+                "model_image": person_url,
+                "garment_image": garment_url,
+                **arguments
+            }
+        )
+        try:
+            # Стадии показывает только основной запрос, не дублирующий
+            result = await self._wait_result(handle, on_progress if primary else None)
+        except BaseException:
+            # Отмена, таймаут или сбой опроса - запрос не должен остаться в очереди fal-ai
+            await self._cancel_request(handle)
+            raise
+
+        # Полный ответ - только для выборки трасс, в остальных записях лишь число изображений
+        log_payload(f"Received result from {self.name}", result)
+        if not result or not result.get("images"):
+            raise ProviderResultError(f"No images in {self.model} response (keys: {sorted(result or {})})")
+        logger.info(f"Received {len(result['images'])} images from {self.name}")
+        return [image["url"] for image in result["images"]]
+
+    async def _wait_result(self, handle, on_progress: Optional[ProgressCallback]):
+        """Опрашивает статус запроса в очереди fal-ai до завершения и возвращает результат"""
+        import fal_client
+
+        last_stage = None
+        last_position = None
+        async for status in handle.iter_events(with_logs=False, interval=settings.fal_poll_interval):
+            if isinstance(status, fal_client.Queued):
+                if last_stage != STAGE_QUEUED or status.position != last_position:
+                    await report_progress(on_progress, STAGE_QUEUED, status.position)
+                last_stage, last_position = STAGE_QUEUED, status.position
+            elif isinstance(status, fal_client.InProgress):
+                if last_stage != STAGE_IN_PROGRESS:
+                    await report_progress(on_progress, STAGE_IN_PROGRESS)
+                last_stage = STAGE_IN_PROGRESS
+            elif isinstance(status, fal_client.Completed):
+                break
+        return await handle.get()
+
+    @staticmethod
+    async def _cancel_request(handle) -> None:
+        """Отменяет запрос в очереди fal-ai, чтобы брошенная генерация не занимала ресурсы"""
+        try:
+            await handle.cancel()
+            logger.info(f"fal-ai request {handle.request_id} cancelled")
+        except Exception as e:
+            logger.warning(f"Failed to cancel fal-ai request {handle.request_id}: {e}")
@@ -0,0 +1,157 @@
+"""
+Маршрутизация генераций между провайдерами примерки
+Порядок выбирается по скользящему окну задержек и доли ошибок, новая модель получает долю трафика (canary)
+"""
+import time
+import random
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Deque
+
+from config.settings import settings
+from llm.providers.base import TryOnProvider
+from llm.providers.fal_provider import FalTryOnProvider
+from llm.providers.fake_provider import FakeTryOnProvider
+from utils.logger import logger
+
+
+@dataclass
+class RouteSample:
+    """Исход генерации на провайдере"""
+    at: float  # time.monotonic()
+    mode: str
+    latency: float
+    ok: bool
+
+
+class ProviderRouter:
+    """
+    Выбирает порядок провайдеров для генерации
+
+    Провайдеры с открытым circuit breaker пропускаются. Остальные сортируются по медиане
+    задержки в режиме генерации, умноженной на (1 + доля ошибок); провайдеры с долей ошибок
+    выше max_error_rate идут последними. Canary-провайдер получает canary_weight генераций
+    первым, в остальных случаях он - запасной.
+    """
+
+    # Максимум замеров на провайдера внутри окна
+    MAX_SAMPLES = 1000
+
+    def __init__(self, providers: List[TryOnProvider], canary: Optional[str] = None, canary_weight: float = 0.0,
+                 window: Optional[float] = None, max_error_rate: Optional[float] = None,
+                 min_samples: Optional[int] = None, rng: Optional[random.Random] = None):
+        if not providers:
+            raise ValueError("At least one try-on provider is required")
+        self.providers: Dict[str, TryOnProvider] = {provider.name: provider for provider in providers}
+        if canary and canary not in self.providers:
+            raise ValueError(f"Canary provider {canary} is not registered")
+        self.canary = canary
+        self.canary_weight = canary_weight
+        self.window = window or settings.tryon_router_window
+        self.max_error_rate = max_error_rate if max_error_rate is not None else settings.tryon_router_max_error_rate
+        self.min_samples = min_samples or settings.tryon_router_min_samples
+        self._rng = rng or random.Random()
+
+        self._samples: Dict[str, Deque[RouteSample]] = {name: deque(maxlen=self.MAX_SAMPLES)
+                                                        for name in self.providers}
+        self.counters: Dict[str, int] = {"fallbacks": 0, "canary_first": 0}
+
+    @property
+    def is_degraded(self) -> bool:
+        """Все провайдеры недоступны - генерации отклоняются сразу"""
+        return all(provider.is_degraded for provider in self.providers.values())
+
+    def _window_samples(self, name: str) -> Deque[RouteSample]:
+        samples = self._samples[name]
+        deadline = time.monotonic() - self.window
+        while samples and samples[0].at < deadline:
+            samples.popleft()
+        return samples
+
+    def error_rate(self, name: str) -> Optional[float]:
+        """Доля ошибок в окне или None, если замеров меньше min_samples"""
+        samples = self._window_samples(name)
+        if len(samples) < self.min_samples:
+            return None
+        return sum(1 for sample in samples if not sample.ok) / len(samples)
+
+    def latency(self, name: str, mode: str) -> Optional[float]:
+        """Медиана задержки успешных генераций режима в окне"""
+        latencies = sorted(s.latency for s in self._window_samples(name) if s.ok and s.mode == mode)
+        if not latencies:
+            return None
+        return latencies[len(latencies) // 2]
+
+    def _score(self, name: str, mode: str) -> float:
+        latency = self.latency(name, mode)
+        if latency is None:
+            # Нет успешных замеров в окне - провайдер идет первым, чтобы их получить;
+            # постоянно падающий отсекается долей ошибок и circuit breaker
+            return 0.0
+        return latency * (1 + (self.error_rate(name) or 0.0))
+
+    def _is_unhealthy(self, name: str) -> bool:
+        rate = self.error_rate(name)
+        return rate is not None and rate > self.max_error_rate
+
+    def candidates(self, mode: str) -> List[TryOnProvider]:
+        """
+        Провайдеры в порядке попыток: первый - основной выбор, остальные - запасные
+
+        Returns:
+            Пустой список, если у всех провайдеров открыт circuit breaker
+        """
+        available = [p for p in self.providers.values() if not p.is_degraded]
+        canary = next((p for p in available if p.name == self.canary), None)
+        stable = [p for p in available if p is not canary]
+        # sorted устойчива: при равных оценках сохраняется порядок регистрации
+        ordered = sorted(stable, key=lambda p: (self._is_unhealthy(p.name), self._score(p.name, mode)))
+
+        if canary is not None:
+            if not self._is_unhealthy(canary.name) and self._rng.random() < self.canary_weight:
+                self.counters["canary_first"] += 1
+                ordered.insert(0, canary)
+            else:
+                ordered.append(canary)
+        return ordered
+
+    def record(self, name: str, mode: str, latency: float, ok: bool) -> None:
+        """Сохраняет исход генерации на провайдере"""
+        self._samples[name].append(RouteSample(time.monotonic(), mode, latency, ok))
+        key = f"{name}_{'ok' if ok else 'failed'}"
+        self.counters[key] = self.counters.get(key, 0) + 1
+
+    def record_fallback(self, name: str) -> None:
+        self.counters["fallbacks"] += 1
+        logger.warning(f"Falling back to try-on provider {name}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает по каждому провайдеру долю ошибок, медианы задержек и состояние политики"""
+        providers = {}
+        for name, provider in self.providers.items():
+            modes = {sample.mode for sample in self._window_samples(name)}
+            providers[name] = {
+                "error_rate": self.error_rate(name),
+                "latency_p50": {mode: self.latency(name, mode) for mode in modes},
+                "samples": len(self._samples[name]),
+                "canary": name == self.canary,
+                **provider.get_stats()
+            }
+        return {**self.counters, "providers": providers}
+
+
+def build_router() -> ProviderRouter:
+    """
+    Собирает роутер из TRYON_PROVIDERS ("имя=модель,имя=модель"; модель "fake" -
+    локальный FakeTryOnProvider) и TRYON_CANARY ("имя:доля")
+    """
+    providers: List[TryOnProvider] = []
+    for name, model in settings.tryon_providers:
+        if model == "fake":
+            providers.append(FakeTryOnProvider(name))
+        else:
+            providers.append(FalTryOnProvider(name, model))
+    logger.info(f"Try-on providers: {', '.join(f'{name}={model}' for name, model in settings.tryon_providers)}"
+                + (f", canary {settings.tryon_canary} at {settings.tryon_canary_weight:.0%}"
+                   if settings.tryon_canary else ""))
+    return ProviderRouter(providers, settings.tryon_canary, settings.tryon_canary_weight)
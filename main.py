@@ -1,40 +1,127 @@
 """
 Главный файл приложения - минималистичный запуск бота
+Режим получения обновлений выбирается настройкой BOT_MODE: polling или webhook
 """
+import signal
 import asyncio
+from typing import Set
+from aiohttp import web
 from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from config.settings import settings
 from container import Container
+from storage.fsm_storage import create_fsm_storage
 from bot.handlers.image_handler import create_router
+from bot.middlewares.inflight import InFlightMiddleware
 from utils.logger import logger
 
+# Сколько ждать обработчики, которые еще отвечают пользователям после остановки очереди (сек)
+HANDLERS_SHUTDOWN_TIMEOUT = 5
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    """Long polling - для локальной разработки"""
+    # Активный webhook мешает getUpdates - снимаем его
+    await bot.delete_webhook()
+    await dp.start_polling(bot)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """
+    Webhook через aiohttp: Telegram получает ответ сразу, обработка идет в фоновых задачах
+
+    Работает до SIGTERM/SIGINT. В контейнере python - PID 1, и без своего обработчика SIGTERM
+    игнорируется: docker stop закончился бы SIGKILL без сохранения данных.
+    """
+    app = web.Application()
+    request_handler = SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=settings.webhook_secret
+    )
+    request_handler.register(app, path=settings.webhook_path)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host=settings.webapp_host, port=settings.webapp_port)
+    await site.start()
+
+    webhook_url = settings.webhook_url.rstrip("/") + settings.webhook_path
+    await bot.set_webhook(
+        url=webhook_url,
+        secret_token=settings.webhook_secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"Webhook server listening on {settings.webapp_host}:{settings.webapp_port}, url: {webhook_url}")
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await stop_event.wait()
+        logger.info("Stop signal received, shutting down webhook server")
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        # Новые обновления больше не принимаются; начатые обработчики завершаются в main()
+        await runner.cleanup()
+
+
+async def wait_handlers(tasks: Set[asyncio.Task]):
+    """Дает начатым обработчикам вернуть токены и ответить, пока хранилище еще открыто"""
+    pending = [task for task in list(tasks) if not task.done()]
+    if not pending:
+        return
+    _, still_running = await asyncio.wait(pending, timeout=HANDLERS_SHUTDOWN_TIMEOUT)
+    if still_running:
+        logger.warning(f"{len(still_running)} update handlers still running at shutdown, cancelling")
+        for task in still_running:
+            task.cancel()
+        await asyncio.gather(*still_running, return_exceptions=True)
+
 
 async def main():
     """Запуск бота"""
-    logger.info("Starting Virtual Fitting Room Bot")
-    
+    logger.info(f"Starting Virtual Fitting Room Bot ({settings.bot_mode} mode)")
+
     # Инициализация бота и диспетчера
     bot = Bot(token=settings.bot_token)
-    dp = Dispatcher()
-    
+    # Состояния FSM хранятся во внешнем хранилище и переживают перезапуск
+    dp = Dispatcher(storage=create_fsm_storage())
+    # Задачи обновлений, которые еще обрабатываются - при остановке их дожидаемся
+    in_flight = InFlightMiddleware()
+    dp.update.outer_middleware(in_flight)
+
     # Подключаем роутеры
     container = Container()
-    
+
     # Инициализируем контейнер (включая sheets_client)
     await container.initialize()
-    
+
     router = create_router(container)
     dp.include_router(router)
     bot.container = container
-    
+
     # Запуск бота
     try:
-        await dp.start_polling(bot)
-    except KeyboardInterrupt:
+        if settings.bot_mode == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await run_polling(bot, dp)
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Bot stopped by user")
     finally:
+        # Прерванные генерации завершаются без результата: ожидающие их обработчики возвращают токены
+        await container.generation_queue.stop()
+        await wait_handlers(in_flight.tasks)
+        await container.shutdown()
+        await dp.storage.close()
         await bot.session.close()
+        # Дописываем записи, оставшиеся в очереди логов
+        await logger.complete()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
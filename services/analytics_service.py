@@ -2,18 +2,22 @@
 Сервис для аналитики генераций изображений
 """
 from utils.logger import logger
+from utils.metrics import metrics
 
 
 class AnalyticsService:
     """Сервис для записи аналитики генераций"""
     
-    def __init__(self, sheets_client):
+    def __init__(self, sheets_client, storage):
         self.sheets_client = sheets_client
+        self.storage = storage
         
     async def log_generation(self, user_id: int, person_url: str, garment_url: str, 
                            result_url: str) -> bool:
         """
-        Записывает данные о генерации в таблицу аналитики
+        Сохраняет данные о генерации в основное хранилище
+        
+        В Google Sheets запись попадает пакетно в фоне, метод ее не ждет.
         
         Args:
             user_id: ID пользователя в Telegram
@@ -22,23 +26,18 @@ class AnalyticsService:
             result_url: URL результата генерации
             
         Returns:
-            True если успешно, False при ошибке
+            True если запись сохранена, False при ошибке
         """
         try:
-            # Используем метод sheets_client для записи
-            success = await self.sheets_client.log_generation(
-                user_id=user_id,
-                person_url=person_url,
-                garment_url=garment_url,
-                result_url=result_url
-            )
-            
-            if success:
-                logger.info(f"Analytics logged successfully for user {user_id}")
-            else:
-                logger.error(f"Failed to log analytics for user {user_id}")
-                
-            return success
+            with metrics.stage("analytics_write"):
+                record_id = await self.storage.log_generation(
+                    user_id=user_id,
+                    person_url=person_url,
+                    garment_url=garment_url,
+                    result_url=result_url
+                )
+            logger.info(f"Analytics logged for user {user_id} with ID {record_id}")
+            return True
             
         except Exception as e:
             logger.error(f"Analytics service error for user {user_id}: {e}")
@@ -0,0 +1,324 @@
+"""
+Очередь генераций между обработчиком и FalClient
+Ограниченная глубина, пул воркеров, одна активная сессия на пользователя с лимитом параллельных генераций,
+отмена брошенных задач
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Optional, Dict, Any, Callable, Awaitable, Deque, Set, List
+
+from config.settings import settings
+from llm.providers.base import MODE_PERFORMANCE, MODE_QUALITY
+from utils.logger import logger
+from utils.metrics import metrics
+from utils import tracing
+
+
+class QueueFullError(Exception):
+    """Очередь заполнена - пользователю нужно попробовать позже"""
+
+
+class DuplicateJobError(Exception):
+    """У пользователя уже есть генерация в очереди или в работе"""
+
+
+# Колбэк прогресса: (позиция в очереди, оценка ожидания в секундах); позиция 0 - генерация началась
+PositionCallback = Callable[[int, float], Awaitable[None]]
+
+
+class GenerationJob:
+    """Задача генерации в очереди"""
+
+    def __init__(self, user_id: int, person, garment,
+                 on_update: Optional[PositionCallback] = None, on_progress=None, mode: str = MODE_QUALITY,
+                 num_samples: int = 1):
+        self.user_id = user_id
+        # Режим генерации: предпросмотр или финальный рендер
+        self.mode = mode
+        # Сколько вариантов вернуть за одну генерацию
+        self.num_samples = num_samples
+        # PhotoBuffer фото человека и одежды
+        self.person = person
+        self.garment = garment
+        self.on_update = on_update
+        # Колбэк стадий генерации в fal-ai (см. FalClient.virtual_tryon)
+        self.on_progress = on_progress
+        self.enqueued_at = time.monotonic()
+        # Трасса запроса: воркер выполняет генерацию в ее контексте
+        self.trace = tracing.current()
+        self.position: Optional[int] = None
+        self.cancelled = False
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        # Задача генерации, пока задача у воркера
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self) -> Optional[Dict[str, Any]]:
+        """Ждет результат генерации (тот же контракт, что у FalClient.virtual_tryon)"""
+        return await asyncio.shield(self.future)
+
+
+class GenerationQueue:
+    """Очередь генераций с N воркерами и обратной связью о позиции"""
+
+    # Вес нового замера в скользящем среднем времени генерации
+    SERVICE_TIME_ALPHA = 0.2
+
+    def __init__(self, fal_client, workers: Optional[int] = None, max_depth: Optional[int] = None,
+                 user_concurrency: Optional[int] = None):
+        self.fal_client = fal_client
+        self.workers = workers or settings.generation_workers
+        self.max_depth = max_depth or settings.generation_queue_max
+        # Сколько генераций одного пользователя выполняется одновременно
+        self.user_concurrency = user_concurrency or settings.generation_user_concurrency
+        # Скользящее среднее времени генерации отдельно по режимам
+        self.avg_service_time = {
+            MODE_PERFORMANCE: settings.generation_preview_service_time,
+            MODE_QUALITY: settings.generation_default_service_time
+        }
+
+        self._pending: Deque[GenerationJob] = deque()
+        # user_id -> число задач пользователя в очереди и в работе
+        self._active_users: Dict[int, int] = {}
+        # user_id -> число задач пользователя у воркеров
+        self._running_users: Dict[int, int] = {}
+        self._in_progress = 0
+        # Задачи, которые сейчас выполняют воркеры
+        self._running: Set[GenerationJob] = set()
+        self._cond = asyncio.Condition()
+        self._tasks = []
+        # Ссылки на задачи уведомлений, чтобы их не собрал сборщик мусора
+        self._notify_tasks: Set[asyncio.Task] = set()
+
+        self.counters = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            f"completed_{MODE_PERFORMANCE}": 0,
+            f"completed_{MODE_QUALITY}": 0,
+            f"failed_{MODE_PERFORMANCE}": 0,
+            f"failed_{MODE_QUALITY}": 0,
+            "rejected_full": 0,
+            "rejected_duplicate": 0,
+            "cancelled": 0
+        }
+
+    async def start(self) -> None:
+        """Запускает воркеры"""
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(i)))
+        logger.info(f"Generation queue started: {self.workers} workers, max depth {self.max_depth}")
+
+    async def stop(self) -> None:
+        """Останавливает воркеры; задачи, не взятые в работу, завершаются с результатом None"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        while self._pending:
+            job = self._pending.popleft()
+            self._release_user(job.user_id)
+            if not job.future.done():
+                job.future.set_result(None)
+
+    @property
+    def depth(self) -> int:
+        """Количество задач, ожидающих воркера"""
+        return len(self._pending)
+
+    def _release_user(self, user_id: int) -> None:
+        count = self._active_users.get(user_id, 0) - 1
+        if count > 0:
+            self._active_users[user_id] = count
+        else:
+            self._active_users.pop(user_id, None)
+
+    def cancel(self, user_id: int) -> bool:
+        """
+        Отменяет генерации пользователя: задачи убираются из очереди или прерываются у воркеров
+        (вместе с запросами в fal-ai), и слоты воркеров освобождаются
+
+        Returns:
+            True, если было что отменять
+        """
+        cancelled = False
+        for job in [job for job in self._pending if job.user_id == user_id]:
+            self._pending.remove(job)
+            self._release_user(user_id)
+            job.cancelled = True
+            self.counters["cancelled"] += 1
+            if not job.future.done():
+                job.future.set_result(None)
+            cancelled = True
+        for job in self._running:
+            if job.user_id == user_id and not job.cancelled:
+                job.cancelled = True
+                self.counters["cancelled"] += 1
+                job._task.cancel()
+                cancelled = True
+        if cancelled:
+            self._notify_positions()
+        return cancelled
+
+    def estimate_wait(self, position: int, mode: str = MODE_QUALITY) -> float:
+        """Оценка времени до готовности результата для позиции в очереди"""
+        return (position // self.workers + 1) * self.avg_service_time[mode]
+
+    async def submit(self, user_id: int, person, garment,
+                     on_update: Optional[PositionCallback] = None, on_progress=None,
+                     mode: str = MODE_QUALITY, num_samples: int = 1) -> GenerationJob:
+        """
+        Ставит генерацию в очередь
+
+        Raises:
+            DuplicateJobError: у пользователя уже есть активная генерация
+            QueueFullError: очередь заполнена
+
+        Returns:
+            Задача, результат которой можно ждать через job.wait()
+        """
+        jobs = await self.submit_batch(user_id, person, [garment], on_update, on_progress, mode, num_samples)
+        return jobs[0]
+
+    async def submit_batch(self, user_id: int, person, garments: List,
+                           on_update: Optional[PositionCallback] = None, on_progress=None,
+                           mode: str = MODE_QUALITY, num_samples: int = 1) -> List[GenerationJob]:
+        """
+        Ставит в очередь примерку одного фото человека с несколькими вещами
+
+        Задачи принимаются все вместе или не принимаются совсем. Воркеры выполняют
+        одновременно не больше user_concurrency задач одного пользователя.
+
+        Raises:
+            DuplicateJobError: у пользователя уже есть активная генерация
+            QueueFullError: в очереди нет места для всех задач
+
+        Returns:
+            Задачи в порядке вещей
+        """
+        if user_id in self._active_users:
+            self.counters["rejected_duplicate"] += 1
+            raise DuplicateJobError(f"User {user_id} already has a generation in progress")
+        if len(self._pending) + len(garments) > self.max_depth:
+            self.counters["rejected_full"] += 1
+            logger.warning(f"Generation queue is full ({self.max_depth}), rejecting user {user_id}")
+            raise QueueFullError("Generation queue is full")
+
+        jobs = [GenerationJob(user_id, person, garment, on_update, on_progress, mode, num_samples)
+                for garment in garments]
+        if len(jobs) > 1:
+            # У каждой вещи альбома своя трасса внутри трассы запроса
+            for index, job in enumerate(jobs, 1):
+                job.trace = job.trace and job.trace.child(str(index))
+        async with self._cond:
+            self._pending.extend(jobs)
+            self._active_users[user_id] = len(jobs)
+            self.counters["submitted"] += len(jobs)
+            self._cond.notify(len(jobs))
+        self._notify_positions()
+        return jobs
+
+    def _take_job(self) -> Optional[GenerationJob]:
+        """Первая задача, пользователь которой не исчерпал лимит параллельных генераций"""
+        for job in self._pending:
+            if self._running_users.get(job.user_id, 0) < self.user_concurrency:
+                self._pending.remove(job)
+                return job
+        return None
+
+    def _notify_positions(self) -> None:
+        """Сообщает ожидающим задачам их новую позицию"""
+        # Свободные воркеры заберут первые задачи сразу - их не считаем стоящими в очереди
+        free_workers = max(self.workers - self._in_progress, 0)
+        for index, job in enumerate(self._pending):
+            position = index + 1 - free_workers
+            if position <= 0 or position == job.position:
+                continue
+            job.position = position
+            self._schedule_update(job, position, self.estimate_wait(position, job.mode))
+
+    def _schedule_update(self, job: GenerationJob, position: int, eta: float) -> None:
+        if job.on_update is None:
+            return
+        task = asyncio.create_task(self._safe_update(job, position, eta))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    @staticmethod
+    async def _safe_update(job: GenerationJob, position: int, eta: float) -> None:
+        try:
+            await job.on_update(position, eta)
+        except Exception as e:
+            logger.warning(f"Queue position update failed for user {job.user_id}: {e}")
+
+    async def _worker(self, worker_id: int) -> None:
+        while True:
+            async with self._cond:
+                job = self._take_job()
+                while job is None:
+                    await self._cond.wait()
+                    job = self._take_job()
+                self._in_progress += 1
+                self._running_users[job.user_id] = self._running_users.get(job.user_id, 0) + 1
+
+            if job.position:
+                # Задача ждала в очереди - сообщаем, что генерация началась
+                self._schedule_update(job, 0, self.avg_service_time[job.mode])
+            self._notify_positions()
+
+            started = time.monotonic()
+            with tracing.use_trace(job.trace):
+                metrics.observe_stage("queue_wait", started - job.enqueued_at)
+                # Задача копирует контекст при создании и продолжает трассу запроса
+                job._task = asyncio.create_task(
+                    self.fal_client.virtual_tryon(job.person, job.garment, on_progress=job.on_progress,
+                                                  mode=job.mode, num_samples=job.num_samples)
+                )
+            result = None
+            self._running.add(job)
+            try:
+                result = await job._task
+            except asyncio.CancelledError:
+                # Отменена сама задача - воркер продолжает работу; иначе останавливается воркер
+                if not job.cancelled:
+                    raise
+                logger.info(f"Generation for user {job.user_id} cancelled")
+            except Exception as e:
+                logger.error(f"Generation worker {worker_id} failed for user {job.user_id}: {e}")
+            finally:
+                self._running.discard(job)
+                self._in_progress -= 1
+                self._release_user(job.user_id)
+                running = self._running_users.pop(job.user_id) - 1
+                if running:
+                    self._running_users[job.user_id] = running
+                with tracing.use_trace(job.trace):
+                    metrics.observe_stage(f"generation_{job.mode}", time.monotonic() - started,
+                                          "ok" if result else "cancelled" if job.cancelled else "error")
+                if result:
+                    self.counters["completed"] += 1
+                    self.counters[f"completed_{job.mode}"] += 1
+                    # Результаты из кэша не отражают реальное время генерации
+                    if not result.get('cached'):
+                        elapsed = time.monotonic() - started
+                        average = self.avg_service_time[job.mode]
+                        self.avg_service_time[job.mode] = average + self.SERVICE_TIME_ALPHA * (elapsed - average)
+                elif not job.cancelled:
+                    self.counters["failed"] += 1
+                    self.counters[f"failed_{job.mode}"] += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+
+            # Освободился слот пользователя - его следующая задача может ждать воркера
+            async with self._cond:
+                self._cond.notify()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает глубину очереди, загрузку воркеров и счетчики"""
+        return {
+            **self.counters,
+            "depth": len(self._pending),
+            "in_progress": self._in_progress,
+            "workers": self.workers,
+            "avg_service_time": dict(self.avg_service_time)
+        }
@@ -0,0 +1,43 @@
+"""
+HTTP-эндпоинт метрик для Prometheus
+Отдельный порт процесса бота, чтобы метрики не были доступны через публичный адрес webhook
+"""
+from typing import Optional
+from aiohttp import web
+
+from config.settings import settings
+from utils.metrics import MetricsRegistry, metrics as default_registry
+from utils.logger import logger
+
+
+class MetricsServer:
+    """Отдает GET /metrics в текстовом формате Prometheus"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, registry: Optional[MetricsRegistry] = None, host: Optional[str] = None,
+                 port: Optional[int] = None):
+        self.registry = registry or default_registry
+        self.host = host or settings.metrics_host
+        self.port = port if port is not None else settings.metrics_port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode("utf-8"), headers={"Content-Type": self.CONTENT_TYPE})
+
+    async def start(self) -> None:
+        """Запускает сервер; METRICS_PORT=0 отключает эндпоинт"""
+        if not self.port:
+            logger.info("Metrics endpoint disabled")
+            return
+        app = web.Application()
+        app.router.add_get(settings.metrics_path, self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host=self.host, port=self.port).start()
+        logger.info(f"Metrics endpoint listening on {self.host}:{self.port}{settings.metrics_path}")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
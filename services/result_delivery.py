@@ -0,0 +1,211 @@
+"""
+Доставка результата примерки пользователю фотографией Telegram вместо ссылки на fal-ai
+Результат скачивается через общий HTTP пул, пережимается в пуле процессов, file_id кэшируется
+"""
+import os
+import json
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List, Tuple, Union
+
+import aiohttp
+from aiogram.types import BufferedInputFile, InputMediaPhoto
+from aiogram.exceptions import TelegramBadRequest
+
+from config.settings import settings
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class ResultDelivery:
+    """Отправка результатов фотографией с кэшем file_id по хэшу результата"""
+
+    CACHE_FILE = "result_file_ids.json"
+
+    def __init__(self, normalizer, cache_dir: Optional[str] = None):
+        self.normalizer = normalizer
+        self.cache_dir = cache_dir or settings.cache_dir
+        self.image_format = settings.result_photo_format
+        self.quality = settings.result_photo_quality
+        self.max_side = settings.result_photo_max_side
+        self.max_entries = settings.result_cache_max_entries
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        # хэш result_url -> file_id фото в Telegram; порядок = LRU
+        self._file_ids: "OrderedDict[str, str]" = OrderedDict()
+
+        self.counters = {
+            "file_id_hits": 0,
+            "uploads": 0,
+            "media_groups": 0,
+            "bytes_downloaded": 0,
+            "bytes_uploaded": 0,
+            "failed": 0
+        }
+
+    async def start(self) -> None:
+        """Создает общий HTTP пул и загружает кэш file_id"""
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=settings.result_http_pool_size),
+            timeout=aiohttp.ClientTimeout(total=settings.result_download_timeout)
+        )
+        try:
+            entries = await asyncio.to_thread(self._read_file)
+        except Exception as e:
+            logger.error(f"Failed to load result file_id cache: {e}")
+            return
+        self._file_ids.update(entries)
+        logger.info(f"Result file_id cache loaded: {len(self._file_ids)} entries")
+
+    async def stop(self) -> None:
+        """Закрывает HTTP пул"""
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def _read_file(self) -> Dict[str, str]:
+        path = os.path.join(self.cache_dir, self.CACHE_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_file(self, snapshot: Dict[str, str]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, self.CACHE_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    async def _remember(self, result_hash: str, file_id: str) -> None:
+        self._file_ids[result_hash] = file_id
+        self._file_ids.move_to_end(result_hash)
+        while len(self._file_ids) > self.max_entries:
+            self._file_ids.popitem(last=False)
+        try:
+            await asyncio.to_thread(self._write_file, dict(self._file_ids))
+        except Exception as e:
+            logger.error(f"Failed to save result file_id cache: {e}")
+
+    async def _download(self, url: str) -> bytes:
+        with metrics.stage("result_download"):
+            async with self._session.get(url) as response:
+                response.raise_for_status()
+                return await response.read()
+
+    async def send(self, bot, chat_id: int, result_url: str, caption: Optional[str] = None,
+                   reply_markup=None) -> bool:
+        """
+        Отправляет результат фотографией
+
+        Результат, который уже отправлялся, пересылается по file_id без скачивания и загрузки.
+
+        Returns:
+            True, если фото отправлено; False - вызывающий код отправляет ссылку
+        """
+        result_hash = hashlib.sha256(result_url.encode("utf-8")).hexdigest()
+
+        file_id = self._file_ids.get(result_hash)
+        if file_id:
+            try:
+                with metrics.stage("reply_send"):
+                    await bot.send_photo(chat_id, file_id, caption=caption, reply_markup=reply_markup)
+                self.counters["file_id_hits"] += 1
+                self._file_ids.move_to_end(result_hash)
+                return True
+            except TelegramBadRequest as e:
+                logger.warning(f"Cached result file_id rejected, uploading again: {e}")
+                self._file_ids.pop(result_hash, None)
+
+        try:
+            data, encoded = await self._encode(result_url)
+            extension = "webp" if self.image_format == "WEBP" else "jpg"
+            with metrics.stage("reply_send"):
+                message = await bot.send_photo(
+                    chat_id, BufferedInputFile(encoded, filename=f"result.{extension}"), caption=caption,
+                    reply_markup=reply_markup
+                )
+        except Exception as e:
+            self.counters["failed"] += 1
+            logger.error(f"Failed to send result as photo: {e}")
+            return False
+
+        self.counters["uploads"] += 1
+        self.counters["bytes_downloaded"] += len(data)
+        self.counters["bytes_uploaded"] += len(encoded)
+        logger.info(f"Result sent as photo: {len(data)} bytes from fal-ai, {len(encoded)} bytes uploaded")
+        if message.photo:
+            await self._remember(result_hash, message.photo[-1].file_id)
+        return True
+
+    async def _encode(self, result_url: str) -> Tuple[bytes, bytes]:
+        """Скачивает результат и пережимает его для Telegram, возвращает (исходные, пережатые) байты"""
+        data = await self._download(result_url)
+        with metrics.stage("result_encode"):
+            encoded = await self.normalizer.encode_result(data, self.image_format, self.quality, self.max_side)
+        return data, encoded
+
+    async def _group_media(self, result_url: str,
+                           use_cache: bool) -> Tuple[Union[str, BufferedInputFile], Optional[Tuple[int, int]]]:
+        """file_id из кэша или пережатые байты результата; второй элемент - (скачано, загружено) байтов"""
+        result_hash = hashlib.sha256(result_url.encode("utf-8")).hexdigest()
+        file_id = self._file_ids.get(result_hash) if use_cache else None
+        if file_id:
+            return file_id, None
+        data, encoded = await self._encode(result_url)
+        extension = "webp" if self.image_format == "WEBP" else "jpg"
+        return BufferedInputFile(encoded, filename=f"result.{extension}"), (len(data), len(encoded))
+
+    async def send_group(self, bot, chat_id: int, result_urls: List[str], caption: Optional[str] = None) -> bool:
+        """
+        Отправляет несколько результатов одним альбомом (до 10 фото)
+
+        Результаты скачиваются и пережимаются параллельно, уже отправлявшиеся - по file_id.
+        Если Telegram отклонил сохраненный file_id, альбом отправляется заново с загрузкой байтов.
+
+        Returns:
+            True, если альбом отправлен; False - вызывающий код отправляет ссылки
+        """
+        if len(result_urls) == 1:
+            return await self.send(bot, chat_id, result_urls[0], caption=caption)
+
+        for use_cache in (True, False):
+            prepared = []
+            try:
+                prepared = await asyncio.gather(*(self._group_media(url, use_cache) for url in result_urls))
+                media = [InputMediaPhoto(media=item, caption=caption if index == 0 else None)
+                         for index, (item, _) in enumerate(prepared)]
+                with metrics.stage("reply_send"):
+                    messages = await bot.send_media_group(chat_id, media)
+                break
+            except TelegramBadRequest as e:
+                if not use_cache or all(uploaded for _, uploaded in prepared):
+                    self.counters["failed"] += 1
+                    logger.error(f"Failed to send results as media group: {e}")
+                    return False
+                logger.warning(f"Cached result file_id rejected in media group, uploading again: {e}")
+            except Exception as e:
+                self.counters["failed"] += 1
+                logger.error(f"Failed to send results as media group: {e}")
+                return False
+
+        self.counters["media_groups"] += 1
+        for url, (_, uploaded), message in zip(result_urls, prepared, messages):
+            result_hash = hashlib.sha256(url.encode("utf-8")).hexdigest()
+            if uploaded is None:
+                self.counters["file_id_hits"] += 1
+                self._file_ids.move_to_end(result_hash)
+                continue
+            self.counters["uploads"] += 1
+            self.counters["bytes_downloaded"] += uploaded[0]
+            self.counters["bytes_uploaded"] += uploaded[1]
+            if message.photo:
+                await self._remember(result_hash, message.photo[-1].file_id)
+        logger.info(f"{len(result_urls)} results sent as media group")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает попадания кэша file_id и объем скачанных и загруженных байтов"""
+        return {**self.counters, "entries": len(self._file_ids)}
@@ -1,121 +1,203 @@
 """
 Сервис для управления токенами пользователей
 """
-from typing import Optional
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional, Dict, Any
 from utils.logger import logger
+from utils.metrics import metrics
+
+
+@dataclass
+class TokenReservation:
+    """Токен, списанный под генерацию до ее завершения"""
+    reservation_id: str
+    user_id: int
+    remaining: int  # Остаток токенов после резервирования
+    amount: int = 1  # Сколько токенов зарезервировано
+    kind: str = "quality"  # Вид генерации для раздельного учета (performance/quality)
 
 
 class TokenService:
     """Сервис для управления токенами пользователей"""
     
-    def __init__(self, sheets_client):
-        self.sheets_client = sheets_client
+    def __init__(self, storage):
+        # Основное хранилище (SQLite или Google Sheets)
+        self.storage = storage
         self.initial_tokens = 10
         
+        # Блокировки по пользователям: операции одного пользователя выполняются по очереди
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._lock_refs: Dict[int, int] = {}
+        # Незавершенные резервирования
+        self._reservations: Dict[str, TokenReservation] = {}
+        # Токены по видам генерации: "<вид>_reserved/_committed/_refunded" -> количество
+        self.counters: Dict[str, int] = {}
+    
+    @asynccontextmanager
+    async def _user_lock(self, user_id: int):
+        """Сериализует операции с токенами одного пользователя"""
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = self._user_locks[user_id] = asyncio.Lock()
+        self._lock_refs[user_id] = self._lock_refs.get(user_id, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._lock_refs[user_id] -= 1
+            if self._lock_refs[user_id] == 0:
+                del self._lock_refs[user_id]
+                del self._user_locks[user_id]
+        
     async def get_user_tokens(self, user_id: int) -> Optional[int]:
         """
         Получает количество токенов пользователя
-        
+
         Args:
             user_id: ID пользователя в Telegram
-            
+
         Returns:
             Количество токенов или None при ошибке
         """
-        if not self.sheets_client.worksheet:
-            logger.error("Worksheet not initialized")
+        if not self.storage.is_ready:
+            logger.error("Storage not initialized")
             return None
-            
+
         try:
-            # Находим пользователя
-            existing_cell = None
-            try:
-                existing_cell = self.sheets_client.worksheet.find(str(user_id))
-            except Exception:
-                logger.warning(f"User {user_id} not found in sheet")
-                return None
-                
-            if existing_cell and existing_cell.col == 1:  # Найден в первом столбце (ID)
-                row_num = existing_cell.row
-                # Получаем значение из столбца F (tokens)
-                tokens_cell = self.sheets_client.worksheet.cell(row_num, 6)  # 6 = столбец F
-                
-                try:
-                    # Если ячейка пустая или None, это старый пользователь - даем ему 10 токенов
-                    if tokens_cell.value is None or tokens_cell.value == "":
-                        logger.info(f"User {user_id} has empty tokens field, setting to 10")
-                        # Устанавливаем токены для старых пользователей
-                        self.sheets_client.worksheet.update_cell(row_num, 6, 10)
-                        return 10
-                    
-                    tokens = int(tokens_cell.value)
-                    logger.info(f"User {user_id} has {tokens} tokens")
-                    return tokens
-                except ValueError:
-                    logger.error(f"Invalid tokens value for user {user_id}: {tokens_cell.value}")
-                    # Для некорректных значений тоже ставим 10
-                    self.sheets_client.worksheet.update_cell(row_num, 6, 10)
-                    return 10
-            
-            return None
-            
+            with metrics.stage("token_read"):
+                tokens = await self.storage.get_tokens(user_id)
         except Exception as e:
             logger.error(f"Failed to get tokens for user {user_id}: {e}")
             return None
-    
+
+        if tokens is None:
+            logger.warning(f"User {user_id} not found in storage")
+            return None
+
+        logger.info(f"User {user_id} has {tokens} tokens")
+        return tokens
+
     async def decrease_tokens(self, user_id: int) -> bool:
         """
         Уменьшает токены пользователя на 1
-        
+
         Args:
             user_id: ID пользователя в Telegram
-            
+
         Returns:
             True если успешно, False при ошибке
         """
-        if not self.sheets_client.worksheet:
-            logger.error("Worksheet not initialized")
-            return False
-            
+        async with self._user_lock(user_id):
+            return await self._debit(user_id) is not None
+
+    async def _debit(self, user_id: int, amount: int = 1) -> Optional[int]:
+        """Списывает токены в хранилище, возвращает остаток или None"""
+        if not self.storage.is_ready:
+            logger.error("Storage not initialized")
+            return None
+
         try:
-            # Находим пользователя
-            existing_cell = None
-            try:
-                existing_cell = self.sheets_client.worksheet.find(str(user_id))
-            except Exception:
-                logger.error(f"User {user_id} not found when trying to decrease tokens")
-                return False
-                
-            if existing_cell and existing_cell.col == 1:  # Найден в первом столбце (ID)
-                row_num = existing_cell.row
-                
-                # Получаем текущее количество токенов
-                tokens_cell = self.sheets_client.worksheet.cell(row_num, 6)  # 6 = столбец F
-                
-                try:
-                    current_tokens = int(tokens_cell.value or 0)
-                    
-                    if current_tokens <= 0:
-                        logger.warning(f"User {user_id} has no tokens to decrease")
-                        return False
-                    
-                    # Уменьшаем на 1
-                    new_tokens = current_tokens - 1
-                    self.sheets_client.worksheet.update_cell(row_num, 6, new_tokens)
-                    
-                    logger.info(f"Decreased tokens for user {user_id}: {current_tokens} -> {new_tokens}")
-                    return True
-                    
-                except ValueError:
-                    logger.error(f"Invalid tokens value for user {user_id}: {tokens_cell.value}")
-                    return False
-            
-            return False
-            
+            with metrics.stage("token_write"):
+                new_tokens = await self.storage.adjust_tokens(user_id, -amount)
         except Exception as e:
             logger.error(f"Failed to decrease tokens for user {user_id}: {e}")
+            return None
+
+        if new_tokens is None:
+            logger.warning(f"User {user_id} not found or has no tokens to decrease")
+            return None
+
+        logger.info(f"Decreased tokens for user {user_id}: {new_tokens + amount} -> {new_tokens}")
+        return new_tokens
+
+    def _count(self, kind: str, event: str, amount: int) -> None:
+        key = f"{kind}_{event}"
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    async def reserve_token(self, user_id: int, amount: int = 1, kind: str = "quality") -> Optional[TokenReservation]:
+        """
+        Проверяет наличие токенов и сразу списывает их под генерацию
+
+        Резервирование нужно завершить через commit() при успехе
+        или refund() при ошибке генерации.
+
+        Args:
+            user_id: ID пользователя в Telegram
+            amount: Стоимость генерации в токенах
+            kind: Вид генерации для раздельного учета
+
+        Returns:
+            Резервирование или None, если токенов нет
+        """
+        async with self._user_lock(user_id):
+            if amount > 0:
+                remaining = await self._debit(user_id, amount)
+            else:
+                remaining = await self.get_user_tokens(user_id)
+            if remaining is None:
+                return None
+            reservation = TokenReservation(
+                reservation_id=uuid.uuid4().hex,
+                user_id=user_id,
+                remaining=remaining,
+                amount=amount,
+                kind=kind
+            )
+            self._reservations[reservation.reservation_id] = reservation
+            self._count(kind, "reserved", amount)
+            logger.info(f"Reserved {amount} token(s) {reservation.reservation_id} for {kind} generation of user {user_id}")
+            return reservation
+
+    async def commit(self, reservation: TokenReservation) -> bool:
+        """
+        Подтверждает списание зарезервированного токена
+
+        Returns:
+            True если резервирование было активно, False если уже завершено
+        """
+        if self._reservations.pop(reservation.reservation_id, None) is None:
+            logger.warning(f"Reservation {reservation.reservation_id} already settled")
             return False
-    
+        self._count(reservation.kind, "committed", reservation.amount)
+        logger.info(f"Committed token {reservation.reservation_id} for user {reservation.user_id}")
+        return True
+
+    async def refund(self, reservation: TokenReservation) -> bool:
+        """
+        Возвращает зарезервированный токен пользователю
+
+        Returns:
+            True если токен возвращен, False если резервирование уже завершено
+        """
+        if self._reservations.pop(reservation.reservation_id, None) is None:
+            logger.warning(f"Reservation {reservation.reservation_id} already settled")
+            return False
+
+        user_id = reservation.user_id
+        if reservation.amount <= 0:
+            return True
+        async with self._user_lock(user_id):
+            try:
+                with metrics.stage("token_write"):
+                    new_tokens = await self.storage.adjust_tokens(user_id, reservation.amount)
+            except Exception as e:
+                logger.error(f"Failed to refund token for user {user_id}: {e}")
+                return False
+            if new_tokens is None:
+                logger.error(f"User {user_id} not found when trying to refund token")
+                return False
+
+        self._count(reservation.kind, "refunded", reservation.amount)
+        logger.info(f"Refunded token {reservation.reservation_id} for user {user_id}")
+        return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает зарезервированные, списанные и возвращенные токены по видам генерации"""
+        return {**self.counters, "open_reservations": len(self._reservations)}
+
     async def has_tokens(self, user_id: int) -> bool:
         """
         Проверяет, есть ли у пользователя токены для генерации
@@ -142,6 +224,19 @@ class TokenService:
             Сообщение о токенах
         """
         tokens = await self.get_user_tokens(user_id)
+        return self.format_tokens_message(tokens)
+    
+    @staticmethod
+    def format_tokens_message(tokens: Optional[int]) -> str:
+        """
+        Формирует сообщение о токенах по уже известному количеству
+        
+        Args:
+            tokens: Количество токенов или None, если оно неизвестно
+            
+        Returns:
+            Сообщение о токенах
+        """
         if tokens is None:
             return "Αδυναμία λήψης πληροφοριών για τα tokens"
         
@@ -0,0 +1,157 @@
+"""
+Буферизованная запись аналитики в Google Sheets
+Строки копятся в памяти и отправляются одним append по размеру пакета или по таймеру
+"""
+import os
+import asyncio
+from datetime import datetime
+from typing import Optional, List
+
+from config.settings import settings
+from utils.logger import logger
+
+
+class AnalyticsSink:
+    """Очередь строк аналитики с пакетной записью и персистентным счетчиком ID"""
+
+    COUNTER_FILE = "analytics_id"
+    # Сколько строк держать в памяти, если таблица долго недоступна
+    MAX_PENDING = 5000
+
+    def __init__(self, sheets_client, cache_dir: Optional[str] = None):
+        self.sheets_client = sheets_client
+        self.batch_size = settings.analytics_batch_size
+        self.flush_interval = settings.analytics_flush_interval
+        self.counter_path = os.path.join(cache_dir or settings.cache_dir, self.COUNTER_FILE)
+
+        self._queue: List[list] = []
+        self._last_id: Optional[int] = None
+        self._flush_lock = asyncio.Lock()
+        self._batch_ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Восстанавливает счетчик ID и запускает фоновую запись"""
+        await self._load_counter()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и отправляет оставшиеся строки"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _load_counter(self) -> bool:
+        """
+        Восстанавливает последний ID из файла, а без файла - из таблицы
+
+        Returns:
+            True если нумерация известна; False - таблица недоступна, попытка повторится при записи
+        """
+        try:
+            self._last_id = await asyncio.to_thread(self._read_counter)
+        except Exception as e:
+            logger.error(f"Failed to read analytics counter: {e}")
+
+        if self._last_id is None:
+            # Счетчика еще нет - берем максимальный ID из таблицы. Если таблица не прочиталась,
+            # нумерацию с нуля не начинаем: ID в таблице повторились бы
+            self._last_id = await self.sheets_client.get_max_analytics_id()
+            if self._last_id is None:
+                logger.warning("Analytics counter unknown, IDs will be assigned once the sheet is readable")
+                return False
+        logger.info(f"Analytics counter restored: last ID {self._last_id}")
+        return True
+
+    def _read_counter(self) -> Optional[int]:
+        if not os.path.exists(self.counter_path):
+            return None
+        with open(self.counter_path, "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+
+    def _write_counter(self, value: int) -> None:
+        os.makedirs(os.path.dirname(self.counter_path), exist_ok=True)
+        tmp_path = self.counter_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(str(value))
+        os.replace(tmp_path, self.counter_path)
+
+    def enqueue(self, user_id: int, person_url: str, garment_url: str, result_url: str) -> Optional[int]:
+        """
+        Ставит строку аналитики в очередь, не дожидаясь записи
+
+        Returns:
+            Присвоенный ID записи или None, если нумерация еще неизвестна (ID назначится перед записью)
+        """
+        record_id = None
+        if self._last_id is not None:
+            self._last_id += 1
+            record_id = self._last_id
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._queue.append([
+            record_id,         # A: id
+            user_id,           # B: id_user
+            person_url,        # C: input_human_image_url
+            garment_url,       # D: input_garment_image_url
+            result_url,        # E: output_image_url
+            timestamp          # F: timestamp
+        ])
+        if len(self._queue) >= self.batch_size:
+            self._batch_ready.set()
+        return record_id
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self) -> bool:
+        """
+        Отправляет накопленные строки одним запросом
+
+        Returns:
+            True если очередь пуста после записи, False при ошибке
+        """
+        async with self._flush_lock:
+            self._batch_ready.clear()
+            if not self._queue:
+                return True
+
+            # Строки, поставленные до восстановления счетчика, получают ID по порядку
+            if self._last_id is None and not await self._load_counter():
+                return False
+            for row in self._queue:
+                if row[0] is None:
+                    self._last_id += 1
+                    row[0] = self._last_id
+
+            rows, self._queue = self._queue, []
+            try:
+                # Счетчик сохраняем до записи строк, чтобы после сбоя ID не повторились
+                await asyncio.to_thread(self._write_counter, self._last_id)
+                success = await self.sheets_client.append_analytics_rows(rows)
+            except Exception as e:
+                logger.error(f"Failed to flush analytics: {e}")
+                success = False
+
+            if not success:
+                # Вернем строки в начало очереди для следующей попытки
+                self._queue = rows + self._queue
+                if len(self._queue) > self.MAX_PENDING:
+                    dropped = len(self._queue) - self.MAX_PENDING
+                    self._queue = self._queue[dropped:]
+                    logger.warning(f"Analytics queue overflow, dropped {dropped} oldest rows")
+                return False
+
+            logger.info(f"Flushed {len(rows)} analytics rows (IDs {rows[0][0]}-{rows[-1][0]})")
+            return True
+
+    @property
+    def pending(self) -> int:
+        """Количество строк, ожидающих записи"""
+        return len(self._queue)
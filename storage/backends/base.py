@@ -0,0 +1,59 @@
+"""
+Интерфейс хранилища пользователей, токенов и аналитики
+"""
+from abc import ABC, abstractmethod
+from typing import Optional
+
+
+class StorageBackend(ABC):
+    """Основное хранилище данных бота"""
+
+    @abstractmethod
+    async def initialize(self) -> bool:
+        """Подготавливает хранилище к работе"""
+
+    @abstractmethod
+    async def close(self) -> None:
+        """Сохраняет несохраненные данные и освобождает ресурсы"""
+
+    @property
+    @abstractmethod
+    def is_ready(self) -> bool:
+        """Можно ли читать данные из хранилища"""
+
+    @abstractmethod
+    async def get_tokens(self, user_id: int) -> Optional[int]:
+        """
+        Returns:
+            Количество токенов или None, если пользователь неизвестен
+        """
+
+    @abstractmethod
+    async def adjust_tokens(self, user_id: int, delta: int) -> Optional[int]:
+        """
+        Атомарно изменяет количество токенов на delta
+
+        Returns:
+            Новый баланс или None, если пользователь неизвестен
+            или баланс стал бы отрицательным
+        """
+
+    @abstractmethod
+    async def upsert_user(self, user_id: int, username: Optional[str] = None,
+                          first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+        """
+        Добавляет нового пользователя с начальными токенами или обновляет профиль
+
+        Returns:
+            True если пользователь новый, False если обновлен
+        """
+
+    @abstractmethod
+    async def log_generation(self, user_id: int, person_url: str, garment_url: str,
+                             result_url: str) -> int:
+        """
+        Сохраняет запись аналитики о генерации
+
+        Returns:
+            ID записи
+        """
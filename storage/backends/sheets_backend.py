@@ -0,0 +1,52 @@
+"""
+Хранилище напрямую в Google Sheets: индекс пользователей в памяти + пакетная аналитика
+"""
+from typing import Optional
+
+from storage.backends.base import StorageBackend
+from storage.user_ledger import UserLedger
+from storage.analytics_sink import AnalyticsSink
+from utils.logger import logger
+
+
+class SheetsStorage(StorageBackend):
+    """Google Sheets как основное хранилище"""
+
+    def __init__(self, sheets_client):
+        self.sheets_client = sheets_client
+        self.user_ledger = UserLedger(sheets_client)
+        self.analytics_sink = AnalyticsSink(sheets_client)
+
+    async def initialize(self) -> bool:
+        await self.user_ledger.start()
+        await self.analytics_sink.start()
+        return self.user_ledger.is_loaded
+
+    async def close(self) -> None:
+        await self.user_ledger.stop()
+        await self.analytics_sink.stop()
+
+    @property
+    def is_ready(self) -> bool:
+        return self.user_ledger.is_loaded
+
+    async def get_tokens(self, user_id: int) -> Optional[int]:
+        return self.user_ledger.get_tokens(user_id)
+
+    async def adjust_tokens(self, user_id: int, delta: int) -> Optional[int]:
+        # Между чтением и записью нет await, поэтому операция атомарна в event loop
+        tokens = self.user_ledger.get_tokens(user_id)
+        if tokens is None or tokens + delta < 0:
+            return None
+        self.user_ledger.set_tokens(user_id, tokens + delta)
+        return tokens + delta
+
+    async def upsert_user(self, user_id: int, username: Optional[str] = None,
+                          first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+        return self.user_ledger.upsert_user(user_id, username, first_name, last_name)
+
+    async def log_generation(self, user_id: int, person_url: str, garment_url: str,
+                             result_url: str) -> Optional[int]:
+        record_id = self.analytics_sink.enqueue(user_id, person_url, garment_url, result_url)
+        logger.info(f"Analytics queued for user {user_id} with ID {record_id}")
+        return record_id
@@ -0,0 +1,225 @@
+"""
+Локальное хранилище на SQLite (WAL) - основной источник данных
+Все изменения пишутся в outbox, откуда их забирает репликатор в Google Sheets
+"""
+import os
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Tuple
+
+from storage.backends.base import StorageBackend
+from utils.logger import logger
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL DEFAULT '',
+    first_name TEXT NOT NULL DEFAULT '',
+    last_name TEXT NOT NULL DEFAULT '',
+    last_activity TEXT NOT NULL DEFAULT '',
+    tokens INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analytics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    person_url TEXT NOT NULL,
+    garment_url TEXT NOT NULL,
+    result_url TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    ref INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage(StorageBackend):
+    """SQLite в режиме WAL; запросы выполняются в одном отдельном потоке"""
+
+    INITIAL_TOKENS = 10
+    # Ключ в meta: данные из Google Sheets импортированы
+    BOOTSTRAP_KEY = "sheets_bootstrapped"
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn: Optional[sqlite3.Connection] = None
+        # Один поток - все транзакции выполняются строго по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def initialize(self) -> bool:
+        try:
+            await self._run(self._connect)
+            logger.info(f"SQLite storage initialized: {self.db_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to initialize SQLite storage: {e}")
+            return False
+
+    def _connect(self) -> None:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    @property
+    def is_ready(self) -> bool:
+        return self._conn is not None
+
+    def _transaction(self, func, *args):
+        """Выполняет func внутри транзакции BEGIN IMMEDIATE"""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(*args)
+            self._conn.execute("COMMIT")
+            return result
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _outbox(self, kind: str, ref: int) -> None:
+        self._conn.execute("INSERT INTO outbox (kind, ref) VALUES (?, ?)", (kind, ref))
+
+    async def get_tokens(self, user_id: int) -> Optional[int]:
+        row = await self._run(self._fetch_one, "SELECT tokens FROM users WHERE user_id = ?", (user_id,))
+        return row["tokens"] if row else None
+
+    def _fetch_one(self, query: str, params: tuple):
+        return self._conn.execute(query, params).fetchone()
+
+    async def adjust_tokens(self, user_id: int, delta: int) -> Optional[int]:
+        return await self._run(self._transaction, self._adjust_tokens, user_id, delta)
+
+    def _adjust_tokens(self, user_id: int, delta: int) -> Optional[int]:
+        row = self._conn.execute("SELECT tokens FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None or row["tokens"] + delta < 0:
+            return None
+        new_tokens = row["tokens"] + delta
+        self._conn.execute("UPDATE users SET tokens = ? WHERE user_id = ?", (new_tokens, user_id))
+        self._outbox("user", user_id)
+        return new_tokens
+
+    async def upsert_user(self, user_id: int, username: Optional[str] = None,
+                          first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+        profile = (username or "", first_name or "", last_name or "",
+                   datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        is_new = await self._run(self._transaction, self._upsert_user, user_id, profile)
+        if is_new:
+            logger.info(f"Added new user {user_id} with {self.INITIAL_TOKENS} tokens")
+        return is_new
+
+    def _upsert_user(self, user_id: int, profile: tuple) -> bool:
+        updated = self._conn.execute(
+            "UPDATE users SET username = ?, first_name = ?, last_name = ?, last_activity = ? WHERE user_id = ?",
+            (*profile, user_id)
+        ).rowcount
+        if not updated:
+            self._conn.execute(
+                "INSERT INTO users (user_id, username, first_name, last_name, last_activity, tokens) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, *profile, self.INITIAL_TOKENS)
+            )
+        self._outbox("user", user_id)
+        return not updated
+
+    async def log_generation(self, user_id: int, person_url: str, garment_url: str,
+                             result_url: str) -> int:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        return await self._run(self._transaction, self._log_generation,
+                               (user_id, person_url, garment_url, result_url, timestamp))
+
+    def _log_generation(self, values: tuple) -> int:
+        record_id = self._conn.execute(
+            "INSERT INTO analytics (user_id, person_url, garment_url, result_url, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            values
+        ).lastrowid
+        self._outbox("analytics", record_id)
+        return record_id
+
+    # --- Методы для репликатора ---
+
+    async def is_bootstrapped(self) -> bool:
+        """Перенесены ли уже данные из Google Sheets (флаг ставится только успешным импортом)"""
+        row = await self._run(self._fetch_one, "SELECT value FROM meta WHERE key = ?", (self.BOOTSTRAP_KEY,))
+        return row is not None
+
+    async def import_from_sheets(self, users: List[Tuple[int, Dict[str, str], int]], last_analytics_id: int) -> None:
+        """
+        Первичная загрузка из таблиц: пользователи (без записи в outbox), продолжение нумерации аналитики
+        и флаг импорта - в одной транзакции
+        """
+        await self._run(self._transaction, self._import_from_sheets, users, last_analytics_id)
+
+    def _import_from_sheets(self, users, last_analytics_id: int) -> None:
+        self._import_users(users)
+        self._seed_analytics_id(last_analytics_id)
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                           (self.BOOTSTRAP_KEY, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+    def _import_users(self, users) -> None:
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO users (user_id, username, first_name, last_name, last_activity, tokens) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, p.get("username", ""), p.get("first_name", ""), p.get("last_name", ""),
+              p.get("last_activity", ""), tokens) for user_id, p, tokens in users]
+        )
+
+    def _seed_analytics_id(self, last_id: int) -> None:
+        """Продолжает нумерацию аналитики с ID, уже существующего в таблице"""
+        row = self._conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'analytics'").fetchone()
+        if row is None:
+            self._conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('analytics', ?)", (last_id,))
+        elif row["seq"] < last_id:
+            self._conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'analytics'", (last_id,))
+
+    async def fetch_outbox(self, limit: int) -> List[Tuple[int, str, int]]:
+        rows = await self._run(self._fetch_all, "SELECT seq, kind, ref FROM outbox ORDER BY seq LIMIT ?", (limit,))
+        return [(row["seq"], row["kind"], row["ref"]) for row in rows]
+
+    def _fetch_all(self, query: str, params: tuple):
+        return self._conn.execute(query, params).fetchall()
+
+    async def ack_outbox(self, last_seq: int) -> None:
+        await self._run(self._transaction, self._conn.execute, "DELETE FROM outbox WHERE seq <= ?", (last_seq,))
+
+    async def get_users(self, user_ids: List[int]) -> List[Dict[str, Any]]:
+        if not user_ids:
+            return []
+        placeholders = ",".join("?" * len(user_ids))
+        rows = await self._run(self._fetch_all, f"SELECT * FROM users WHERE user_id IN ({placeholders})",
+                               tuple(user_ids))
+        return [dict(row) for row in rows]
+
+    async def get_analytics(self, record_ids: List[int]) -> List[Dict[str, Any]]:
+        if not record_ids:
+            return []
+        placeholders = ",".join("?" * len(record_ids))
+        rows = await self._run(self._fetch_all,
+                               f"SELECT * FROM analytics WHERE id IN ({placeholders}) ORDER BY id",
+                               tuple(record_ids))
+        return [dict(row) for row in rows]
@@ -0,0 +1,180 @@
+"""
+Управление временными файлами на томе ./storage
+Каждый файл учитывается: квота на объем, TTL, удаление по окончании сессии, очистка сирот при запуске
+"""
+import os
+import time
+import uuid
+import asyncio
+from typing import Optional, Dict, Any
+
+from config.settings import settings
+from utils.logger import logger
+
+
+class StorageQuotaError(Exception):
+    """Файл не помещается в квоту временного хранилища"""
+
+
+class FileManager:
+    """Учет временных файлов с шардированием по подкаталогам, квотой и TTL"""
+
+    # Как часто (сек) удалять просроченные файлы и сирот
+    SWEEP_INTERVAL = 300
+
+    def __init__(self, root: Optional[str] = None, quota_bytes: Optional[int] = None, ttl: Optional[int] = None):
+        self.root = root or settings.temp_dir
+        self.quota_bytes = quota_bytes or settings.temp_quota_mb * 1024 * 1024
+        self.ttl = ttl or settings.temp_ttl
+
+        # path -> {"owner", "size", "created"}
+        self._files: Dict[str, Dict[str, Any]] = {}
+        self._total_bytes = 0
+        self._sweep_task: Optional[asyncio.Task] = None
+
+        self.counters = {
+            "allocated": 0,
+            "released": 0,
+            "expired": 0,
+            "orphans_removed": 0,
+            "quota_rejected": 0
+        }
+
+    async def start(self) -> None:
+        """Удаляет сирот прошлых запусков и запускает периодическую очистку"""
+        removed = await asyncio.to_thread(self._sweep_orphans, True)
+        if removed:
+            logger.info(f"Removed {removed} orphan files from {self.root}")
+        self._sweep_task = asyncio.create_task(self._sweep_loop())
+
+    async def stop(self) -> None:
+        """Останавливает очистку и удаляет все учтенные файлы"""
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
+        for path in list(self._files):
+            self.release(path)
+
+    def _shard_path(self, name: str) -> str:
+        """root/ab/cd/<name> - в одном каталоге не больше нескольких сотен файлов"""
+        return os.path.join(self.root, name[:2], name[2:4], name)
+
+    def allocate(self, owner: Any, suffix: str = ".part", size_hint: int = 0) -> str:
+        """
+        Выделяет путь для нового файла и учитывает его за владельцем (сессией)
+
+        Args:
+            owner: Владелец файла, обычно user_id сессии
+            suffix: Расширение файла
+            size_hint: Ожидаемый размер файла для проверки квоты
+
+        Raises:
+            StorageQuotaError: файл не помещается в квоту даже после удаления просроченных
+
+        Returns:
+            Путь, по которому можно записать файл
+        """
+        if self._total_bytes + size_hint > self.quota_bytes:
+            self._expire()
+            if self._total_bytes + size_hint > self.quota_bytes:
+                self.counters["quota_rejected"] += 1
+                raise StorageQuotaError(
+                    f"Temp storage quota exceeded: {self._total_bytes + size_hint} > {self.quota_bytes} bytes"
+                )
+
+        path = self._shard_path(f"{uuid.uuid4().hex}{suffix}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._files[path] = {"owner": owner, "size": size_hint, "created": time.time()}
+        self._total_bytes += size_hint
+        self.counters["allocated"] += 1
+        return path
+
+    def commit(self, path: str) -> int:
+        """Обновляет учтенный размер после записи файла, возвращает размер"""
+        entry = self._files.get(path)
+        size = os.path.getsize(path)
+        if entry is not None:
+            self._total_bytes += size - entry["size"]
+            entry["size"] = size
+        return size
+
+    def release(self, path: str) -> None:
+        """Удаляет файл и снимает его с учета"""
+        entry = self._files.pop(path, None)
+        if entry is not None:
+            self._total_bytes -= entry["size"]
+            self.counters["released"] += 1
+        self._remove(path)
+
+    def release_owner(self, owner: Any) -> None:
+        """Удаляет все файлы сессии - вызывается по окончании сценария FSM"""
+        for path in [p for p, entry in self._files.items() if entry["owner"] == owner]:
+            self.release(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove temp file {path}: {e}")
+
+    def _expire(self) -> None:
+        """Удаляет учтенные файлы старше TTL"""
+        deadline = time.time() - self.ttl
+        for path in [p for p, entry in self._files.items() if entry["created"] < deadline]:
+            self.release(path)
+            self.counters["expired"] += 1
+
+    def _sweep_orphans(self, remove_dirs: bool = False) -> int:
+        """
+        Удаляет неучтенные файлы старше TTL и, при запуске, пустые подкаталоги
+
+        Молодые неучтенные файлы не трогаем: они могут принадлежать живой сессии
+        другого процесса бота на том же томе.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        deadline = time.time() - self.ttl
+        removed = 0
+        for dirpath, dirnames, filenames in os.walk(self.root, topdown=False):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if path in self._files:
+                    continue
+                try:
+                    if os.path.getmtime(path) < deadline:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+            if remove_dirs and dirpath != self.root:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+        self.counters["orphans_removed"] += removed
+        return removed
+
+    async def _sweep_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.SWEEP_INTERVAL)
+            self._expire()
+            try:
+                await asyncio.to_thread(self._sweep_orphans)
+            except Exception as e:
+                logger.error(f"Temp storage sweep failed: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает число и объем учтенных файлов и счетчики очистки"""
+        return {
+            **self.counters,
+            "files": len(self._files),
+            "bytes": self._total_bytes,
+            "quota_bytes": self.quota_bytes
+        }
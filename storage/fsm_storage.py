@@ -0,0 +1,144 @@
+"""
+Хранилище состояний FSM для aiogram на общей базе SQLite
+Несколько процессов бота видят одни и те же сессии; брошенные сессии истекают по TTL
+"""
+import os
+import json
+import time
+import sqlite3
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config.settings import settings
+from utils.logger import logger
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """FSM storage в SQLite (WAL) с TTL для неактивных сессий"""
+
+    # Как часто удалять просроченные сессии (сек)
+    PURGE_INTERVAL = 60
+
+    def __init__(self, db_path: str, ttl: int):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = self._connect()
+        self._last_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+        )
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+    def _load(self, key: str) -> Optional[tuple]:
+        """Возвращает (state, data) или None, если сессии нет или она просрочена"""
+        row = self._conn.execute("SELECT state, data, updated_at FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if time.time() - row[2] > self.ttl:
+            self._conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+            return None
+        return row[0], json.loads(row[1])
+
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any]) -> None:
+        now = time.time()
+        if state is None and not data:
+            self._conn.execute("DELETE FROM fsm WHERE key = ?", (key,))
+        else:
+            self._conn.execute(
+                "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at",
+                (key, state, json.dumps(data), now)
+            )
+        if now - self._last_purge > self.PURGE_INTERVAL:
+            self._last_purge = now
+            purged = self._conn.execute("DELETE FROM fsm WHERE updated_at < ?", (now - self.ttl,)).rowcount
+            if purged:
+                logger.info(f"Purged {purged} expired FSM sessions")
+
+    def _set_state(self, key: str, state: Optional[str]) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._load(key)
+            self._store(key, state, current[1] if current else {})
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _set_data(self, key: str, data: Dict[str, Any], merge: bool) -> Dict[str, Any]:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            current = self._load(key)
+            state = current[0] if current else None
+            new_data = {**current[1], **data} if (merge and current) else dict(data)
+            self._store(key, state, new_data)
+            self._conn.execute("COMMIT")
+            return new_data
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._set_state, self._key(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        current = await self._run(self._load, self._key(key))
+        return current[0] if current else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._run(self._set_data, self._key(key), data, False)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        current = await self._run(self._load, self._key(key))
+        return current[1] if current else {}
+
+    async def update_data(self, key: StorageKey, data: Dict[str, Any]) -> Dict[str, Any]:
+        # Чтение и запись в одной транзакции - безопасно при нескольких процессах
+        new_data = await self._run(self._set_data, self._key(key), data, True)
+        return new_data.copy()
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+def create_fsm_storage() -> BaseStorage:
+    """Создает FSM storage по настройке FSM_STORAGE: sqlite, redis или memory"""
+    if settings.fsm_storage == "memory":
+        return MemoryStorage()
+
+    if settings.fsm_storage == "redis":
+        # Общие сессии для процессов на разных машинах; импорт здесь, чтобы без Redis не грузить клиент
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(
+            settings.redis_url,
+            state_ttl=settings.fsm_ttl,
+            data_ttl=settings.fsm_ttl
+        )
+
+    return SQLiteFSMStorage(settings.fsm_db_path, settings.fsm_ttl)
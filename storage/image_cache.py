@@ -0,0 +1,229 @@
+"""
+Многоуровневый кэш изображений: file_unique_id Telegram → sha256 содержимого → URL в fal-ai
+Байты изображений не хранятся: фото известного содержимого не скачивается и не загружается повторно
+Индекс меняется в памяти и записывается на диск фоновой задачей раз в IMAGE_CACHE_FLUSH_INTERVAL
+"""
+import os
+import json
+import shutil
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+
+from config.settings import settings
+from utils.logger import logger
+
+
+class ImageCache:
+    """Индекс изображений по содержимому с LRU и TTL: сами байты не хранятся"""
+
+    INDEX_FILE = "index.json"
+    # Каталог файлов прежней версии кэша - удаляется при загрузке
+    LEGACY_IMAGES_DIR = "images"
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or settings.cache_dir
+        self.max_entries = settings.image_cache_max_entries
+        self.ttl = settings.image_cache_ttl
+        self.url_ttl = settings.image_cache_url_ttl
+        self.flush_interval = settings.image_cache_flush_interval
+
+        # hash -> {"created", "accessed", "url", "url_created"}; порядок = LRU
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # file_unique_id -> hash
+        self._unique_ids: Dict[str, str] = {}
+        # Индекс изменился после последней записи на диск
+        self._dirty = False
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.counters = {
+            "id_hits": 0,
+            "id_misses": 0,
+            "upload_hits": 0,
+            "upload_misses": 0,
+            "evictions": 0
+        }
+
+    async def start(self) -> None:
+        """Загружает индекс и запускает фоновую запись"""
+        await self.load()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую запись и сохраняет последние изменения"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def load(self) -> None:
+        """Загружает индекс кэша с диска"""
+        try:
+            index = await asyncio.to_thread(self._read_index)
+            await asyncio.to_thread(self._remove_legacy_files)
+        except Exception as e:
+            logger.error(f"Failed to load image cache index: {e}")
+            return
+
+        entries = index.get("entries", {})
+        for content_hash, entry in sorted(entries.items(), key=lambda item: item[1].get("accessed", 0)):
+            entry.pop("path", None)
+            entry.pop("size", None)
+            self._entries[content_hash] = entry
+
+        for unique_id, content_hash in index.get("unique_ids", {}).items():
+            if content_hash in self._entries:
+                self._unique_ids[unique_id] = content_hash
+
+        self._evict()
+        logger.info(f"Image cache loaded: {len(self._entries)} entries")
+
+    def _read_index(self) -> Dict[str, Any]:
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return {}
+        with open(index_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _remove_legacy_files(self) -> None:
+        legacy_dir = os.path.join(self.cache_dir, self.LEGACY_IMAGES_DIR)
+        if os.path.isdir(legacy_dir):
+            shutil.rmtree(legacy_dir, ignore_errors=True)
+            logger.info(f"Removed legacy image cache files: {legacy_dir}")
+
+    def _write_index(self, snapshot: Dict[str, Any]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, index_path)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Записывает индекс на диск, если он изменился; все изменения за интервал - одной записью"""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            snapshot = {
+                "entries": {key: dict(value) for key, value in self._entries.items()},
+                "unique_ids": dict(self._unique_ids)
+            }
+            self._dirty = False
+            try:
+                await asyncio.to_thread(self._write_index, snapshot)
+            except Exception as e:
+                # Повторим при следующей записи
+                self._dirty = True
+                logger.error(f"Failed to save image cache index: {e}")
+
+    def _is_expired(self, entry: Dict[str, Any], now: float) -> bool:
+        return now - entry.get("created", 0) > self.ttl
+
+    def _touch(self, content_hash: str, now: float) -> Dict[str, Any]:
+        entry = self._entries[content_hash]
+        entry["accessed"] = now
+        self._entries.move_to_end(content_hash)
+        return entry
+
+    def _drop(self, content_hash: str) -> None:
+        """Удаляет запись из индекса"""
+        if self._entries.pop(content_hash, None) is None:
+            return
+        for unique_id in [uid for uid, h in self._unique_ids.items() if h == content_hash]:
+            del self._unique_ids[unique_id]
+        self.counters["evictions"] += 1
+
+    def _evict(self) -> None:
+        """Удаляет просроченные записи и вытесняет самые старые по LRU"""
+        now = time.time()
+        for content_hash in [h for h, e in self._entries.items() if self._is_expired(e, now)]:
+            self._drop(content_hash)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+    def lookup(self, file_unique_id: str) -> Optional[str]:
+        """
+        Уровень 1: ищет хэш содержимого по file_unique_id Telegram
+
+        Returns:
+            Хэш содержимого, если для него есть действующий URL в fal-ai, иначе None -
+            тогда фото нужно скачивать
+        """
+        now = time.time()
+        content_hash = self._unique_ids.get(file_unique_id)
+        entry = self._entries.get(content_hash) if content_hash else None
+        if entry is None or self._is_expired(entry, now) or not self._has_url(entry, now):
+            self.counters["id_misses"] += 1
+            return None
+        self.counters["id_hits"] += 1
+        self._touch(content_hash, now)
+        return content_hash
+
+    def remember(self, file_unique_id: str, content_hash: str) -> None:
+        """
+        Уровень 2: связывает file_unique_id с хэшем скачанного содержимого
+
+        Меняет только индекс в памяти, на диск он попадает при следующей фоновой записи.
+
+        Args:
+            file_unique_id: Уникальный ID файла в Telegram
+            content_hash: sha256 содержимого изображения
+        """
+        now = time.time()
+        if content_hash not in self._entries:
+            self._entries[content_hash] = {"created": now, "accessed": now}
+        self._touch(content_hash, now)
+        if self._unique_ids.get(file_unique_id) == content_hash:
+            return
+        self._unique_ids[file_unique_id] = content_hash
+        self._evict()
+        self._dirty = True
+
+    def _has_url(self, entry: Dict[str, Any], now: float) -> bool:
+        return bool(entry.get("url")) and now - entry.get("url_created", 0) <= self.url_ttl
+
+    def get_url(self, content_hash: str) -> Optional[str]:
+        """
+        Уровень 3: возвращает ранее полученный URL fal-ai для этого содержимого
+
+        Returns:
+            URL или None, если изображение нужно загружать заново
+        """
+        entry = self._entries.get(content_hash)
+        now = time.time()
+        if entry and self._has_url(entry, now):
+            self.counters["upload_hits"] += 1
+            self._touch(content_hash, now)
+            return entry["url"]
+        self.counters["upload_misses"] += 1
+        return None
+
+    def set_url(self, content_hash: str, url: str) -> None:
+        """Запоминает URL fal-ai для содержимого (на диск - при следующей фоновой записи)"""
+        now = time.time()
+        entry = self._entries.get(content_hash)
+        if entry is None:
+            entry = self._entries[content_hash] = {"created": now, "accessed": now}
+        entry["url"] = url
+        entry["url_created"] = now
+        self._evict()
+        self._dirty = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики попаданий/промахов и размер кэша"""
+        id_total = self.counters["id_hits"] + self.counters["id_misses"]
+        upload_total = self.counters["upload_hits"] + self.counters["upload_misses"]
+        return {
+            **self.counters,
+            "id_hit_ratio": self.counters["id_hits"] / id_total if id_total else 0.0,
+            "upload_hit_ratio": self.counters["upload_hits"] / upload_total if upload_total else 0.0,
+            "entries": len(self._entries)
+        }
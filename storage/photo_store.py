@@ -0,0 +1,77 @@
+"""
+Фото активных сессий примерки в памяти процесса
+Фото освобождается при завершении сессии или по TTL брошенной сессии
+"""
+import time
+import asyncio
+from typing import Optional, Dict, Tuple
+
+from config.settings import settings
+from image.photo_buffer import PhotoBuffer
+
+
+class PhotoStore:
+    """Фото человека по user_id между первым и вторым сообщением сессии"""
+
+    # Как часто (сек) удалять фото брошенных сессий
+    PURGE_INTERVAL = 60
+
+    def __init__(self, file_manager=None, ttl: Optional[int] = None):
+        self.ttl = ttl or settings.fsm_ttl
+        # Временные файлы сессии удаляются вместе с ней
+        self.file_manager = file_manager
+        # user_id -> (фото, время сохранения)
+        self._photos: Dict[int, Tuple[PhotoBuffer, float]] = {}
+        self._purge_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Запускает очистку брошенных сессий"""
+        self._purge_task = asyncio.create_task(self._purge_loop())
+
+    async def stop(self) -> None:
+        """Останавливает очистку и освобождает все фото"""
+        if self._purge_task:
+            self._purge_task.cancel()
+            try:
+                await self._purge_task
+            except asyncio.CancelledError:
+                pass
+            self._purge_task = None
+        for user_id in list(self._photos):
+            self.release(user_id)
+
+    def put(self, user_id: int, photo: PhotoBuffer) -> None:
+        """Сохраняет фото человека для сессии, освобождая предыдущее"""
+        previous = self._photos.get(user_id)
+        if previous and previous[0] is not photo:
+            previous[0].close()
+        self._photos[user_id] = (photo, time.monotonic())
+
+    def get(self, user_id: int) -> Optional[PhotoBuffer]:
+        """Возвращает фото человека или None, если сессия начата другим процессом"""
+        item = self._photos.get(user_id)
+        return item[0] if item else None
+
+    def release(self, user_id: int) -> None:
+        """Завершает сессию: освобождает память и удаляет временный файл"""
+        item = self._photos.pop(user_id, None)
+        if item:
+            item[0].close()
+        if self.file_manager:
+            self.file_manager.release_owner(user_id)
+
+    async def _purge_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.PURGE_INTERVAL)
+            deadline = time.monotonic() - self.ttl
+            for user_id in [uid for uid, (_, saved) in self._photos.items() if saved < deadline]:
+                self.release(user_id)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Возвращает число сессий и объем фото в памяти и на диске"""
+        photos = [photo for photo, _ in self._photos.values()]
+        return {
+            "sessions": len(photos),
+            "memory_bytes": sum(p.size for p in photos if p.data is not None),
+            "spilled_bytes": sum(p.size for p in photos if p.spill_path is not None)
+        }
@@ -0,0 +1,131 @@
+"""
+Фоновое зеркалирование локального хранилища в таблицы Google Sheets
+Таблицы остаются доступны операторам для просмотра, но источником данных является SQLite
+"""
+import asyncio
+from typing import Optional
+
+from config.settings import settings
+from storage.user_ledger import UserLedger
+from utils.logger import logger
+
+
+class SheetsReplicator:
+    """Переносит изменения из outbox SQLite в таблицы пользователей и аналитики"""
+
+    # Предельная пауза между попытками первичного импорта (сек)
+    BOOTSTRAP_MAX_DELAY = 60
+
+    def __init__(self, storage, sheets_client):
+        self.storage = storage
+        self.sheets_client = sheets_client
+        self.interval = settings.replication_interval
+        self.batch_size = settings.replication_batch_size
+        # Индекс строк таблицы пользователей, через него пишутся изменения
+        self.user_ledger = UserLedger(sheets_client)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """
+        Импортирует данные из таблиц, если база еще не заполнялась из них, и запускает репликацию
+
+        Пока импорт не удался, запуск не завершается и бот не принимает изменений: иначе
+        пользователи из таблицы были бы созданы заново с начальными токенами, а их балансы
+        в таблице перезаписаны.
+        """
+        if not settings.users_sheet_id:
+            logger.warning("Google Sheets not configured, replication disabled (changes stay in outbox)")
+            return
+
+        attempt = 0
+        while not await self._bootstrap():
+            attempt += 1
+            delay = min(self.interval * 2 ** attempt, self.BOOTSTRAP_MAX_DELAY)
+            logger.error(f"Import from Google Sheets failed, retry {attempt} in {delay:.0f}s (bot waits for it)")
+            await asyncio.sleep(delay)
+
+        if not await self.user_ledger.start():
+            logger.warning("Users sheet not loaded, replication waits until it is readable")
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        """Останавливает репликацию, предварительно отправив накопленные изменения"""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.replicate()
+        await self.user_ledger.stop()
+
+    async def _bootstrap(self) -> bool:
+        """
+        Первый запуск: переносит пользователей и нумерацию аналитики из таблиц в SQLite
+
+        Returns:
+            True если импорт выполнен (сейчас или раньше), False если таблицы не прочитались
+        """
+        if await self.storage.is_bootstrapped():
+            return True
+        if not self.sheets_client.worksheet and not await self.sheets_client.initialize():
+            return False
+        if not await self.user_ledger.load():
+            return False
+        last_id = await self.sheets_client.get_max_analytics_id()
+        if last_id is None:
+            return False
+
+        users = self.user_ledger.export_users()
+        await self.storage.import_from_sheets(users, last_id)
+        logger.info(f"Imported {len(users)} users from Google Sheets into local storage")
+        return True
+
+    async def _loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.replicate()
+
+    async def replicate(self) -> bool:
+        """
+        Переносит одну порцию изменений из outbox в таблицы
+
+        Returns:
+            True если порция записана (или outbox пуст), False при ошибке
+        """
+        try:
+            # Без индекса строк пользователи были бы добавлены в таблицу повторно
+            if not self.user_ledger.is_loaded and not await self.user_ledger.load():
+                return False
+
+            entries = await self.storage.fetch_outbox(self.batch_size)
+            if not entries:
+                return True
+
+            user_ids = sorted({ref for _, kind, ref in entries if kind == "user"})
+            analytics_ids = [ref for _, kind, ref in entries if kind == "analytics"]
+
+            for user in await self.storage.get_users(user_ids):
+                profile = {
+                    "username": user["username"],
+                    "first_name": user["first_name"],
+                    "last_name": user["last_name"],
+                    "last_activity": user["last_activity"]
+                }
+                self.user_ledger.mirror_user(user["user_id"], profile, user["tokens"])
+            if user_ids and not await self.user_ledger.flush():
+                return False
+
+            rows = [
+                [r["id"], r["user_id"], r["person_url"], r["garment_url"], r["result_url"], r["timestamp"]]
+                for r in await self.storage.get_analytics(analytics_ids)
+            ]
+            if rows and not await self.sheets_client.append_analytics_rows(rows):
+                return False
+
+            await self.storage.ack_outbox(entries[-1][0])
+            logger.info(f"Replicated {len(user_ids)} users and {len(rows)} analytics rows to Google Sheets")
+            return True
+
+        except Exception as e:
+            logger.error(f"Replication to Google Sheets failed: {e}")
+            return False
@@ -0,0 +1,182 @@
+"""
+Кэш результатов виртуальной примерки с объединением одинаковых одновременных запросов
+"""
+import os
+import json
+import time
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, Awaitable
+
+from config.settings import settings
+from utils.logger import logger
+
+
+class ResultCache:
+    """Персистентный кэш result_url по (фото человека, фото одежды, модель, параметры)"""
+
+    CACHE_FILE = "results.json"
+    # Итог общей генерации, если ее запустивший запрос отменен (например, пользователь отправил /start)
+    _LEADER_CANCELLED = object()
+
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir or settings.cache_dir
+        self.max_entries = settings.result_cache_max_entries
+        self.ttl = settings.result_cache_ttl
+
+        # key -> {"person_url", "garment_url", "result_url", "result_urls", "created"}; порядок = LRU
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # key -> future текущей генерации (single-flight)
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.counters = {
+            "hits": 0,
+            "misses": 0,
+            "merged": 0
+        }
+
+    @staticmethod
+    def make_key(person_hash: str, garment_hash: str, model: str, arguments: Dict[str, Any]) -> str:
+        """Строит ключ кэша из хэшей изображений, модели и параметров генерации"""
+        payload = json.dumps({
+            "person": person_hash,
+            "garment": garment_hash,
+            "model": model,
+            "arguments": arguments
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    async def load(self) -> None:
+        """Загружает сохраненные результаты с диска"""
+        try:
+            entries = await asyncio.to_thread(self._read_file)
+        except Exception as e:
+            logger.error(f"Failed to load result cache: {e}")
+            return
+
+        now = time.time()
+        for key, entry in sorted(entries.items(), key=lambda item: item[1].get("created", 0)):
+            if now - entry.get("created", 0) <= self.ttl:
+                self._entries[key] = entry
+        logger.info(f"Result cache loaded: {len(self._entries)} entries")
+
+    def _read_file(self) -> Dict[str, Any]:
+        path = os.path.join(self.cache_dir, self.CACHE_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_file(self, snapshot: Dict[str, Any]) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, self.CACHE_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, path)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Возвращает сохраненный результат или None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.get("created", 0) > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    async def put(self, key: str, result: Dict[str, Any]) -> None:
+        """Сохраняет результат и записывает кэш на диск"""
+        self._entries[key] = {
+            "person_url": result["person_url"],
+            "garment_url": result["garment_url"],
+            "result_url": result["result_url"],
+            "result_urls": result.get("result_urls") or [result["result_url"]],
+            "created": time.time()
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        snapshot = {k: dict(v) for k, v in self._entries.items()}
+        try:
+            await asyncio.to_thread(self._write_file, snapshot)
+        except Exception as e:
+            logger.error(f"Failed to save result cache: {e}")
+
+    async def get_or_create(self, key: str,
+                            factory: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """
+        Возвращает результат из кэша или выполняет генерацию
+
+        Одновременные запросы с одинаковым ключом ждут одну общую генерацию.
+        Если запрос, запустивший ее, отменен, генерацию перезапускает один из ожидающих,
+        а остальные ждут уже его. Результаты, полученные не собственной генерацией, помечаются 'cached': True.
+
+        Args:
+            key: Ключ из make_key()
+            factory: Корутина-функция, выполняющая генерацию
+
+        Returns:
+            Словарь с URL изображений или None при ошибке
+        """
+        merged = False
+        while True:
+            entry = self.get(key)
+            if entry is not None:
+                self.counters["hits"] += 1
+                logger.info(f"Try-on result taken from cache: {entry['result_url']}")
+                return self._as_result(entry, cached=True)
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            if not merged:
+                self.counters["merged"] += 1
+                merged = True
+            logger.info("Identical try-on already in progress, waiting for it")
+            result = await asyncio.shield(inflight)
+            if result is not self._LEADER_CANCELLED:
+                return self._as_result(result, cached=True) if result else None
+            # Первый проснувшийся ожидающий не найдет генерации в _inflight и запустит свою
+            logger.info("Identical try-on was cancelled by its requester, taking it over")
+
+        self.counters["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        result = None
+        cancelled = False
+        try:
+            result = await factory()
+            if result:
+                await self.put(key, result)
+            return result
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            future.set_result(self._LEADER_CANCELLED if cancelled else result)
+
+    @staticmethod
+    def _as_result(entry: Dict[str, Any], cached: bool) -> Dict[str, Any]:
+        return {
+            'person_url': entry['person_url'],
+            'garment_url': entry['garment_url'],
+            'result_url': entry['result_url'],
+            # Записи прежней версии кэша хранят только один вариант
+            'result_urls': entry.get('result_urls') or [entry['result_url']],
+            'cached': cached
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает счетчики попаданий, промахов и объединенных запросов"""
+        total = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_ratio": self.counters["hits"] / total if total else 0.0,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight)
+        }
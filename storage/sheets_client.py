@@ -1,13 +1,16 @@
 """
 Клиент для работы с Google Sheets
 """
+import asyncio
 import gspread
 from google.oauth2.service_account import Credentials as ServiceAccountCredentials
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 from utils.logger import logger
+from utils.metrics import metrics
 from config.settings import settings
+from storage.sheets_scheduler import SheetsScheduler, PRIORITY_TOKENS, PRIORITY_ANALYTICS, PRIORITY_STATS
 
 
 class SheetsClient:
@@ -20,24 +23,30 @@ class SheetsClient:
         # Для аналитики
         self.analytics_sheet = None
         self.analytics_worksheet = None
+        # Все вызовы таблиц идут через планировщик с учетом квот
+        self.scheduler = SheetsScheduler()
         
     async def initialize(self) -> bool:
         """Инициализация клиента Google Sheets"""
+        await self.scheduler.start()
         try:
-            # Загрузка учетных данных из JSON файла
+            # Загрузка учетных данных из JSON файла - чтение файла, запросов к Sheets API нет
             if hasattr(settings, 'google_credentials_file'):
-                self.gc = gspread.service_account(filename=settings.google_credentials_file)
+                self.gc = await asyncio.to_thread(gspread.service_account,
+                                                  filename=settings.google_credentials_file)
             else:
                 logger.error("Google credentials file not specified in settings")
                 return False
-                
-            # Открытие таблицы пользователей по ID
-            self.sheet = self.gc.open_by_key(settings.users_sheet_id)
-            self.worksheet = self.sheet.sheet1  # Первый лист
-            
-            # Открытие таблицы аналитики по ID
-            self.analytics_sheet = self.gc.open_by_key(settings.analytics_sheet_id)
-            self.analytics_worksheet = self.analytics_sheet.sheet1  # Первый лист
+
+            # Открытие таблиц и их первых листов - чтения метаданных, они идут через планировщик
+            self.sheet = await self.scheduler.read(self.gc, "open_by_key", settings.users_sheet_id,
+                                                   priority=PRIORITY_TOKENS)
+            self.worksheet = await self.scheduler.read(self.sheet, "get_worksheet", 0, priority=PRIORITY_TOKENS)
+
+            self.analytics_sheet = await self.scheduler.read(self.gc, "open_by_key", settings.analytics_sheet_id,
+                                                             priority=PRIORITY_ANALYTICS)
+            self.analytics_worksheet = await self.scheduler.read(self.analytics_sheet, "get_worksheet", 0,
+                                                                 priority=PRIORITY_ANALYTICS)
             
             logger.info("Google Sheets client initialized successfully (users + analytics)")
             return True
@@ -45,6 +54,10 @@ class SheetsClient:
         except Exception as e:
             logger.error(f"Failed to initialize Google Sheets client: {e}")
             return False
+
+    async def close(self) -> None:
+        """Останавливает планировщик запросов (после записи накопленных изменений хранилищами)"""
+        await self.scheduler.stop()
     
     async def add_or_update_user(self, user_id: int, username: Optional[str] = None, 
                                 first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
@@ -65,7 +78,8 @@ class SheetsClient:
             # Используем find() для поиска ячейки с ID пользователя
             existing_cell = None
             try:
-                existing_cell = self.worksheet.find(str(user_id))
+                existing_cell = await self.scheduler.read(self.worksheet, "find", str(user_id),
+                                                          priority=PRIORITY_TOKENS)
             except gspread.CellNotFound:
                 # Пользователь не найден - это нормально для новых пользователей
                 pass
@@ -86,13 +100,15 @@ class SheetsClient:
                 
                 # Обновляем только A-E, не трогаем столбец F (tokens)
                 cell_range = f"A{row_num}:E{row_num}"
-                self.worksheet.update(cell_range, [user_data])
+                await self.scheduler.update(self.worksheet, [{"range": cell_range, "values": [user_data]}],
+                                            priority=PRIORITY_TOKENS)
                 
                 logger.info(f"Updated user {user_id} in row {row_num}")
             else:
                 # Добавляем нового пользователя с начальными токенами
                 user_data_with_tokens = user_data + [10]  # Добавляем токены в столбец F
-                self.worksheet.append_row(user_data_with_tokens)
+                await self.scheduler.write(self.worksheet, "append_row", user_data_with_tokens,
+                                           priority=PRIORITY_TOKENS)
                 logger.info(f"Added new user {user_id} with 10 tokens")
                 
             return True
@@ -107,11 +123,13 @@ class SheetsClient:
             if not self.worksheet:
                 return {"error": "Worksheet not initialized"}
                 
-            # Получаем количество строк с данными
-            total_rows = len(self.worksheet.get_all_values()) - 1  # -1 для заголовка
-            
-            # Получаем колонку с username для подсчета заполненных
-            username_column = self.worksheet.col_values(2)[1:]  # Пропускаем заголовок
+            # Все строки (для количества) и колонка username (для подсчета заполненных) - в низшем приоритете
+            rows, usernames = await asyncio.gather(
+                self.scheduler.read(self.worksheet, "get_all_values", priority=PRIORITY_STATS),
+                self.scheduler.read(self.worksheet, "col_values", 2, priority=PRIORITY_STATS)
+            )
+            total_rows = len(rows) - 1  # -1 для заголовка
+            username_column = usernames[1:]  # Пропускаем заголовок
             users_with_username = sum(1 for username in username_column if username.strip())
             
             return {
@@ -124,37 +142,33 @@ class SheetsClient:
             logger.error(f"Failed to get user stats: {e}")
             return {"error": str(e)}
     
-    async def get_next_analytics_id(self) -> int:
-        """Получает следующий ID для записи в аналитику"""
+    async def get_max_analytics_id(self) -> Optional[int]:
+        """
+        Возвращает максимальный ID в таблице аналитики (читает только столбец A)
+
+        Returns:
+            Максимальный ID (0 для пустой таблицы) или None, если таблица недоступна -
+            тогда нумерация неизвестна и начинать ее с нуля нельзя
+        """
         try:
             if not self.analytics_worksheet:
                 logger.error("Analytics worksheet not initialized")
-                return 1
+                return None
                 
-            # Получаем количество строк с данными (не считая заголовок)
-            all_values = self.analytics_worksheet.get_all_values()
-            
-            # Если таблица пустая или только заголовок
-            if len(all_values) <= 1:
-                return 1
-                
-            # Возвращаем количество строк (следующий ID)
-            return len(all_values)
+            ids = await self.scheduler.read(self.analytics_worksheet, "col_values", 1, priority=PRIORITY_ANALYTICS)
+            numeric_ids = [int(value) for value in ids[1:] if value.strip().isdigit()]  # Пропускаем заголовок
+            return max(numeric_ids, default=0)
             
         except Exception as e:
-            logger.error(f"Failed to get next analytics ID: {e}")
-            return 1
+            logger.error(f"Failed to get max analytics ID: {e}")
+            return None
     
-    async def log_generation(self, user_id: int, person_url: str, garment_url: str, 
-                           result_url: str) -> bool:
+    async def append_analytics_rows(self, rows: List[list]) -> bool:
         """
-        Записывает данные о генерации в таблицу аналитики
+        Добавляет пакет строк в таблицу аналитики одним запросом
         
         Args:
-            user_id: ID пользователя в Telegram
-            person_url: URL фото человека
-            garment_url: URL фото одежды
-            result_url: URL результата генерации
+            rows: Строки вида [id, user_id, person_url, garment_url, result_url, timestamp]
             
         Returns:
             True если успешно, False при ошибке
@@ -163,36 +177,22 @@ class SheetsClient:
             if not self.analytics_worksheet:
                 logger.error("Analytics worksheet not initialized")
                 return False
-                
-            # Получаем следующий ID
-            next_id = await self.get_next_analytics_id()
-            
-            # Текущее время
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Находим первую пустую строку
-            all_values = self.analytics_worksheet.get_all_values()
-            next_row = len(all_values) + 1
-            
-            # Данные для записи в конкретные ячейки
-            analytics_data = [
-                next_id,           # A: id
-                user_id,           # B: id_user
-                person_url,        # C: input_human_image_url
-                garment_url,       # D: input_garment_image_url
-                result_url,        # E: output_image_url
-                timestamp          # F: timestamp
-            ]
-            
-            # Записываем данные в конкретный диапазон A:F
-            cell_range = f"A{next_row}:F{next_row}"
-            self.analytics_worksheet.update(cell_range, [analytics_data])
             
-            logger.info(f"Logged generation for user {user_id} with ID {next_id} in row {next_row}")
+            # table_range привязывает запись к столбцам A-F, чтобы данные не смещались
+            with metrics.stage("sheets_analytics_append"):
+                await self.scheduler.write(
+                    self.analytics_worksheet,
+                    "append_rows",
+                    rows,
+                    table_range="A1:F1",
+                    priority=PRIORITY_ANALYTICS
+                )
+            
+            logger.info(f"Appended {len(rows)} analytics rows")
             return True
             
         except Exception as e:
-            logger.error(f"Failed to log generation for user {user_id}: {e}")
+            logger.error(f"Failed to append analytics rows: {e}")
             return False
 
 
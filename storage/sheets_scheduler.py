@@ -0,0 +1,258 @@
+"""
+Планировщик запросов к Google Sheets: все вызовы таблиц проходят через одну очередь с учетом минутных квот
+Одинаковые чтения объединяются, записи диапазонов собираются в один batch_update, остальное идет по приоритету
+"""
+import time
+import random
+import asyncio
+import itertools
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Optional, Dict, List, Deque, Set
+
+from config.settings import settings
+from utils.errors import is_transient
+from utils.logger import logger
+
+# Приоритеты запросов: меньше - раньше
+PRIORITY_TOKENS = 0
+PRIORITY_ANALYTICS = 1
+PRIORITY_STATS = 2
+PRIORITY_NAMES = {PRIORITY_TOKENS: "tokens", PRIORITY_ANALYTICS: "analytics", PRIORITY_STATS: "stats"}
+
+READ = "read"
+WRITE = "write"
+
+# Квоты Google Sheets считаются за скользящую минуту
+QUOTA_WINDOW = 60.0
+
+
+@dataclass
+class SheetsRequest:
+    """Вызов метода листа gspread, ожидающий выполнения"""
+    priority: int
+    seq: int
+    kind: str
+    worksheet: Any
+    method: str
+    args: tuple
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    # Ключ объединения одинаковых чтений
+    key: Optional[tuple] = None
+    # Диапазоны batch_update, собранные из нескольких update()
+    data: Optional[List[Dict[str, Any]]] = None
+    attempts: int = 0
+    not_before: float = 0.0
+
+
+class SheetsScheduler:
+    """
+    Очередь вызовов Google Sheets с квотами на чтение и запись
+
+    Запрос выполняется, когда в его квоте есть место; из готовых первым идет запрос с меньшим приоритетом.
+    Записи одного листа выполняются по одной и в порядке поступления. 429 и временные ошибки
+    повторяются с экспоненциальной задержкой, после 429 очередь приостанавливается целиком.
+    """
+
+    def __init__(self, read_quota: Optional[int] = None, write_quota: Optional[int] = None,
+                 concurrency: Optional[int] = None):
+        self.quotas = {
+            READ: read_quota or settings.sheets_read_quota,
+            WRITE: write_quota or settings.sheets_write_quota
+        }
+        self.concurrency = max(concurrency or settings.sheets_concurrency, 1)
+        self.retry_attempts = max(settings.sheets_retry_attempts, 1)
+        self.retry_base_delay = settings.sheets_retry_base_delay
+        self.retry_max_delay = settings.sheets_retry_max_delay
+
+        self._pending: List[SheetsRequest] = []
+        # Ожидающие и выполняющиеся чтения - к ним присоединяются одинаковые
+        self._reads: Dict[tuple, SheetsRequest] = {}
+        # Еще не начатый batch_update каждого листа - к нему добавляются новые диапазоны
+        self._batches: Dict[int, SheetsRequest] = {}
+        # Листы, запись в которые выполняется сейчас
+        self._writing: Set[int] = set()
+        # Время отправки запросов за последнюю минуту
+        self._sent: Dict[str, Deque[float]] = {READ: deque(), WRITE: deque()}
+        self._paused_until = 0.0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self.counters = {
+            "requests": 0, "read_calls": 0, "write_calls": 0, "merged_reads": 0, "combined_writes": 0,
+            "throttled": 0, "retries": 0, "failed": 0
+        }
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self) -> None:
+        """Останавливает очередь; невыполненные запросы завершаются ошибкой"""
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        for request in self._pending:
+            if not request.future.done():
+                request.future.set_exception(RuntimeError("Sheets scheduler stopped"))
+        self._pending.clear()
+        self._reads.clear()
+        self._batches.clear()
+
+    async def read(self, worksheet, method: str, *args, priority: int = PRIORITY_STATS, **kwargs) -> Any:
+        """Чтение (get_all_values, col_values, find...); одинаковое ожидающее или идущее чтение переиспользуется"""
+        key = (id(worksheet), method, args, tuple(sorted(kwargs.items())))
+        request = self._reads.get(key)
+        if request is not None:
+            request.priority = min(request.priority, priority)
+            self.counters["merged_reads"] += 1
+        else:
+            request = self._enqueue(READ, worksheet, method, args, kwargs, priority, key=key)
+            self._reads[key] = request
+        return await asyncio.shield(request.future)
+
+    async def write(self, worksheet, method: str, *args, priority: int = PRIORITY_TOKENS, **kwargs) -> Any:
+        """Запись, которую нельзя объединить (append_row, append_rows)"""
+        request = self._enqueue(WRITE, worksheet, method, args, kwargs, priority)
+        return await asyncio.shield(request.future)
+
+    async def update(self, worksheet, data: List[Dict[str, Any]], priority: int = PRIORITY_TOKENS) -> Any:
+        """
+        Запись диапазонов ({"range": "A2:E2", "values": [[...]]}); все update() листа,
+        поступившие до отправки, уходят одним batch_update
+        """
+        request = self._batches.get(id(worksheet))
+        if request is not None:
+            request.data.extend(data)
+            request.priority = min(request.priority, priority)
+            self.counters["combined_writes"] += 1
+        else:
+            batch = list(data)
+            request = self._enqueue(WRITE, worksheet, "batch_update", (batch,), {}, priority)
+            request.data = batch
+            self._batches[id(worksheet)] = request
+        return await asyncio.shield(request.future)
+
+    def _enqueue(self, kind: str, worksheet, method: str, args: tuple, kwargs: Dict[str, Any],
+                 priority: int, key: Optional[tuple] = None) -> SheetsRequest:
+        request = SheetsRequest(priority=priority, seq=next(self._seq), kind=kind, worksheet=worksheet,
+                                method=method, args=args, kwargs=kwargs,
+                                future=asyncio.get_running_loop().create_future(), key=key)
+        self._pending.append(request)
+        self.counters["requests"] += 1
+        self._wakeup.set()
+        return request
+
+    def _quota_free_at(self, kind: str, now: float) -> float:
+        """Когда в квоте освободится место (now - если место есть)"""
+        sent = self._sent[kind]
+        while sent and now - sent[0] >= QUOTA_WINDOW:
+            sent.popleft()
+        if len(sent) < self.quotas[kind]:
+            return now
+        return sent[len(sent) - self.quotas[kind]] + QUOTA_WINDOW
+
+    def _pick(self, now: float) -> Optional[SheetsRequest]:
+        """Готовый к отправке запрос с наименьшим приоритетом"""
+        for request in sorted(self._pending, key=lambda r: (r.priority, r.seq)):
+            if request.kind == WRITE:
+                sheet = id(request.worksheet)
+                if sheet in self._writing:
+                    continue
+                # Записи листа идут по порядку: более ранняя запись выполняется первой с приоритетом поздней
+                request = min((r for r in self._pending if r.kind == WRITE and id(r.worksheet) == sheet),
+                              key=lambda r: r.seq)
+            if request.not_before <= now and self._quota_free_at(request.kind, now) <= now:
+                return request
+        return None
+
+    def _wait_time(self, now: float) -> Optional[float]:
+        """Через сколько секунд может стать готовым какой-то запрос; None - ждать нового события"""
+        times = [max(r.not_before, self._quota_free_at(r.kind, now)) for r in self._pending
+                 if not (r.kind == WRITE and id(r.worksheet) in self._writing)]
+        return max(min(times) - now, 0.0) if times else None
+
+    async def _next(self) -> SheetsRequest:
+        while True:
+            now = time.monotonic()
+            if now >= self._paused_until:
+                request = self._pick(now)
+                if request is not None:
+                    self._pending.remove(request)
+                    if self._batches.get(id(request.worksheet)) is request:
+                        del self._batches[id(request.worksheet)]
+                    if request.kind == WRITE:
+                        self._writing.add(id(request.worksheet))
+                    self._sent[request.kind].append(now)
+                    return request
+                timeout = self._wait_time(now)
+            else:
+                timeout = self._paused_until - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self) -> None:
+        while True:
+            request = await self._next()
+            self.counters[f"{request.kind}_calls"] += 1
+            try:
+                result = await asyncio.to_thread(getattr(request.worksheet, request.method),
+                                                 *request.args, **request.kwargs)
+            except Exception as e:
+                self._retry_or_fail(request, e)
+            else:
+                self._finish(request)
+                if not request.future.done():
+                    request.future.set_result(result)
+            finally:
+                self._wakeup.set()
+
+    def _finish(self, request: SheetsRequest) -> None:
+        if request.kind == WRITE:
+            self._writing.discard(id(request.worksheet))
+        if request.key is not None and self._reads.get(request.key) is request:
+            del self._reads[request.key]
+
+    def _retry_or_fail(self, request: SheetsRequest, error: Exception) -> None:
+        request.attempts += 1
+        if is_transient(error) and request.attempts < self.retry_attempts:
+            delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** (request.attempts - 1)))
+            request.not_before = time.monotonic() + delay
+            status = getattr(getattr(error, "response", None), "status_code", None)
+            if status == 429:
+                # Квота проекта исчерпана - остальные запросы тоже получили бы 429
+                self._paused_until = max(self._paused_until, request.not_before)
+                self.counters["throttled"] += 1
+            self.counters["retries"] += 1
+            logger.warning(f"Sheets {request.method} failed ({error}), retry {request.attempts} in {delay:.1f}s")
+            if request.kind == WRITE:
+                self._writing.discard(id(request.worksheet))
+            self._pending.append(request)
+            return
+
+        self._finish(request)
+        self.counters["failed"] += 1
+        if not request.future.done():
+            request.future.set_exception(error)
+
+    def get_stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        for kind in self._sent:
+            self._quota_free_at(kind, now)
+        return {
+            **self.counters,
+            "pending": len(self._pending),
+            "pending_by_priority": {
+                name: sum(1 for r in self._pending if r.priority == priority)
+                for priority, name in PRIORITY_NAMES.items()
+            },
+            "quota_used": {kind: len(sent) for kind, sent in self._sent.items()},
+            "quota_limit": dict(self.quotas),
+            "paused": now < self._paused_until
+        }
@@ -0,0 +1,307 @@
+"""
+Индекс пользователей в памяти поверх таблицы Google Sheets
+Чтение - из памяти, запись - фоновой пакетной отправкой в таблицу
+"""
+import re
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional, Dict, List, Set
+
+from config.settings import settings
+from utils.logger import logger
+from utils.metrics import metrics
+from storage.sheets_scheduler import PRIORITY_TOKENS
+
+
+@dataclass
+class UserRecord:
+    """Строка пользователя в таблице"""
+    row: Optional[int]  # None, пока строка еще не добавлена в таблицу
+    tokens: int
+    profile: Dict[str, str] = field(default_factory=dict)
+
+
+class UserLedger:
+    """Реестр пользователей: user_id → (строка, токены, профиль)"""
+
+    INITIAL_TOKENS = 10
+    TOKENS_COLUMN = "F"
+
+    def __init__(self, sheets_client):
+        self.sheets_client = sheets_client
+        self.flush_interval = settings.ledger_flush_interval
+        self.resync_interval = settings.ledger_resync_interval
+
+        self._users: Dict[int, UserRecord] = {}
+        self._loaded = False
+
+        # Изменения, ожидающие записи в таблицу
+        self._dirty_tokens: Set[int] = set()
+        self._dirty_profiles: Set[int] = set()
+        self._new_users: List[int] = []
+
+        # Запись и пересинхронизация не должны пересекаться
+        self._sync_lock = asyncio.Lock()
+        self._flush_event = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    async def start(self) -> bool:
+        """
+        Загружает таблицу и запускает фоновые задачи записи и пересинхронизации
+
+        Returns:
+            True если таблица загружена; иначе загрузку повторит пересинхронизация
+        """
+        loaded = self._loaded or await self.load()
+        self._tasks.append(asyncio.create_task(self._flush_loop()))
+        self._tasks.append(asyncio.create_task(self._resync_loop()))
+        return loaded
+
+    async def stop(self) -> None:
+        """Останавливает фоновые задачи и записывает накопленные изменения"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self.flush()
+
+    async def load(self) -> bool:
+        """
+        Загружает всех пользователей одним запросом
+
+        Returns:
+            True если успешно, False при ошибке
+        """
+        worksheet = self.sheets_client.worksheet
+        if not worksheet:
+            logger.error("Worksheet not initialized, user ledger is empty")
+            return False
+
+        async with self._sync_lock:
+            try:
+                with metrics.stage("sheets_user_read"):
+                    rows = await self.sheets_client.scheduler.read(worksheet, "get_all_values",
+                                                                   priority=PRIORITY_TOKENS)
+            except Exception as e:
+                logger.error(f"Failed to load users sheet: {e}")
+                return False
+            self._merge_rows(rows)
+            self._loaded = True
+
+        logger.info(f"User ledger loaded: {len(self._users)} users")
+        return True
+
+    def _merge_rows(self, rows: List[List[str]]) -> None:
+        """Обновляет индекс из таблицы, не затирая еще не записанные изменения"""
+        seen: Set[int] = set()
+        for row_num, values in enumerate(rows, start=1):
+            if not values:
+                continue
+            try:
+                user_id = int(values[0])
+            except ValueError:
+                continue  # Заголовок или мусор
+            seen.add(user_id)
+
+            values = values + [""] * (6 - len(values))
+            profile = {
+                "username": values[1],
+                "first_name": values[2],
+                "last_name": values[3],
+                "last_activity": values[4]
+            }
+            try:
+                tokens = int(values[5])
+                invalid_tokens = False
+            except ValueError:
+                # Пустое или некорректное значение - старый пользователь, даем начальные токены
+                logger.info(f"User {user_id} has empty or invalid tokens field, setting to {self.INITIAL_TOKENS}")
+                tokens = self.INITIAL_TOKENS
+                invalid_tokens = True
+
+            record = self._users.get(user_id)
+            if record is None:
+                self._users[user_id] = UserRecord(row=row_num, tokens=tokens, profile=profile)
+            else:
+                record.row = row_num
+                if user_id not in self._dirty_tokens:
+                    record.tokens = tokens
+                if user_id not in self._dirty_profiles:
+                    record.profile = profile
+            if invalid_tokens:
+                self._mark_tokens_dirty(user_id)
+
+        # Пользователи, удаленные из таблицы вручную (кроме еще не добавленных)
+        for user_id in [uid for uid, r in self._users.items() if uid not in seen and r.row is not None]:
+            del self._users[user_id]
+            self._dirty_tokens.discard(user_id)
+            self._dirty_profiles.discard(user_id)
+
+    def get_tokens(self, user_id: int) -> Optional[int]:
+        """Возвращает количество токенов из памяти или None, если пользователь неизвестен"""
+        record = self._users.get(user_id)
+        return record.tokens if record else None
+
+    def set_tokens(self, user_id: int, tokens: int) -> bool:
+        """Меняет количество токенов в памяти и ставит запись в очередь"""
+        record = self._users.get(user_id)
+        if record is None:
+            return False
+        record.tokens = tokens
+        self._mark_tokens_dirty(user_id)
+        return True
+
+    def upsert_user(self, user_id: int, username: Optional[str] = None,
+                    first_name: Optional[str] = None, last_name: Optional[str] = None) -> bool:
+        """
+        Добавляет нового пользователя или обновляет профиль существующего
+
+        Returns:
+            True если пользователь новый, False если обновлен
+        """
+        profile = {
+            "username": username or "",
+            "first_name": first_name or "",
+            "last_name": last_name or "",
+            "last_activity": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        record = self._users.get(user_id)
+        if record is None:
+            self._users[user_id] = UserRecord(row=None, tokens=self.INITIAL_TOKENS, profile=profile)
+            self._new_users.append(user_id)
+            self._flush_event.set()
+            logger.info(f"Added new user {user_id} with {self.INITIAL_TOKENS} tokens")
+            return True
+
+        record.profile = profile
+        if record.row is not None:
+            self._dirty_profiles.add(user_id)
+            self._flush_event.set()
+        return False
+
+    def mirror_user(self, user_id: int, profile: Dict[str, str], tokens: int) -> None:
+        """Переписывает пользователя значениями из основного хранилища"""
+        record = self._users.get(user_id)
+        if record is None:
+            self._users[user_id] = UserRecord(row=None, tokens=tokens, profile=dict(profile))
+            self._new_users.append(user_id)
+        else:
+            record.profile = dict(profile)
+            record.tokens = tokens
+            if record.row is not None:
+                self._dirty_profiles.add(user_id)
+                self._dirty_tokens.add(user_id)
+        self._flush_event.set()
+
+    def export_users(self) -> List[tuple]:
+        """Возвращает всех пользователей как (user_id, profile, tokens)"""
+        return [(user_id, dict(record.profile), record.tokens) for user_id, record in self._users.items()]
+
+    def _mark_tokens_dirty(self, user_id: int) -> None:
+        self._dirty_tokens.add(user_id)
+        self._flush_event.set()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._flush_event.wait()
+            # Небольшая задержка, чтобы собрать несколько изменений в один запрос
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def _resync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.resync_interval)
+            await self.load()
+
+    async def flush(self) -> bool:
+        """
+        Записывает накопленные изменения в таблицу пакетно: новые пользователи - одним append_rows,
+        профили и токены - одним batch_update
+
+        Returns:
+            True если все изменения записаны, False если часть осталась в очереди
+        """
+        worksheet = self.sheets_client.worksheet
+        if not worksheet:
+            return False
+
+        async with self._sync_lock:
+            self._flush_event.clear()
+
+            new_users, self._new_users = self._new_users, []
+            appended = []
+            for user_id in new_users:
+                record = self._users.get(user_id)
+                if record is None or record.row is not None or user_id in appended:
+                    continue
+                self._dirty_tokens.discard(user_id)
+                self._dirty_profiles.discard(user_id)
+                appended.append(user_id)
+            if appended:
+                rows = []
+                for user_id in appended:
+                    p = self._users[user_id].profile
+                    rows.append([str(user_id), p["username"], p["first_name"], p["last_name"],
+                                 p["last_activity"], self._users[user_id].tokens])
+                try:
+                    with metrics.stage("sheets_user_append"):
+                        response = await self.sheets_client.scheduler.write(
+                            worksheet, "append_rows", rows, table_range="A1:F1", priority=PRIORITY_TOKENS
+                        )
+                    # Строки добавляются подряд, начиная с первой строки ответа
+                    first_row = self._parse_row(response)
+                    for offset, user_id in enumerate(appended):
+                        record = self._users.get(user_id)
+                        if record is not None:
+                            record.row = first_row + offset if first_row else None
+                except Exception as e:
+                    logger.error(f"Failed to append {len(appended)} users: {e}")
+                    self._new_users.extend(appended)
+
+            updates = []
+            dirty_profiles, self._dirty_profiles = self._dirty_profiles, set()
+            dirty_tokens, self._dirty_tokens = self._dirty_tokens, set()
+            for user_id in dirty_profiles:
+                record = self._users.get(user_id)
+                if record and record.row:
+                    p = record.profile
+                    updates.append({
+                        "range": f"A{record.row}:E{record.row}",
+                        "values": [[str(user_id), p["username"], p["first_name"], p["last_name"], p["last_activity"]]]
+                    })
+            for user_id in dirty_tokens:
+                record = self._users.get(user_id)
+                if record and record.row:
+                    updates.append({
+                        "range": f"{self.TOKENS_COLUMN}{record.row}",
+                        "values": [[record.tokens]]
+                    })
+
+            if updates:
+                try:
+                    with metrics.stage("sheets_user_update"):
+                        await self.sheets_client.scheduler.update(worksheet, updates, priority=PRIORITY_TOKENS)
+                    logger.info(f"User ledger flushed {len(updates)} updates")
+                except Exception as e:
+                    logger.error(f"Failed to flush user ledger: {e}")
+                    # Вернем изменения в очередь для следующей попытки
+                    self._dirty_profiles |= dirty_profiles
+                    self._dirty_tokens |= dirty_tokens
+                    self._flush_event.set()
+                    return False
+
+            return not self._new_users
+
+    @staticmethod
+    def _parse_row(response) -> Optional[int]:
+        """Достает номер первой строки из ответа append_rows ('Sheet1!A5:F7' → 5)"""
+        try:
+            updated_range = response["updates"]["updatedRange"]
+            return int(re.search(r"![A-Z]+(\d+)", updated_range).group(1))
+        except Exception:
+            return None
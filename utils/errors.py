@@ -0,0 +1,24 @@
+"""
+Классификация ошибок внешних сервисов (fal-ai, Google Sheets): какие из них имеет смысл повторять
+"""
+
+# HTTP статусы, при которых повтор имеет смысл
+TRANSIENT_STATUSES = {408, 409, 425, 429, 500, 502, 503, 504}
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Временная ли ошибка: сеть, таймаут, перегрузка или 5xx
+
+    Ошибки 4xx (например, неподходящее фото или нет доступа к таблице) повторять бессмысленно.
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is not None:
+        return status in TRANSIENT_STATUSES
+    # Сетевые ошибки httpx (ConnectError, ReadTimeout и т.п.) не наследуют ConnectionError
+    return type(error).__module__.startswith("httpx") or isinstance(error, OSError)
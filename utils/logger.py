@@ -1,14 +1,59 @@
 """
 Настройка логирования через loguru
+Запись в файл идет через очередь в отдельном потоке, event loop не ждет диск
 """
+import json
+import traceback
+import multiprocessing
 from loguru import logger
 from config.settings import settings
+from utils import tracing
+
+# Поля записи, которые выводятся отдельно от extra
+_RESERVED_EXTRA = {"trace_id", "user_id", "_json"}
+
+
+def _add_trace(record) -> None:
+    """Добавляет trace ID текущего запроса в каждую запись"""
+    trace = tracing.current()
+    extra = record["extra"]
+    extra.setdefault("trace_id", trace.trace_id if trace else "-")
+    if trace and trace.user_id is not None:
+        extra.setdefault("user_id", trace.user_id)
+
+
+def _json_format(record) -> str:
+    """Одна строка JSON на запись: время, уровень, место, сообщение, trace ID и поля из bind()"""
+    entry = {
+        "ts": record["time"].isoformat(timespec="milliseconds"),
+        "level": record["level"].name,
+        "logger": f"{record['name']}:{record['line']}",
+        "msg": record["message"],
+        "trace_id": record["extra"].get("trace_id", "-")
+    }
+    if "user_id" in record["extra"]:
+        entry["user_id"] = record["extra"]["user_id"]
+    for key, value in record["extra"].items():
+        if key not in _RESERVED_EXTRA:
+            entry[key] = value
+    if record["exception"]:
+        entry["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    record["extra"]["_json"] = json.dumps(entry, ensure_ascii=False, default=str)
+    return "{extra[_json]}\n"
+
 
 # Настройка форматирования и уровня логов
 logger.remove()
-logger.add(
-    "logs/app.log",
-    level=settings.log_level,
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {name}:{line} | {message}",
-    rotation="1 day"
-)
\ No newline at end of file
+logger.configure(patcher=_add_trace)
+# Процессы пула ImageNormalizer (spawn) заново импортируют модули приложения - в них файловый sink
+# не добавляется, иначе каждый воркер запускал бы свой поток записи в тот же logs/app.log
+if multiprocessing.current_process().name == "MainProcess":
+    logger.add(
+        "logs/app.log",
+        level=settings.log_level,
+        format=_json_format if settings.log_format == "json" else
+        "{time:YYYY-MM-DD HH:mm:ss} | {level} | {extra[trace_id]} | {name}:{line} | {message}",
+        rotation="1 day",
+        # Форматирование в вызывающем коде, запись в файл - в фоновом потоке loguru
+        enqueue=True
+    )
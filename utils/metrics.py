@@ -0,0 +1,205 @@
+"""
+Метрики в текстовом формате Prometheus без внешних зависимостей
+Гистограммы длительностей стадий примерки и показатели сервисов, которые снимаются при запросе /metrics
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterable, List, Tuple, Union
+
+from utils.logger import logger
+from utils import tracing
+
+
+# Границы корзин (сек): от чтения из SQLite до генерации в fal-ai
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160, 320)
+
+LabelValues = Tuple[str, ...]
+# Значение показателя: число или {значения меток: число}
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Iterable[str], values: Iterable[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счетчик с метками"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами
+
+    Замер - bisect по корзинам и два сложения, поэтому метрики можно держать включенными в продакшене.
+    Кумулятивные значения корзин считаются только при выдаче.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # значения меток -> [счетчики по корзинам (последний - +Inf), сумма]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    """Показатель, который читается из сервиса при выдаче (глубина очереди, доля попаданий кэша)"""
+
+    def __init__(self, name: str, documentation: str, func: Callable[[], GaugeValue],
+                 labelnames: Tuple[str, ...] = (), kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.func = func
+        self.labelnames = labelnames
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.warning(f"Metric {self.name} collection failed: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        values = value if isinstance(value, dict) else {(): value}
+        for key, item in values.items():
+            if item is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(item)}")
+        return lines
+
+
+class StageTimer:
+    """Замер одной стадии; fail() отмечает ошибку, если функция сообщает о ней без исключения"""
+
+    def __init__(self):
+        self.outcome = "ok"
+
+    def fail(self) -> None:
+        self.outcome = "error"
+
+
+class MetricsRegistry:
+    """Реестр метрик процесса бота"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+        self.stage_seconds = self.histogram(
+            "tryon_stage_duration_seconds",
+            "Duration of try-on pipeline stages",
+            ("stage", "outcome")
+        )
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name: str, documentation: str, func: Callable[[], GaugeValue],
+              labelnames: Tuple[str, ...] = (), kind: str = "gauge") -> CallbackMetric:
+        """
+        Регистрирует показатель, вычисляемый при выдаче
+
+        Повторная регистрация заменяет функцию: новый экземпляр сервиса вытесняет старый.
+
+        Args:
+            func: Возвращает число или {значения меток: число}
+            kind: gauge или counter (для накопительных счетчиков сервисов)
+        """
+        if isinstance(self._metrics.get(name), CallbackMetric):
+            del self._metrics[name]
+        return self._register(CallbackMetric(name, documentation, func, labelnames, kind))
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Замеряет длительность стадии примерки
+
+        Исключение внутри блока записывается как outcome="error" и пробрасывается дальше;
+        отмена задачи записывается как outcome="cancelled". Внутри трассы стадия пишется в лог как span.
+        """
+        timer = StageTimer()
+        started = time.perf_counter()
+        try:
+            yield timer
+        except BaseException as e:
+            timer.outcome = "error" if isinstance(e, Exception) else "cancelled"
+            raise
+        finally:
+            self.observe_stage(name, time.perf_counter() - started, timer.outcome)
+
+    def observe_stage(self, name: str, seconds: float, outcome: str = "ok") -> None:
+        """Записывает стадию, длительность которой измерена вне блока with (ожидание в очереди)"""
+        self.stage_seconds.observe(seconds, stage=name, outcome=outcome)
+        tracing.record_span(name, seconds, outcome)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus 0.0.4"""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Глобальный реестр: стадии замеряются в модулях, показатели сервисов регистрирует контейнер
+metrics = MetricsRegistry()
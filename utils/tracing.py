@@ -0,0 +1,75 @@
+"""
+Трассировка генераций: trace ID в контексте задачи и тайминги стадий (span) в структурированных логах
+Контекст переходит в задачи asyncio автоматически, в воркеры очереди - через GenerationJob.trace
+"""
+import random
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any
+
+from config.settings import settings
+
+
+@dataclass(frozen=True)
+class Trace:
+    """Контекст одного запроса пользователя"""
+    trace_id: str
+    user_id: Optional[int] = None
+    # Логировать ли полные ответы сервисов (LOG_PAYLOAD_SAMPLE_RATE)
+    sampled: bool = False
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def child(self, suffix: str) -> "Trace":
+        """Трасса одной генерации внутри запроса (вещь альбома)"""
+        return Trace(f"{self.trace_id}.{suffix}", self.user_id, self.sampled, self.attributes)
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def new_trace(user_id: Optional[int] = None, **attributes: Any) -> Trace:
+    return Trace(
+        trace_id=uuid.uuid4().hex[:16],
+        user_id=user_id,
+        sampled=random.random() < settings.log_payload_sample_rate,
+        attributes=attributes
+    )
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]):
+    """Делает trace текущим внутри блока (None - блок вне трассы)"""
+    token = _current.set(trace)
+    try:
+        yield trace
+    finally:
+        _current.reset(token)
+
+
+def record_span(name: str, seconds: float, outcome: str) -> None:
+    """Пишет тайминг стадии в лог, если стадия выполняется внутри трассы"""
+    if _current.get() is None:
+        return
+    # utils.logger импортирует этот модуль для trace ID в записях
+    from utils.logger import logger
+    logger.bind(span=name, duration_ms=round(seconds * 1000, 2), outcome=outcome).info(
+        f"span {name} {outcome} in {seconds * 1000:.1f}ms"
+    )
+
+
+def log_payload(message: str, payload: Any) -> None:
+    """Полный ответ сервиса - только для трасс, выбранных LOG_PAYLOAD_SAMPLE_RATE"""
+    trace = _current.get()
+    if trace is None or not trace.sampled:
+        return
+    from utils.logger import logger
+    if settings.log_format == "json":
+        logger.bind(payload=payload).info(message)
+    else:
+        logger.info(f"{message}: {payload}")